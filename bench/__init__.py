@@ -0,0 +1,3 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+# flake8: noqa
@@ -0,0 +1,92 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+Benchmark ChatLog archival throughput, and reading logs before and after.
+
+    python3 -m bench.archive [days]
+"""
+
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from edi.db import EdiDb
+from edi.units.chatlog import LogArchiver, LogIndex, log_files, open_log
+
+DAYS = 60
+CHANNELS = 8
+LINES = 1000
+WORDS = "lorem ipsum dolor sit amet the quick brown fox jumps over lazy dog".split()
+
+
+def populate(root: Path, days: int) -> int:
+    rng = random.Random(42)
+    today = datetime.now()
+    total = 0
+    for c in range(CHANNELS):
+        channel = root / "team" / f"channel{c}"
+        channel.mkdir(parents=True)
+        for d in range(days):
+            date = (today - timedelta(days=d)).strftime(r"%Y-%m-%d")
+            lines = [
+                f"[12:{i % 60:02d}:00] <user{rng.randrange(50)}> "
+                + " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+                + "\n"
+                for i in range(LINES)
+            ]
+            data = "".join(lines)
+            (channel / f"{date}.log").write_text(data)
+            total += len(data)
+    return total
+
+
+def read_all(root: Path) -> float:
+    before = time.perf_counter()
+    for path in log_files(root):
+        with open_log(path) as fd:
+            for _line in fd:
+                pass
+    return time.perf_counter() - before
+
+
+async def archive(root: Path, workers: int) -> None:
+    db = EdiDb(str(root / "edi.db"))
+    await db.start()
+    index = LogIndex(db, root)
+    await index.start()
+    await index.update()
+
+    archiver = LogArchiver(root, index, days=7, workers=workers)
+    before = time.perf_counter()
+    count = await archiver.run_once()
+    elapsed = time.perf_counter() - before
+    archiver.stop()
+    await db.stop()
+
+    print(
+        f"{workers} workers: archived {count} files in {elapsed:.2f}s, "
+        f"{archiver.usage['plain'] / 1e6:.1f} MB plain, "
+        f"{archiver.usage['archived'] / 1e6:.1f} MB archived"
+    )
+
+
+def main(days: int) -> None:
+    for workers in (1, 4):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            total = populate(root, days)
+            if workers == 1:
+                print(f"{CHANNELS * days} log files, {total / 1e6:.1f} MB")
+                print(f"read plain:    {read_all(root):.2f}s")
+            asyncio.get_event_loop().run_until_complete(archive(root, workers))
+            if workers == 1:
+                print(f"read archived: {read_all(root):.2f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DAYS)
@@ -0,0 +1,108 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+Micro-benchmark for per-message command recognition in Edi.command.
+
+Compares running the full command regex against every message with the
+mention pre-filter and compiled command index.
+
+    python3 -m bench.commands
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Any, List
+
+from aioslack import Channel, Event, User
+
+from edi import Edi
+from edi.config import Config
+from edi.core import COMMANDS, CommandIndex
+
+ME_NAME = "edi"
+ME_ID = "U0EDI0000"
+MESSAGES = 100_000
+ADDRESSED = 0.02
+
+WORDS = "the quick brown fox jumps over lazy dog lorem ipsum dolor sit amet".split()
+
+
+class FakeSlack:
+    def __init__(self) -> None:
+        self.me = Event.generate({"id": ME_ID, "name": ME_NAME})
+        self.users = {"U0000000": User(id="U0000000", team_id="T0", name="user")}
+        self.channels = {"C0000000": Channel(id="C0000000", name="general")}
+
+
+def generate_events(count: int, addressed: float) -> List[Any]:
+    rng = random.Random(42)
+    events = []
+    for _ in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+        if rng.random() < addressed:
+            text = f"<@{ME_ID}> unknowncommand {text}"
+        events.append(
+            Event.generate(
+                {
+                    "type": "message",
+                    "channel": "C0000000",
+                    "user": "U0000000",
+                    "ts": f"{time.time():.6f}",
+                    "text": text,
+                }
+            )
+        )
+    return events
+
+
+def baseline(edi: Edi, events: List[Any]) -> float:
+    """Previous behavior: full regex and dict lookup on every message."""
+    before = time.perf_counter()
+    for event in events:
+        if event.type != "message" or "subtype" in event or "bot_user" in event:
+            continue
+        match = edi.command_re.match(event.text)
+        if not match:
+            continue
+        command = match[2].strip().lower()
+        if command not in COMMANDS:
+            continue
+    return time.perf_counter() - before
+
+
+async def current(edi: Edi, events: List[Any]) -> float:
+    before = time.perf_counter()
+    for event in events:
+        await edi.command(event)
+    return time.perf_counter() - before
+
+
+def main() -> None:
+    logging.disable(logging.WARNING)
+    edi = Edi(Config())
+    edi.slack = FakeSlack()
+    edi.command_re = re.compile(
+        r"^\s*"
+        rf"(?P<name>@?{ME_NAME}|<@{ME_ID}>)[:,]?"
+        r"\s+(?P<command>\w+)(?P<args>.*)$"
+    )
+    edi.command_prefixes = (ME_NAME, f"@{ME_NAME}", f"<@{ME_ID}>")
+    edi.commands = CommandIndex(COMMANDS)
+
+    events = generate_events(MESSAGES, ADDRESSED)
+    loop = asyncio.new_event_loop()
+
+    old = baseline(edi, events)
+    new = loop.run_until_complete(current(edi, events))
+
+    print(f"{MESSAGES} messages, {ADDRESSED:.0%} addressed to the bot")
+    print(f"baseline: {old / MESSAGES * 1e6:8.2f} µs/message")
+    print(f"current:  {new / MESSAGES * 1e6:8.2f} µs/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+In-process stand-in for the Slack web and RTM APIs.
+
+FakeSlack serves the subset of the web API used by Edi, plus an RTM websocket
+that replays queued events, over TLS on localhost.  `FakeSlack.client()` returns
+a subclass of aioslack's Slack whose session resolves slack.com to the fake
+server, so the bot code under test runs unmodified.
+"""
+
+import asyncio
+import json
+import socket
+import ssl
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Type
+
+import aiohttp
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+
+from aioslack import Slack
+
+HOST = "slack.com"
+
+
+class FakeResolver(AbstractResolver):
+    """Resolve slack.com to the local fake server."""
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+
+    async def resolve(
+        self, host: str, port: int = 0, family: int = socket.AF_INET
+    ) -> List[Dict[str, Any]]:
+        if host != HOST:
+            raise OSError(f"fake resolver only knows {HOST}, not {host}")
+        return [
+            {
+                "hostname": host,
+                "host": "127.0.0.1",
+                "port": self.port,
+                "family": socket.AF_INET,
+                "proto": 0,
+                "flags": socket.AI_NUMERICHOST,
+            }
+        ]
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeSlack:
+    """Local Slack server, replaying events from `queue` to RTM clients."""
+
+    def __init__(
+        self,
+        me: Dict[str, Any],
+        team: Dict[str, Any],
+        users: List[Dict[str, Any]],
+        channels: List[Dict[str, Any]],
+    ) -> None:
+        self.me = me
+        self.team = team
+        self.users = users
+        self.channels = channels
+
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.history: Dict[str, List[Dict[str, Any]]] = {}
+        self.posted: List[Dict[str, Any]] = []
+        self.calls: Dict[str, int] = {}
+        self.connections = 0
+        self.ratelimited = 0  # reject this many posts with 429 before accepting
+
+        self.port = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def ssl_context(self) -> ssl.SSLContext:
+        """Generate a throwaway self-signed certificate for the server."""
+        cert = Path(self.tmpdir.name) / "cert.pem"
+        key = Path(self.tmpdir.name) / "key.pem"
+        subprocess.run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-days",
+                "1",
+                "-subj",
+                f"/CN={HOST}",
+                "-keyout",
+                str(key),
+                "-out",
+                str(cert),
+            ],
+            check=True,
+            capture_output=True,
+        )
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(str(cert), str(key))
+        return context
+
+    async def start(self) -> int:
+        app = web.Application()
+        app.router.add_post("/api/{method}", self.api)
+        app.router.add_get("/rtm", self.rtm)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0, ssl_context=self.ssl_context())
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        return self.port
+
+    async def stop(self) -> None:
+        self.disconnect()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        self.tmpdir.cleanup()
+
+    def client(self) -> Type[Slack]:
+        """Return a Slack subclass that connects to this server."""
+        port = self.port
+
+        class LocalSlack(Slack):
+            def __init__(self, token: str) -> None:
+                super().__init__(token)
+                asyncio.ensure_future(self.session.close())
+                self.session = aiohttp.ClientSession(
+                    headers={"Authorization": f"Bearer {self.token}"},
+                    connector=aiohttp.TCPConnector(
+                        resolver=FakeResolver(port), ssl=False
+                    ),
+                )
+
+        return LocalSlack
+
+    def send(self, *events: Dict[str, Any]) -> None:
+        """Queue events to be sent over RTM, to be remembered for history once sent."""
+        for event in events:
+            self.queue.put_nowait(event)
+
+    def miss(self, *events: Dict[str, Any]) -> None:
+        """Add messages to history without sending them, as if sent during an outage."""
+        for event in events:
+            self.history.setdefault(event["channel"], []).append(event)
+
+    def disconnect(self) -> None:
+        """Close the current RTM connection after queued events are sent."""
+        self.queue.put_nowait(None)
+
+    async def api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        response: Dict[str, Any] = {"ok": True}
+        if method == "rtm.start":
+            response.update(
+                {
+                    "self": self.me,
+                    "team": self.team,
+                    "users": self.users,
+                    "channels": self.channels,
+                    "groups": [],
+                    "url": f"wss://{HOST}/rtm",
+                }
+            )
+        elif method == "rtm.connect":
+            response.update(
+                {"self": self.me, "team": self.team, "url": f"wss://{HOST}/rtm"}
+            )
+        elif method == "chat.postMessage":
+            if self.ratelimited > 0:
+                self.ratelimited -= 1
+                return web.json_response(
+                    {"ok": False, "error": "ratelimited"},
+                    status=429,
+                    headers={"Retry-After": "1"},
+                )
+            self.posted.append(params)
+            response.update({"channel": params.get("channel"), "ts": "0"})
+        elif method in ("channels.history", "conversations.history"):
+            response.update(self.channel_history(params))
+        return web.json_response(response)
+
+    def channel_history(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        messages = self.history.get(str(params.get("channel", "")), [])
+        oldest = float(params.get("oldest", 0) or 0)
+        latest = float(params.get("cursor") or params.get("latest") or 0)
+        latest = latest or float("inf")
+        inclusive = str(params.get("inclusive", "")).lower() in ("1", "true")
+        count = int(params.get("limit") or params.get("count") or 100)
+
+        def within(ts: float) -> bool:
+            if inclusive:
+                return oldest <= ts <= latest
+            return oldest < ts < latest
+
+        found = [m for m in messages if within(float(m["ts"]))]
+        found.sort(key=lambda m: float(m["ts"]), reverse=True)
+        has_more = len(found) > count
+        return {
+            "messages": found[:count],
+            "has_more": has_more,
+            "response_metadata": {
+                "next_cursor": found[count - 1]["ts"] if has_more else ""
+            },
+        }
+
+    async def rtm(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+
+        await ws.send_str(json.dumps({"type": "hello"}))
+        while True:
+            event = await self.queue.get()
+            if event is None:
+                break
+            if event.get("type") == "message" and "channel" in event:
+                self.history.setdefault(event["channel"], []).append(event)
+            await ws.send_str(json.dumps(event))
+
+        await ws.close()
+        return ws
@@ -0,0 +1,86 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+Benchmark quote insert throughput for different QuoteDB settings.
+
+    python3 -m bench.grabs [count] [directory]
+
+Databases are created in a temporary directory, inside `directory` if given;
+use one on the disk the bot will run on, as the cost of fsync dominates.
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from edi.db import EdiDb
+from edi.units.quotes import Quote, QuoteDB
+
+COUNT = 2000
+CONCURRENCY = 20
+
+SETTINGS: Dict[str, Dict[str, Any]] = {
+    "rollback journal": dict(journal_mode="delete", synchronous="full"),
+    "wal, synchronous=full": dict(journal_mode="wal", synchronous="full"),
+    "wal, full, write_delay=5ms": dict(
+        journal_mode="wal", synchronous="full", write_delay=0.005
+    ),
+    "wal, synchronous=normal": dict(journal_mode="wal", synchronous="normal"),
+    "wal, normal, write_delay=5ms": dict(
+        journal_mode="wal", synchronous="normal", write_delay=0.005
+    ),
+}
+
+
+async def grab(qdb: QuoteDB, count: int, latencies: List[float]) -> None:
+    for i in range(count):
+        before = time.perf_counter()
+        qid = await qdb.add(Quote.new("general", "user", "grabber", f"quote {i}"))
+        latencies.append(time.perf_counter() - before)
+        assert qid > 0
+
+
+async def run(
+    path: Path, count: int, settings: Dict[str, Any]
+) -> Tuple[float, List[float]]:
+    settings = dict(settings)
+    write_delay = settings.pop("write_delay", 0.0)
+    db = EdiDb(str(path), **settings)
+    await db.start()
+    qdb = QuoteDB(db, write_delay=write_delay)
+    await qdb.start()
+    latencies: List[float] = []
+    before = time.perf_counter()
+    await asyncio.gather(
+        *[grab(qdb, count // CONCURRENCY, latencies) for _ in range(CONCURRENCY)]
+    )
+    await qdb.stop()
+    elapsed = time.perf_counter() - before
+    await db.stop()
+    return elapsed, sorted(latencies)
+
+
+async def main(count: int, directory: Optional[str]) -> None:
+    print(f"{count} grabs from {CONCURRENCY} concurrent users")
+    for name, settings in SETTINGS.items():
+        with tempfile.TemporaryDirectory(dir=directory) as tmp:
+            elapsed, latencies = await run(Path(tmp) / "quotes.db", count, settings)
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[len(latencies) * 99 // 100] * 1000
+            print(
+                f"{name:>30}: {count / elapsed:8.0f} grabs/s, "
+                f"p50 {p50:.2f} ms, p99 {p99:.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else COUNT,
+            sys.argv[2] if len(sys.argv) > 2 else None,
+        )
+    )
@@ -0,0 +1,100 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+Benchmark dispatch latency with synchronous vs queued log handlers.
+
+    python3 -m bench.logs [events]
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from aioslack import Event
+
+from edi import Context, Edi, Unit
+from edi.config import Config
+from edi.log import init_logger, stop_logger
+
+EVENTS = 20_000
+
+log = logging.getLogger(__name__)
+
+
+class Chatty(Unit):
+    async def on_message(self, event: Event) -> None:
+        log.info("[%s] #%s <%s> %s", event.ts, event.channel, event.user, event.text)
+
+
+def reset_logging() -> None:
+    stop_logger()
+    root = logging.getLogger("")
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def sync_logger(file_path: str) -> None:
+    """Previous behavior: handlers attached directly to the root logger."""
+    root = logging.getLogger("")
+    root.setLevel(logging.INFO)
+    for handler in (logging.StreamHandler(sys.stdout), logging.FileHandler(file_path)):
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        root.addHandler(handler)
+
+
+async def measure(edi: Edi, events: List[Event]) -> List[float]:
+    latencies = []
+    for event in events:
+        before = time.perf_counter()
+        await edi.dispatch(event)
+        latencies.append(time.perf_counter() - before)
+    return sorted(latencies)
+
+
+def main(count: int) -> None:
+    edi = Edi(Config())
+    edi.units = {Chatty: Chatty(None)}
+    edi.build_routes()
+    edi.command = lambda event, context: asyncio.sleep(0)  # type: ignore
+    edi.context = Context  # type: ignore
+    events = [
+        Event.generate(
+            {"type": "message", "ts": f"{i}.000", "user": "U0", "text": f"hello {i}"}
+        )
+        for i in range(count)
+    ]
+
+    loop = asyncio.get_event_loop()
+    stdout = sys.stdout
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        results = {}
+        sys.stdout = devnull
+        try:
+            sync_logger(str(Path(tmp) / "sync.log"))
+            results["synchronous handlers"] = loop.run_until_complete(
+                measure(edi, events)
+            )
+            reset_logging()
+
+            init_logger(stdout=True, file_path=str(Path(tmp) / "queued.log"))
+            results["queued handlers"] = loop.run_until_complete(measure(edi, events))
+            reset_logging()
+        finally:
+            sys.stdout = stdout
+
+    print(f"{count} message events dispatched")
+    for name, latencies in results.items():
+        p50 = latencies[len(latencies) // 2] * 1e6
+        p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+        print(f"{name:>22}: p50 {p50:7.1f} µs, p99 {p99:7.1f} µs")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else EVENTS)
@@ -0,0 +1,109 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+Benchmark random quote selection against a large synthetic quotes table.
+
+    python3 -m bench.quotes [rows]
+"""
+
+import asyncio
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from edi.db import EdiDb
+from edi.units.quotes import QuoteDB
+
+ROWS = 1_000_000
+CHANNELS = ["general", "random", "dev"]
+USERS = [f"user{i}" for i in range(200)]
+SAMPLES = 50
+
+
+def populate(path: Path, rows: int) -> None:
+    db = sqlite3.connect(str(path))
+    db.execute(
+        """
+        CREATE TABLE quotes (
+            id INTEGER PRIMARY KEY,
+            channel TEXT,
+            username TEXT,
+            added_by TEXT,
+            added_at TIMESTAMP,
+            quote TEXT
+        )
+        """
+    )
+    rng = random.Random(42)
+    db.executemany(
+        "INSERT INTO quotes VALUES (NULL, ?, ?, ?, ?, ?)",
+        (
+            (
+                rng.choice(CHANNELS),
+                rng.choice(USERS),
+                rng.choice(USERS),
+                "2018-01-01 00:00:00",
+                f"synthetic quote number {i}",
+            )
+            for i in range(rows)
+        ),
+    )
+    db.commit()
+    db.close()
+
+
+async def order_by_random(qdb: QuoteDB, samples: int) -> float:
+    """Previous implementation of QuoteDB.random."""
+    query = """
+        SELECT * FROM quotes
+        WHERE channel = ?
+        ORDER BY random()
+        LIMIT 1
+    """
+    before = time.perf_counter()
+    for _ in range(samples):
+        await qdb.db.fetchone(query, ["general"])
+    return (time.perf_counter() - before) / samples
+
+
+async def sampled(qdb: QuoteDB, samples: int) -> float:
+    before = time.perf_counter()
+    for _ in range(samples):
+        await qdb.random("general")
+    return (time.perf_counter() - before) / samples
+
+
+async def main(rows: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "quotes.db"
+        print(f"populating {rows} quotes...")
+        populate(path, rows)
+
+        db = EdiDb(str(path))
+        await db.start()
+        for shuffle in (False, True):
+            qdb = QuoteDB(db, shuffle=shuffle)
+            await qdb.start()
+
+            if not shuffle:
+                old = await order_by_random(qdb, SAMPLES)
+                print(f"ORDER BY random(): {old * 1000:8.2f} ms/quote")
+
+            before = time.perf_counter()
+            await qdb.quote_ids("general")
+            load = time.perf_counter() - before
+            new = await sampled(qdb, SAMPLES * 20)
+            mode = "shuffle" if shuffle else "random"
+            print(f"{mode:>17}: {new * 1000:8.2f} ms/quote ({load * 1000:.0f} ms load)")
+
+        await db.stop()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
+    )
@@ -0,0 +1,274 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+Replay recorded or synthetic RTM event streams through Edi.run.
+
+Edi connects to an in-process fake Slack server, which floods it with events;
+each event's dispatch latency is recorded, and throughput and latency
+percentiles are reported once every event has been dispatched.
+
+    python3 -m bench.replay --scenario mixed --events 20000
+    python3 -m bench.replay --replay recorded.jsonl --workers 4
+    python3 -m bench.replay --reconnects 3 --missed 50
+"""
+
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import click
+
+import edi.bot
+from aioslack import Event
+from edi import Edi
+from edi.config import Config
+from edi.metrics import METRICS
+
+from .fake_slack import FakeSlack
+
+ME = {"id": "UEDI00000", "name": "edi"}
+TEAM = {"id": "T00000000", "name": "bench"}
+CHANNELS = 8
+USERS = 50
+WORDS = "the quick brown fox jumps over lazy dog lorem ipsum dolor sit amet".split()
+
+
+class Generator:
+    """Synthetic event streams resembling a busy workspace."""
+
+    def __init__(self, seed: int = 42) -> None:
+        self.rng = random.Random(seed)
+        self.ts = time.time() - 3600
+        self.users = [f"U{i:08d}" for i in range(USERS)]
+        self.channels = [f"C{i:08d}" for i in range(CHANNELS)]
+        self.sent: List[Dict[str, Any]] = []
+        self.archive: List[Dict[str, Any]] = []  # history only, not sent over RTM
+
+    def next_ts(self) -> str:
+        self.ts += 0.001
+        return f"{self.ts:.6f}"
+
+    def text(self) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(3, 25)))
+
+    def message(self, text: str = "") -> Dict[str, Any]:
+        event = {
+            "type": "message",
+            "channel": self.rng.choice(self.channels),
+            "user": self.rng.choice(self.users),
+            "text": text or self.text(),
+            "ts": self.next_ts(),
+        }
+        self.sent.append(event)
+        return event
+
+    def reaction(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "type": "reaction_added",
+            "user": self.rng.choice(self.users),
+            "reaction": self.rng.choice(["+1", "joy", "eyes", "tada"]),
+            "item": {
+                "type": "message",
+                "channel": message["channel"],
+                "ts": message["ts"],
+            },
+            "event_ts": self.next_ts(),
+        }
+
+    def command(self) -> Dict[str, Any]:
+        name = self.rng.choice(
+            ["hello", "help", "quote", f"grab <@{self.rng.choice(self.users)}>"]
+        )
+        return self.message(f"<@{ME['id']}> {name}")
+
+    def messages(self, count: int) -> List[Dict[str, Any]]:
+        return [self.message() for _ in range(count)]
+
+    def reactions(self, count: int) -> List[Dict[str, Any]]:
+        """Reactions to a mix of recent messages and older ones from history."""
+        self.archive = self.messages(max(1, count // 10))
+        self.sent = []
+        events = self.messages(max(1, count // 10))
+        events.extend(
+            self.reaction(self.rng.choice(self.archive if i % 2 else self.sent))
+            for i in range(count)
+        )
+        return events
+
+    def commands(self, count: int) -> List[Dict[str, Any]]:
+        return [self.command() for _ in range(count)]
+
+    def mixed(self, count: int) -> List[Dict[str, Any]]:
+        events = []
+        while len(events) < count:
+            roll = self.rng.random()
+            if roll < 0.85 or not self.sent:
+                events.append(self.message())
+            elif roll < 0.97:
+                events.append(self.reaction(self.rng.choice(self.sent)))
+            else:
+                events.append(self.command())
+        return events
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def replay(
+    events: List[Dict[str, Any]],
+    archive: List[Dict[str, Any]],
+    workers: int,
+    root: Path,
+    reconnects: int = 0,
+    missed: int = 0,
+) -> None:
+    server = FakeSlack(
+        me=ME,
+        team=TEAM,
+        users=[
+            {"id": f"U{i:08d}", "team_id": TEAM["id"], "name": f"user{i}"}
+            for i in range(USERS)
+        ]
+        + [{"id": ME["id"], "team_id": TEAM["id"], "name": ME["name"]}],
+        channels=[
+            {"id": f"C{i:08d}", "name": f"channel{i}", "is_member": True}
+            for i in range(CHANNELS)
+        ],
+    )
+    for message in archive:
+        server.history.setdefault(message["channel"], []).append(message)
+    await server.start()
+    edi.bot.Slack = server.client()  # type: ignore
+
+    config = Config(
+        tables={},
+        content={
+            "bot": {
+                "token": "xoxb-bench",
+                "dispatch_workers": workers,
+                "db_path": str(root / "edi.db"),
+                # the fake server has no rate limits to respect
+                "backfill_interval": 0.001,
+            },
+            "units": {"disable_units": ["Twitter"]},
+            "chatlog": {"root": str(root / "logs")},
+        },
+    )
+    bot = Edi(config)
+
+    expected = len(events)
+    latencies: List[float] = []
+    done = asyncio.Event()
+    dispatch = bot.dispatch
+
+    async def timed_dispatch(event: Event) -> None:
+        before = time.perf_counter()
+        await dispatch(event)
+        if event.type != "hello":
+            latencies.append(time.perf_counter() - before)
+            if len(latencies) >= expected:
+                done.set()
+
+    bot.dispatch = timed_dispatch  # type: ignore
+
+    task = asyncio.ensure_future(bot.run())
+    started = time.perf_counter()
+    chunk = len(events) // (reconnects + 1) + 1
+    for i in range(0, len(events), chunk):
+        if i:
+            server.disconnect()
+            # messages sent while disconnected only reach the bot through backfill
+            gap = [e for e in events[i : i + chunk] if e["type"] == "message"][:missed]
+            server.miss(*gap)
+            server.send(*[e for e in events[i : i + chunk] if e not in gap])
+        else:
+            server.send(*events[i : i + chunk])
+    await done.wait()
+    elapsed = time.perf_counter() - started
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    if bot.pool is not None:
+        await bot.pool.stop()
+    await bot.sender.stop()
+    await asyncio.gather(*[unit.stop() for unit in bot.units.values()])
+    await bot.db.stop()
+    await bot.slack.close()
+    await server.stop()
+
+    latencies.sort()
+    print(f"{expected} events in {elapsed:.2f}s: {expected / elapsed:.0f} events/s")
+    print(
+        f"dispatch latency: p50 {percentile(latencies, 0.5) * 1000:.3f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.3f} ms, "
+        f"max {latencies[-1] * 1000:.3f} ms"
+    )
+    print(f"api calls: {server.calls}")
+    reconnect = METRICS.histogram("edi_reconnect_seconds")
+    if reconnect.count:
+        print(
+            f"reconnects: {reconnect.count}, "
+            f"mean {reconnect.sum / reconnect.count * 1000:.3f} ms"
+        )
+    backfill = METRICS.histogram("edi_backfill_seconds")
+    if backfill.count:
+        replayed = METRICS.counters.get("edi_backfill_messages_total", {}).get((), 0)
+        print(
+            f"backfilled {int(replayed)} messages in {backfill.count} runs, "
+            f"mean {backfill.sum / backfill.count * 1000:.3f} ms"
+        )
+
+
+@click.command("replay")
+@click.option(
+    "--scenario",
+    type=click.Choice(["messages", "reactions", "commands", "mixed"]),
+    default="mixed",
+    help="synthetic event stream to generate",
+)
+@click.option("--events", "count", default=10_000, help="number of events")
+@click.option(
+    "--replay",
+    "path",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON lines file of recorded RTM events to replay instead",
+)
+@click.option("--workers", default=0, help="bot.dispatch_workers")
+@click.option("--reconnects", default=0, help="drop the RTM connection N times")
+@click.option("--missed", default=0, help="messages missed during each outage")
+@click.option("--debug", is_flag=True, help="show bot logging")
+def main(
+    scenario: str,
+    count: int,
+    path: Optional[str],
+    workers: int,
+    reconnects: int,
+    missed: int,
+    debug: bool,
+) -> None:
+    """Benchmark Edi against a fake Slack server."""
+    logging.basicConfig(level=logging.DEBUG if debug else logging.CRITICAL)
+
+    generator = Generator()
+    if path:
+        with open(path) as fd:
+            events = [json.loads(line) for line in fd if line.strip()]
+    else:
+        events = getattr(generator, scenario)(count)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.get_event_loop().run_until_complete(
+            replay(events, generator.archive, workers, Path(tmp), reconnects, missed)
+        )
+
+
+if __name__ == "__main__":
+    main()
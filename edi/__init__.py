@@ -4,8 +4,9 @@
 
 """Simple and elegant Slack bot."""
 
+from .startup import PROFILE  # start timing before importing anything else
 from .bot import Edi
-from .core import Unit, command
+from .core import Context, Unit, command, offload
 from .config import Config
 
 __version__ = "0.5.0"
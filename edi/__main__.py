@@ -1,10 +1,13 @@
 # Copyright 2017 John Reese
 # Licensed under the MIT license
 
+import time
+
 import click
 
 from .bot import init_from_config
 from .config import Config
+from .startup import PROFILE
 
 
 @click.command("edi")
@@ -21,22 +24,38 @@ from .config import Config
     type=click.Path(exists=False, resolve_path=True, dir_okay=False, writable=True),
     help="path to log program output",
 )
+@click.option(
+    "--startup-profile", is_flag=True, help="report time spent on each startup phase"
+)
+@click.option(
+    "--supervise",
+    is_flag=True,
+    help="run each of the config's [workspaces.*] in its own process",
+)
 @click.option("--version", "-V", is_flag=True, help="show version and exit")
 def init_from_cli(
-    debug: bool = False, config: str = "", log: str = "", version: bool = False
+    debug: bool = False,
+    config: str = "",
+    log: str = "",
+    startup_profile: bool = False,
+    supervise: bool = False,
+    version: bool = False,
 ) -> None:
     """Simple Slack Bot"""
 
+    PROFILE.add("import edi", time.perf_counter() - PROFILE.created)
+
     if version:
         from edi import __version__
 
         print(f"edi v{__version__}")
         return
 
-    if config is not None:
-        cfg = Config.load_from_file(config)
-    else:
-        cfg = Config.load_defaults()
+    with PROFILE.measure("config"):
+        if config is not None:
+            cfg = Config.load_from_file(config)
+        else:
+            cfg = Config.load_defaults()
 
     if log is not None:
         cfg.bot.log = log
@@ -44,6 +63,18 @@ def init_from_cli(
     if debug:
         cfg.bot.debug = True
 
+    if startup_profile:
+        cfg.bot.startup_profile = True
+
+    if supervise:
+        if config is None:
+            raise click.UsageError("--supervise requires --config")
+
+        from .supervisor import supervise as run_supervisor
+
+        run_supervisor(config, cfg)
+        return
+
     init_from_config(cfg)
 
 
@@ -0,0 +1,222 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from aioslack import Event, SlackError
+
+from .metrics import METRICS
+from .sender import RateLimited
+
+log = logging.getLogger(__name__)
+
+Api = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+class Backfill:
+    """
+    Fetch and replay the messages missed while disconnected from RTM.
+
+    The newest message `ts` seen in each channel is tracked as events arrive.
+    After a reconnect, each channel's history from then until the reconnect is
+    paged through, with at most `concurrency` channels fetching at once, and no
+    more than one request every `interval` seconds, honoring Retry-After.
+    Messages are dispatched oldest first with `replayed` set on the event, and
+    duplicates are dropped by ts in both directions: replayed messages already
+    seen live, and live messages that were already replayed.
+    """
+
+    def __init__(
+        self,
+        api: Api,
+        dispatch: Callable[[Event], Awaitable[None]],
+        *,
+        concurrency: int = 2,
+        interval: float = 1.2,
+        pages: int = 10,
+        page_size: int = 200,
+        retries: int = 3,
+    ) -> None:
+        self.api = api
+        self.dispatch = dispatch
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self.pages = pages
+        self.page_size = page_size
+        self.retries = retries
+
+        self.last_seen: Dict[str, str] = {}
+        self.live: Optional[Dict[str, Set[str]]] = None
+        self.replayed: Dict[str, Set[str]] = {}
+        self.next_request = 0.0
+        self.pending: Optional[Tuple[Dict[str, str], str]] = None
+        self.task: Optional[asyncio.Future] = None
+
+    def observe(self, event: Event) -> bool:
+        """Record a message received live, returning False if already replayed."""
+        if event.type != "message":
+            return True
+
+        channel = getattr(event, "channel", None)
+        ts = getattr(event, "ts", None)
+        if not isinstance(channel, str) or not isinstance(ts, str):
+            return True
+
+        if self.replayed and ts in self.replayed.get(channel, ()):
+            METRICS.increment("edi_backfill_duplicates_total")
+            return False
+
+        # ts values are fixed width, so they sort correctly as strings
+        if ts > self.last_seen.get(channel, ""):
+            self.last_seen[channel] = ts
+        if self.live is not None:
+            self.live.setdefault(channel, set()).add(ts)
+        return True
+
+    def start(self) -> None:
+        """Begin filling the gap since the last message seen in each channel."""
+        since = dict(self.last_seen)
+        latest = f"{time.time():.6f}"
+        if self.task is not None and not self.task.done():
+            # another outage before the last gap was filled; fill this one after
+            self.pending = (since, latest)
+            return
+
+        if since:
+            # RTM delivers each channel in order, so only replayed messages newer
+            # than the last live one could still arrive live
+            self.replayed = {
+                channel: {ts for ts in replayed if ts > since.get(channel, "")}
+                for channel, replayed in self.replayed.items()
+            }
+            self.live = {}
+            self.task = asyncio.ensure_future(self.run(since, latest))
+
+    async def stop(self) -> None:
+        self.pending = None
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self, since: Dict[str, str], latest: str) -> None:
+        try:
+            while True:
+                await self.fill(since, latest)
+                if self.pending is None:
+                    break
+                since, latest = self.pending
+                self.pending = None
+        finally:
+            self.live = None
+
+    async def fill(self, since: Dict[str, str], latest: str) -> None:
+        before = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def channel(channel: str, oldest: str) -> int:
+            async with semaphore:
+                messages = await self.history(channel, oldest, latest)
+            return await self.replay(channel, messages)
+
+        results = await asyncio.gather(
+            *[channel(c, ts) for c, ts in since.items()], return_exceptions=True
+        )
+
+        count = 0
+        for result in results:
+            if isinstance(result, BaseException):
+                log.error(f"backfill failed: {result}")
+            else:
+                count += result
+
+        elapsed = time.perf_counter() - before
+        METRICS.observe("edi_backfill_seconds", elapsed)
+        log.info(
+            f"backfilled {count} messages in {len(since)} channels in {elapsed:.2f}s"
+        )
+
+    async def pace(self) -> None:
+        """Wait for our turn, spacing requests from all channels `interval` apart."""
+        now = time.monotonic()
+        wait = self.next_request - now
+        self.next_request = max(now, self.next_request) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def request(self, **kwargs: Any) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            await self.pace()
+            try:
+                METRICS.increment("edi_backfill_requests_total")
+                return await self.api("conversations.history", **kwargs)
+
+            except RateLimited as e:
+                METRICS.increment("edi_backfill_ratelimited_total")
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                log.warning(f"rate limited fetching history, waiting {e.retry_after}s")
+                self.next_request = max(
+                    self.next_request, time.monotonic() + e.retry_after
+                )
+
+    async def history(
+        self, channel: str, oldest: str, latest: str
+    ) -> Dict[str, Dict[str, Any]]:
+        """Fetch messages between `oldest` and `latest`, keyed by ts."""
+        messages: Dict[str, Dict[str, Any]] = {}
+        cursor = ""
+        for _page in range(self.pages):
+            kwargs = {
+                "channel": channel,
+                "oldest": oldest,
+                "latest": latest,
+                "limit": self.page_size,
+            }
+            if cursor:
+                kwargs["cursor"] = cursor
+
+            try:
+                response = await self.request(**kwargs)
+            except SlackError as e:
+                log.warning(f"could not fetch history for {channel}: {e}")
+                break
+
+            for message in response.get("messages", []):
+                messages.setdefault(message["ts"], message)
+
+            cursor = response.get("response_metadata", {}).get("next_cursor", "")
+            if not response.get("has_more") or not cursor:
+                break
+
+        else:
+            log.warning(f"backfill for {channel} stopped after {self.pages} pages")
+
+        return messages
+
+    async def replay(self, channel: str, messages: Dict[str, Dict[str, Any]]) -> int:
+        """Dispatch fetched messages in order, skipping those seen live."""
+        live = self.live.setdefault(channel, set()) if self.live is not None else set()
+        replayed = self.replayed.setdefault(channel, set())
+        count = 0
+        for ts in sorted(messages, key=float):
+            if ts in live or ts in replayed:
+                METRICS.increment("edi_backfill_duplicates_total")
+                continue
+
+            replayed.add(ts)
+            data = dict(messages[ts], channel=channel, replayed=True)
+            data.setdefault("type", "message")
+            if ts > self.last_seen.get(channel, ""):
+                self.last_seen[channel] = ts
+
+            await self.dispatch(Event.generate(data, recursive=False))
+            METRICS.increment("edi_backfill_messages_total")
+            count += 1
+
+        return count
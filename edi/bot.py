@@ -5,15 +5,49 @@ import asyncio
 import logging
 import re
 import signal
-from typing import Dict, Optional, Type
-
+import time
+from concurrent.futures import Future
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from aiohttp import ClientError
+from attr import fields_dict
 from ent import Singleton
 
 from aioslack import Event, Slack, SlackError
+from aioslack.types import Auto, Channel, Group, User
 
+from .backfill import Backfill
 from .config import Config
-from .core import COMMANDS, Unit, materialize_commands
+from .core import (
+    COMMANDS,
+    RESPONSES,
+    CommandIndex,
+    Context,
+    ContextHandler,
+    Handler,
+    Unit,
+    accepts_context,
+    backoff,
+    materialize_commands,
+    with_context,
+)
+from .db import EdiDb
+from .executors import Executors
 from .log import init_logger
+from .metrics import METRICS
+from .pool import WorkerPool
+from .sender import Sender
+from .startup import PROFILE
 from .units import import_units
 
 try:
@@ -24,6 +58,29 @@ except ImportError:
 
 log = logging.getLogger(__name__)
 
+A = TypeVar("A", bound=Auto)
+
+
+def build(cls: Type[A], data: Mapping[str, Any]) -> A:
+    """
+    Build a directory entry from an event payload.
+
+    Auto.build() fails on mappings in fields not typed as a class, like the
+    `latest` message of a joined channel, so those keep their defaults.
+    """
+    types = fields_dict(cls)
+    return cls.build(
+        {
+            key: value
+            for key, value in data.items()
+            if not (
+                isinstance(value, Mapping)
+                and key in types
+                and not isinstance(types[key].type, type)
+            )
+        }
+    )
+
 
 class Edi(metaclass=Singleton):
     """Main event framework for the bot."""
@@ -33,8 +90,38 @@ class Edi(metaclass=Singleton):
     def __init__(self, config: Config = None) -> None:
         self.config = config or Config()
         self.units: Dict[Type[Unit], Unit] = {}
+        self.routes: Dict[str, List[ContextHandler]] = {}
+        self.default_routes: List[Tuple[Unit, Handler]] = []
         self.task: Optional[asyncio.Future] = None
+        self.pool: Optional[WorkerPool] = None
         self.command_re = re.compile(r"^@_$")
+        self.command_prefixes: Tuple[str, ...] = ()
+        self.commands = CommandIndex({})
+        RESPONSES.maxsize = self.config.bot.command_cache_size
+        self.db = EdiDb(
+            self.config.bot.db_path,
+            readers=self.config.bot.db_readers,
+            journal_mode=self.config.bot.db_journal_mode,
+            synchronous=self.config.bot.db_synchronous,
+            cache_size=self.config.bot.db_cache_size,
+        )
+        self.executors = Executors(
+            threads=self.config.bot.executor_threads,
+            processes=self.config.bot.executor_processes,
+        )
+        self.sender = Sender(
+            lambda: self.slack,
+            interval=self.config.bot.post_interval,
+            coalesce=self.config.bot.post_coalesce,
+            retries=self.config.bot.post_retries,
+        )
+        self.backfill = Backfill(
+            self.sender.api,
+            self.submit,
+            concurrency=self.config.bot.backfill_concurrency,
+            interval=self.config.bot.backfill_interval,
+            pages=self.config.bot.backfill_pages,
+        )
         self._started = False
         log.debug(f"Edi initialized with {config}")
 
@@ -67,34 +154,152 @@ class Edi(metaclass=Singleton):
     async def run(self) -> None:
         """Execute all the bits of Edi."""
 
+        if self.config.bot.dispatch_workers > 0:
+            self.pool = WorkerPool(
+                self.dispatch,
+                workers=self.config.bot.dispatch_workers,
+                maxsize=self.config.bot.dispatch_queue,
+            )
+            self.pool.start()
+            METRICS.gauge("edi_dispatch_queue", lambda: len(self.pool or ()))
+
+        self.slack = Slack(token=self.config.bot.token)
+        try:
+            with PROFILE.measure("open database"):
+                await self.db.start()
+
+            with PROFILE.measure("import units"):
+                import_units(disabled=self.config.units.disable_units)
+
+        except Exception:
+            log.exception("startup failed, stopping")
+            await self.stop()
+            raise
+
+        failures = 0
+        disconnected: Optional[float] = None
+
         while True:
+            if failures:
+                bot = self.config.bot
+                delay = backoff(failures, bot.reconnect_min, bot.reconnect_max)
+                log.info(f"reconnecting in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+            hello = False
             try:
                 log.debug("connecting to slack")
-                self.slack = Slack(token=self.config.bot.token)
-                async for event in self.slack.rtm():
+                connecting = time.perf_counter()
+                async for event in self.rtm():
                     if event.type == "hello":
                         log.info(
                             f"connected to {self.slack.team.name} "
                             f"as {self.slack.me.name}"
                         )
+                        hello = True
+                        failures = 0
+                        if disconnected is None:
+                            PROFILE.add("connect", time.perf_counter() - connecting)
+                        else:
+                            elapsed = time.perf_counter() - disconnected
+                            log.info(f"reconnected after {elapsed:.3f}s")
+                            METRICS.observe("edi_reconnect_seconds", elapsed)
+                            disconnected = None
+                            if self.config.bot.backfill:
+                                self.backfill.start()
                         await self.ready()
 
                     if event.type == "goodbye":
                         log.info("RTM server will disconnect soon")
 
-                    await self.dispatch(event)
+                    self.update_directory(event)
+                    if self.backfill.observe(event):
+                        await self.submit(event)
 
                 log.info("RTM disconnected")
+                if not hello:
+                    # closed before hello, so back off as if it had failed
+                    failures += 1
 
-            except SlackError:
+            except (SlackError, ClientError, asyncio.TimeoutError):
                 log.exception("RTM exception, reconnecting")
-                continue
+                failures += 1
 
             except Exception:
                 log.exception("run loop exception, stopping")
                 await self.stop()
                 raise
 
+            METRICS.increment("edi_reconnects_total")
+            if disconnected is None:
+                disconnected = time.perf_counter()
+
+    async def rtm(self) -> AsyncIterator[Event]:
+        """
+        Connect to RTM, reusing the existing session and directories if possible.
+
+        The first connection uses rtm.start to fill the user and channel caches;
+        later connections use the much lighter rtm.connect, and the caches are
+        kept current from events by update_directory().
+        """
+        if not self.slack.users:
+            async for event in self.slack.rtm():
+                yield event
+            return
+
+        response = await self.slack.api("rtm.connect")
+        self.slack.me = Auto.generate(response.self_, "Me", recursive=False)
+        self.slack.team = Auto.generate(response.team, "Team", recursive=False)
+
+        async with self.slack.session.ws_connect(response["url"]) as ws:
+            async for msg in ws:
+                event: Event = Event.generate(msg.json(), recursive=False)
+                if event.type == "goodbye":
+                    break
+                yield event
+
+    def update_directory(self, event: Event) -> None:
+        """Apply user and channel changes to the cached directories."""
+        kind = event.type
+        try:
+            if kind in ("team_join", "user_change"):
+                user = build(User, event.user)
+                self.slack.users[user.id] = user
+
+            elif kind in ("channel_created", "channel_joined"):
+                channel = build(Channel, event.channel)
+                self.slack.channels[channel.id] = channel
+
+            elif kind == "group_joined":
+                group = build(Group, event.channel)
+                self.slack.groups[group.id] = group
+
+            elif kind in ("channel_rename", "group_rename"):
+                cache, cls = (
+                    (self.slack.channels, Channel)
+                    if kind == "channel_rename"
+                    else (self.slack.groups, Group)
+                )
+                info = event.channel
+                existing = cache.get(info["id"])
+                if existing is None:
+                    cache[info["id"]] = build(cls, info)
+                else:
+                    existing.name = info["name"]
+                    cache[info["id"]] = existing
+
+            elif kind == "channel_deleted" and event.channel in self.slack.channels:
+                del self.slack.channels[event.channel]
+
+            elif kind in ("channel_archive", "channel_unarchive"):
+                channel = self.slack.channels.get(event.channel)
+                if channel is not None:
+                    channel.is_archived = kind == "channel_archive"
+
+        except Exception:
+            # a stale directory entry is better than dropping the connection
+            log.exception(f"failed to update directory from {kind} event")
+
     async def ready(self) -> None:
         """Connected to slack and ready to start units."""
 
@@ -106,21 +311,43 @@ class Edi(metaclass=Singleton):
             rf"(?P<name>@?{self.slack.me.name}|<@{self.slack.me.id}>)[:,]?"
             r"\s+(?P<command>\w+)(?P<args>.*)$"
         )
+        self.command_prefixes = (
+            self.slack.me.name,
+            f"@{self.slack.me.name}",
+            f"<@{self.slack.me.id}>",
+        )
 
-        import_units()
         self.units = {
             unit: unit(self.slack)
             for unit in Unit.all_units()
             if unit.__name__ not in self.config.units.disable_units
         }
         materialize_commands(self.units)
+        self.commands = CommandIndex(COMMANDS)
+        METRICS.gauge("edi_command_cache_entries", lambda: len(RESPONSES))
+        for cmd in COMMANDS.values():
+            if cmd.cache_ttl:
+                METRICS.gauge(
+                    "edi_command_cache_hit_ratio",
+                    lambda name=cmd.name: RESPONSES.ratio(name),
+                    command=cmd.name,
+                )
+        self.build_routes()
         log.debug(f"starting {len(self.units)} units")
+
+        async def start(unit: Unit) -> None:
+            with PROFILE.measure(f"start {unit}"):
+                await unit.start()
+
         for result in await asyncio.gather(
-            *[unit.start() for unit in self.units.values()], return_exceptions=True
+            *[start(unit) for unit in self.units.values()], return_exceptions=True
         ):
             if isinstance(result, BaseException):
                 log.error(f"uncaught exception:\n{result}")
 
+        if self.config.bot.startup_profile:
+            log.info(PROFILE.report())
+
     async def stop(self) -> None:
         """Stop all the bits of Edi."""
 
@@ -129,6 +356,13 @@ class Edi(metaclass=Singleton):
                 self.task.cancel()
                 self.task = None
 
+            if self.pool is not None:
+                await self.pool.stop()
+                self.pool = None
+
+            await self.backfill.stop()
+            await self.sender.stop()
+
             log.debug(f"Stopping {len(self.units)} units")
             for result in await asyncio.gather(
                 *[unit.stop() for unit in self.units.values()], return_exceptions=True
@@ -136,105 +370,288 @@ class Edi(metaclass=Singleton):
                 if isinstance(result, BaseException):
                     log.error(f"uncaught exception:\n{result}")
 
+            self.executors.stop()
+            await self.db.stop()
             await self.slack.close()
 
         finally:
             self.loop.stop()
             log.info("Goodbye!")
 
-    async def command(self, event: Event) -> bool:
+    async def command(self, event: Event, context: Optional[Context] = None) -> bool:
         """Parse for command and dispatch, return True if handled."""
-        if event.type != "message" or "subtype" in event or "bot_user" in event:
+        if event.type != "message":
+            return False
+
+        # most messages aren't addressed to us, so avoid any regex work for them
+        text = getattr(event, "text", None)
+        if not text or not text.lstrip().startswith(self.command_prefixes):
+            return False
+
+        if "subtype" in event or "bot_user" in event or "replayed" in event:
             return False
 
-        match = self.command_re.match(event.text)
+        match = self.command_re.match(text)
         if not match:
             return False
 
-        log.info(f"possible command: {event.text}")
-        user = self.slack.users[event.user]
-        channel = self.slack.channels[event.channel]
-        command = match[2].strip().lower()
+        if context is None:
+            context = self.context(event)
+        user, channel = context.user, context.channel
+        if user is None or channel is None:
+            return False
+
+        log.info("possible command: %s", text)
+        name = match[2].strip().lower()
         args = match[3].strip()
 
-        if command not in COMMANDS:
-            log.warning(f"unknown command from {user.name}: {command} {args}")
+        cmd, match = self.commands.parse(name, args)
+        if cmd is None:
+            log.warning("unknown command from %s: %s %s", user.name, name, args)
             return False
 
         try:
-            method, args_re, _description = COMMANDS[command]
+            command, method = cmd.name, cmd.method
             if command in self.config.units.disable_commands:
-                await self.slack.api(
-                    "chat.postMessage",
-                    as_user=True,
-                    channel=channel.id,
-                    text=f'<@{user.id}> command "{command}" disabled',
+                self.sender.post(
+                    channel.id, f'<@{user.id}> command "{command}" disabled'
                 )
                 return True
 
-            match = args_re.match(args)
             if not match:
-                log.warning(f"invalid arguments from {user.name}: {command} {args}")
-                await self.slack.api(
-                    "chat.postMessage",
-                    as_user=True,
-                    channel=channel.id,
-                    text=f'<@{user.id}> invalid arguments to command "{command}"',
+                log.warning(
+                    "invalid arguments from %s: %s %s", user.name, command, args
+                )
+                self.sender.post(
+                    channel.id, f'<@{user.id}> invalid arguments to command "{command}"'
+                )
+                return True
+
+            reason = cmd.limited(channel.id, user.id, time.monotonic())
+            if reason is not None:
+                log.info("rejected %s from %s: %s", command, user.name, reason)
+                METRICS.increment(
+                    "edi_command_rejections_total", command=command, reason=reason
                 )
+                if reason == "concurrency":
+                    reply = f'<@{user.id}> command "{command}" is busy, try again soon'
+                else:
+                    reply = f'<@{user.id}> slow down, "{command}" is cooling down'
+                self.sender.post(channel.id, reply)
                 return True
 
-            kwargs = match.groupdict()
-            if kwargs:
-                log.info(f"running {method.__name__}({channel}, {user}, **{kwargs})")
-                response = await method(channel, user, **kwargs)
-            else:
-                pargs = match.groups()
-                log.info(f"running {method.__name__}({channel}, {user}, *{pargs})")
-                response = await method(channel, user, *pargs)
+            if cmd.cache_ttl:
+                cached = RESPONSES.get(command, channel.name, args, time.monotonic())
+                if cached is not None:
+                    log.info("cached response for %s %s", command, args)
+                    self.sender.post(channel.id, cached)
+                    return True
 
-            if response:
-                await self.slack.api(
-                    "chat.postMessage", as_user=True, channel=channel.id, text=response
+            cmd.running += 1
+            job: Optional[Future] = None
+            before = time.perf_counter()
+            try:
+                kwargs = match.groupdict()
+                pargs = () if kwargs else match.groups()
+                if kwargs:
+                    log.info(
+                        "running %s(%s, %s, **%s)",
+                        method.__name__,
+                        channel,
+                        user,
+                        kwargs,
+                    )
+                else:
+                    log.info(
+                        "running %s(%s, %s, *%s)", method.__name__, channel, user, pargs
+                    )
+
+                if cmd.executor:
+                    job = self.executors.run(
+                        cmd.executor, method, channel, user, *pargs, **kwargs
+                    )
+                    call = asyncio.wrap_future(job)
+                else:
+                    call = method(channel, user, *pargs, **kwargs)
+
+                if cmd.timeout:
+                    call = asyncio.wait_for(call, cmd.timeout)
+                response = await call
+
+            except asyncio.TimeoutError:
+                log.warning("command %s from %s timed out", command, user.name)
+                METRICS.increment(
+                    "edi_command_rejections_total", command=command, reason="timeout"
+                )
+                self.sender.post(
+                    channel.id, f'<@{user.id}> command "{command}" timed out'
+                )
+                return True
+            except Exception:
+                METRICS.increment("edi_command_errors_total", command=command)
+                raise
+            finally:
+                if job is None or job.done():
+                    cmd.running -= 1
+                else:
+                    # the pool can't stop it, so it keeps its slot until it ends
+                    self.executors.when_done(job, cmd.release)
+                METRICS.observe(
+                    "edi_command_seconds", time.perf_counter() - before, command=command
                 )
 
+            if response:
+                self.sender.post(channel.id, response)
+                if cmd.cache_ttl:
+                    expires = time.monotonic() + cmd.cache_ttl
+                    RESPONSES.set(command, channel.name, args, response, expires)
+
         except Exception:
             log.exception("exception occurred during command processing")
-            try:
-                await self.slack.api(
-                    "chat.postMessage",
-                    as_user=True,
-                    channel=channel.id,
-                    text=fr"<@{user.id}> error occurred ¯\_(ツ)_/¯",
-                )
-            except SlackError:
-                log.exception("failed to alert user of error")
+            self.sender.post(channel.id, fr"<@{user.id}> error occurred ¯\_(ツ)_/¯")
 
         return True
 
+    @staticmethod
+    def event_key(event: Event) -> Optional[str]:
+        """Return the channel an event belongs to, for ordered dispatch."""
+        channel = getattr(event, "channel", None)
+        if channel is None:
+            item = getattr(event, "item", None)
+            if isinstance(item, Mapping):
+                channel = item.get("channel", None)
+        return channel if isinstance(channel, str) else None
+
+    def context(self, event: Event) -> Context:
+        """Resolve the channel and user of an event once, for every handler."""
+        channel = None
+        channel_id = self.event_key(event)
+        if channel_id is not None:
+            channel = self.slack.channels.get(channel_id)
+            if channel is None:
+                channel = self.slack.groups.get(channel_id)
+
+        user = None
+        username = getattr(event, "username", None) or ""
+        user_id = getattr(event, "user", None)
+        if isinstance(user_id, str):
+            user = self.slack.users.get(user_id)
+            if user is not None and getattr(event, "bot_user", None) is None:
+                username = user.name
+
+        return Context(event, channel, user, username)
+
+    def build_routes(self) -> None:
+        """Precompute the handlers for each event type from active units."""
+
+        handlers = {unit: unit.handlers() for unit in self.units.values()}
+        defaults = {unit: unit.default_handler() for unit in self.units.values()}
+        event_types = {key for value in handlers.values() for key in value}
+
+        self.default_routes = [
+            (unit, fn) for unit, fn in defaults.items() if fn is not None
+        ]
+        self.routes = {}
+        for event_type in event_types:
+            routes = []
+            for unit in self.units.values():
+                fn = handlers[unit].get(event_type, defaults[unit])
+                if fn is not None:
+                    routes.append(self.timed(unit, event_type, self.adapt(fn)))
+            self.routes[event_type] = routes
+
+        log.debug(
+            f"routing {len(self.routes)} event types, "
+            f"{len(self.default_routes)} default handlers"
+        )
+
+    def adapt(self, fn: Handler) -> ContextHandler:
+        """Adapt a unit's handler to take a context, and offload it if marked."""
+        executor = getattr(fn, "executor", "")
+        if executor:
+            return self.executors.handler(executor, fn, accepts_context(fn))
+        return with_context(fn)
+
+    @staticmethod
+    def timed(unit: Unit, event_type: str, fn: ContextHandler) -> ContextHandler:
+        """Wrap a unit's handler to record its latency per event type."""
+        histogram = METRICS.histogram(
+            "edi_handler_seconds", unit=unit, handler=fn.__name__, type=event_type
+        )
+        return METRICS.timed(fn, histogram)
+
+    def route(self, event_type: str) -> List[ContextHandler]:
+        """Return the handlers that should receive events of the given type."""
+        routes = self.routes.get(event_type, None)
+        if routes is None:
+            routes = [
+                self.timed(unit, event_type, self.adapt(fn))
+                for unit, fn in self.default_routes
+            ]
+            self.routes[event_type] = routes
+        return routes
+
+    async def submit(self, event: Event) -> None:
+        """Dispatch an event, through the worker pool if there is one."""
+        if self.pool is None:
+            await self.dispatch(event)
+        else:
+            await self.pool.submit(self.event_key(event), event)
+
     async def dispatch(self, event: Event) -> None:
         """Dispatch events to all active units."""
-        if "channel" in event:
-            channel_name = self.slack.channels[event.channel].name
+        before = time.perf_counter()
+        try:
+            await self.deliver(event)
+        finally:
+            METRICS.observe(
+                "edi_dispatch_seconds", time.perf_counter() - before, type=event.type
+            )
+
+    async def deliver(self, event: Event) -> None:
+        context = self.context(event)
+        if context.channel is not None:
+            channel_name = context.channel.name
             if channel_name in self.config.bot.ignore_channels:
-                log.debug(f"ignoring event from channel #{channel_name}")
+                log.debug("ignoring event from channel #%s", channel_name)
                 return
 
-        await self.command(event)
+        await self.command(event, context)
+
+        handlers = self.route(event.type)
+        if not handlers:
+            return
+
+        if len(handlers) == 1:
+            try:
+                await handlers[0](event, context)
+            except Exception as e:
+                log.error("uncaught exception:\n%s", e)
+                METRICS.increment("edi_handler_errors_total", type=event.type)
+            return
 
         results = await asyncio.gather(
-            *[unit.dispatch(event) for unit in self.units.values()],
-            return_exceptions=True,
+            *[handler(event, context) for handler in handlers], return_exceptions=True
         )
 
         for result in results:
             if isinstance(result, BaseException):
-                log.error(f"uncaught exception:\n{result}")
+                log.error("uncaught exception:\n%s", result)
+                METRICS.increment("edi_handler_errors_total", type=event.type)
 
 
 def init_from_config(config: Config) -> None:
     """Initialize Edi from a loaded `Config` object."""
 
-    init_logger(stdout=True, file_path=config.bot.log, debug=config.bot.debug)
+    init_logger(
+        stdout=True,
+        file_path=config.bot.log,
+        debug=config.bot.debug,
+        max_bytes=config.bot.log_max_bytes,
+        backups=config.bot.log_backups,
+        rotate=config.bot.log_rotate,
+        compress=config.bot.log_compress,
+    )
     log.debug("logger initialized")
 
     Edi(config).start()
@@ -2,16 +2,16 @@
 # Licensed under the MIT license
 
 from pathlib import Path
-from typing import Any, Dict, List, Mapping
+from typing import Any, Dict, List, Mapping, Optional
 
 import toml
-from attr import dataclass, fields
+from attr import Factory, dataclass, fields
 
 
 @dataclass
 class Config:
-    _tables: Dict[str, "Config"] = {}
-    _content: Dict[str, Mapping[str, Any]] = {}
+    _tables: Dict[str, "Config"] = Factory(dict)
+    _content: Dict[str, Mapping[str, Any]] = Factory(dict)
 
     def __getattr__(self, key: str) -> "Config":
         """
@@ -35,10 +35,27 @@ class Config:
                 raise AttributeError(f"config table {key} not found")
         return self._tables[key]
 
+    def is_set(self, table: str, key: str) -> bool:
+        """Whether the config file gave a value for a setting."""
+        return key in self._content.get(table.lower(), {})
+
+    def override(self, table: str, key: str, value: Any) -> None:
+        """Replace a setting, whether or not its table has been loaded yet."""
+        table = table.lower()
+        self._content[table] = {**self._content.get(table, {}), key: value}
+        self._tables.pop(table, None)
+
+    def workspace_names(self) -> List[str]:
+        """Names of the `[workspaces.*]` tables, for running under a supervisor."""
+        return sorted(self._content.get("workspaces", {}))
+
     @classmethod
-    def load_from_file(cls, file_path: str) -> "Config":
+    def load_from_file(
+        cls, file_path: str, workspace: Optional[str] = None
+    ) -> "Config":
         """Given a path to a local configuration file, read the config file and
-        merge its contents onto the default configuration."""
+        merge its contents onto the default configuration.  If `workspace` is
+        given, tables from `[workspaces.<name>]` are merged over the shared ones."""
 
         config = cls()
         path = Path(file_path).expanduser()
@@ -55,6 +72,18 @@ class Config:
         else:
             raise RuntimeError(f"config path {path} not valid")
 
+        if workspace is not None:
+            overrides = config._content.get("workspaces", {}).get(workspace)
+            if overrides is None:
+                raise KeyError(f"workspace {workspace} not found in {path}")
+
+            for key, value in overrides.items():
+                if isinstance(value, Mapping):
+                    key = key.lower()
+                    config._content[key] = {**config._content.get(key, {}), **value}
+                else:
+                    raise KeyError("workspace config values must be in tables")
+
         return config
 
 
@@ -62,10 +91,33 @@ class Config:
 class bot(Config):
     token: str = "changeme"
     db_path: str = "edi.db"
+    db_readers: int = 2
+    db_journal_mode: str = "wal"
+    db_synchronous: str = "normal"
+    db_cache_size: int = -2000
     debug: bool = False
     log: str = ""
+    log_max_bytes: int = 0
+    log_rotate: str = ""
+    log_backups: int = 5
+    log_compress: bool = True
     uvloop: bool = True
     ignore_channels: List[str] = []
+    startup_profile: bool = False
+    dispatch_workers: int = 0
+    dispatch_queue: int = 1000
+    command_cache_size: int = 1000
+    executor_threads: int = 4
+    executor_processes: int = 2
+    post_interval: float = 1.0
+    post_coalesce: int = 3000
+    post_retries: int = 3
+    reconnect_min: float = 1.0
+    reconnect_max: float = 120.0
+    backfill: bool = True
+    backfill_concurrency: int = 2
+    backfill_interval: float = 1.2
+    backfill_pages: int = 10
 
 
 @dataclass
@@ -3,55 +3,319 @@
 
 import inspect
 import logging
+import random
 import re
+from bisect import bisect_left
+from collections import OrderedDict
 from types import FunctionType
-from typing import Any, Callable, Dict, Pattern, Set, Tuple, Type, TypeVar
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Match,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 from aioslack import Event, Slack
+from aioslack.types import Channel, User
+from attr import Factory, dataclass
 
 log = logging.getLogger(__name__)
 
-COMMANDS: Dict[str, Tuple[Any, Pattern, str]] = {}
 T = TypeVar("T", bound=FunctionType)
+Handler = Callable[[Event], Awaitable[None]]
+
+
+class Context:
+    """
+    Channel, user, and message details for one event, resolved once by Edi.
+
+    Handlers that accept a second argument, `on_<type>(event, context)`, receive
+    this alongside the event instead of looking things up in the Slack caches.
+    """
+
+    __slots__ = (
+        "event",
+        "channel",
+        "user",
+        "username",
+        "text",
+        "ts",
+        "subtype",
+        "replayed",
+    )
+
+    def __init__(
+        self,
+        event: Event,
+        channel: Optional[Channel] = None,
+        user: Optional[User] = None,
+        username: str = "",
+    ) -> None:
+        self.event = event
+        self.channel = channel
+        self.user = user
+        self.username = username
+        self.text: str = getattr(event, "text", None) or ""
+        self.ts: str = getattr(event, "ts", None) or ""
+        self.subtype: str = getattr(event, "subtype", None) or ""
+        self.replayed: bool = bool(getattr(event, "replayed", False))
+
+    @property
+    def channel_name(self) -> str:
+        return self.channel.name if self.channel is not None else ""
+
+
+ContextHandler = Callable[[Event, Context], Awaitable[None]]
+
+
+def accepts_context(fn: Callable) -> bool:
+    """Whether a handler takes `(event, context)` rather than just the event."""
+    try:
+        params = list(inspect.signature(fn).parameters.values())
+    except (TypeError, ValueError):
+        return True
+    return any(p.kind == p.VAR_POSITIONAL for p in params) or len(params) >= 2
+
+
+def with_context(fn: Callable[..., Awaitable[None]]) -> ContextHandler:
+    """Adapt a handler to the `(event, context)` calling convention."""
+    if accepts_context(fn):
+        return fn
+
+    def legacy(event: Event, context: Context) -> Awaitable[None]:
+        return fn(event)
+
+    legacy.__name__ = getattr(fn, "__name__", "legacy")
+    return legacy
+
+
+def backoff(failures: int, minimum: float, maximum: float) -> float:
+    """Exponential backoff with random jitter, in seconds."""
+    ceiling = min(maximum, minimum * 2 ** (failures - 1))
+    return random.uniform(minimum, max(minimum, ceiling))
+
+
+@dataclass
+class Command:
+    name: str
+    method: Any
+    args: Pattern
+    description: str
+    aliases: List[str] = Factory(list)
+
+    # execution limits, where zero means unlimited
+    timeout: float = 0.0
+    concurrency: int = 0
+    cooldown: float = 0.0
+    cooldown_per: str = "user"
+
+    # seconds to reuse responses for the same arguments in the same channel
+    cache_ttl: float = 0.0
+
+    # run a synchronous method in the shared "thread" or "process" pool
+    executor: str = ""
+
+    # current runs, and when each user or channel last ran the command
+    running: int = 0
+    last_run: Dict[str, float] = Factory(dict)
+
+    def limited(self, channel: str, user: str, now: float) -> Optional[str]:
+        """Return why a new run would exceed this command's limits, if it would."""
+        if self.concurrency and self.running >= self.concurrency:
+            return "concurrency"
+
+        if self.cooldown:
+            key = user if self.cooldown_per == "user" else channel
+            if now - self.last_run.get(key, -self.cooldown) < self.cooldown:
+                return "cooldown"
+            if len(self.last_run) > 1000:
+                expired = now - self.cooldown
+                self.last_run = {k: t for k, t in self.last_run.items() if t > expired}
+            self.last_run[key] = now
+
+        return None
+
+    def release(self) -> None:
+        """Free the run's concurrency slot once it has finished."""
+        self.running -= 1
+
+
+COMMANDS: Dict[str, Command] = {}
+EXECUTORS = ("thread", "process")
 
 
 def command(
-    args: str = r"(.*)", name: str = "", description: str = ""
+    args: str = r"(.*)",
+    name: str = "",
+    description: str = "",
+    aliases: Sequence[str] = (),
+    *,
+    timeout: float = 0.0,
+    concurrency: int = 0,
+    cooldown: float = 0.0,
+    cooldown_per: str = "user",
+    cache_ttl: float = 0.0,
+    executor: str = "",
 ) -> Callable[[T], T]:
-    """Decorator for automating command/args declaration and dispatch."""
+    """
+    Decorator for automating command/args declaration and dispatch.
+
+    Commands can limit how long each run may take in seconds, how many runs
+    may be in progress at once, and how many seconds each user (or channel,
+    with `cooldown_per="channel"`) must wait between runs.  Commands whose
+    response depends only on their arguments and channel can set `cache_ttl`
+    to reuse responses for that many seconds; see `RESPONSES.invalidate()`.
+
+    Synchronous methods that block or burn CPU can set `executor` to "thread"
+    or "process" to run in the shared pools instead of on the event loop.  In
+    the process pool, the method runs on a bare instance of its unit, without
+    any of the state set up by `start()`.
+    """
+
+    if cooldown_per not in ("user", "channel"):
+        raise ValueError(f"cooldown_per must be user or channel, not {cooldown_per}")
+    if executor and executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {EXECUTORS}, not {executor}")
 
     def wrapper(fn: T) -> T:
         if fn.__name__ == fn.__qualname__:
             # TODO: maybe handle raw functions
             raise ValueError("@command takes class methods only")
+        if executor and inspect.iscoroutinefunction(fn):
+            raise ValueError("@command(executor=...) takes synchronous methods only")
 
         cmd = name.lower() if name else fn.__name__.lower()
-        if cmd in COMMANDS:
-            unit, _regex, _description = COMMANDS[name]
-            raise ValueError(f'command "{cmd}" already claimed by {unit.__name__}')
+        names = [alias.lower() for alias in aliases]
+        for existing in COMMANDS.values():
+            claimed = [existing.name] + existing.aliases
+            for key in [cmd] + names:
+                if key in claimed:
+                    _module, cls_name, _fn_name = existing.method
+                    raise ValueError(f'command "{key}" already claimed by {cls_name}')
 
         module = inspect.getmodule(fn)
         cls_name = fn.__qualname__.split(".")[0]
         fn_name = fn.__name__
 
-        COMMANDS[cmd] = ((module, cls_name, fn_name), re.compile(args), description)
+        COMMANDS[cmd] = Command(
+            name=cmd,
+            method=(module, cls_name, fn_name),
+            args=re.compile(args),
+            description=description,
+            aliases=names,
+            timeout=timeout,
+            concurrency=concurrency,
+            cooldown=cooldown,
+            cooldown_per=cooldown_per,
+            cache_ttl=cache_ttl,
+            executor=executor,
+        )
 
         return fn
 
     return wrapper
 
 
+def offload(executor: str) -> Callable[[T], T]:
+    """
+    Decorator to run a synchronous "on_<type>" handler in a shared pool.
+
+    As with `@command(executor=...)`, handlers in the "process" pool run on a
+    bare instance of their unit, without any of the state set up by `start()`.
+    """
+
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {EXECUTORS}, not {executor}")
+
+    def wrapper(fn: T) -> T:
+        if inspect.iscoroutinefunction(fn):
+            raise ValueError("@offload takes synchronous methods only")
+        fn.executor = executor  # type: ignore
+        return fn
+
+    return wrapper
+
+
+class ResponseCache:
+    """
+    Least recently used cache of command responses.
+
+    Entries are keyed by command name, channel name, and arguments, and expire
+    after the command's `cache_ttl`.  Units should invalidate a command's
+    responses when the data behind them changes.
+    """
+
+    def __init__(self, maxsize: int = 1000) -> None:
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = (
+            OrderedDict()
+        )
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, name: str, channel: str, args: str, now: float) -> Optional[str]:
+        key = (name, channel, args)
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            expires, response = entry
+            if expires > now:
+                self.entries.move_to_end(key)
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return response
+            del self.entries[key]
+
+        self.misses[name] = self.misses.get(name, 0) + 1
+        return None
+
+    def set(
+        self, name: str, channel: str, args: str, response: str, expires: float
+    ) -> None:
+        key = (name, channel, args)
+        self.entries[key] = (expires, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, name: str, channel: Optional[str] = None) -> None:
+        """Drop cached responses of a command, in one channel or in all of them."""
+        for key in list(self.entries):
+            if key[0] == name and (channel is None or key[1] == channel):
+                del self.entries[key]
+
+    def ratio(self, name: str) -> float:
+        """Fraction of lookups for a command that were served from the cache."""
+        hits = self.hits.get(name, 0)
+        total = hits + self.misses.get(name, 0)
+        return hits / total if total else 0.0
+
+
+RESPONSES = ResponseCache()
+
+
 def materialize_commands(units: Dict[Type["Unit"], "Unit"]) -> None:
     for name in list(COMMANDS):
-        info, args, description = COMMANDS[name]
+        cmd = COMMANDS[name]
         try:
-            module, cls_name, fn_name = info
+            module, cls_name, fn_name = cmd.method
             cls = getattr(module, cls_name)
             method = None
             instance = units[cls]
             method = getattr(instance, fn_name)
             if method:
-                COMMANDS[name] = method, args, description
+                cmd.method = method
             else:
                 raise AttributeError(f"no active unit of {cls} with method {fn_name}")
 
@@ -59,6 +323,48 @@ def materialize_commands(units: Dict[Type["Unit"], "Unit"]) -> None:
             COMMANDS.pop(name)
 
 
+class CommandIndex:
+    """
+    Compiled lookup of active commands by name, alias, or unambiguous prefix.
+
+    Built once from the materialized commands, so that resolving a command and
+    parsing its arguments is a dictionary lookup and a single regex match.
+    """
+
+    def __init__(self, commands: Mapping[str, Command]) -> None:
+        self.names: Dict[str, Command] = {}
+        for cmd in commands.values():
+            self.names[cmd.name] = cmd
+            for alias in cmd.aliases:
+                self.names.setdefault(alias, cmd)
+        self.keys = sorted(self.names)
+        self.prefixes: Dict[str, Command] = {}
+
+    def resolve(self, name: str) -> Optional[Command]:
+        """Find the command for a name, alias, or unambiguous prefix of either."""
+        cmd = self.names.get(name) or self.prefixes.get(name)
+        if cmd is not None or not name:
+            return cmd
+
+        for key in self.keys[bisect_left(self.keys, name) :]:
+            if not key.startswith(name):
+                break
+            if cmd is not None and self.names[key] is not cmd:
+                return None  # ambiguous prefix
+            cmd = self.names[key]
+
+        if cmd is not None:
+            self.prefixes[name] = cmd
+        return cmd
+
+    def parse(self, name: str, args: str) -> Tuple[Optional[Command], Optional[Match]]:
+        """Resolve a command and match its arguments in one step."""
+        cmd = self.resolve(name)
+        if cmd is None:
+            return None, None
+        return cmd, cmd.args.match(args)
+
+
 class Unit:
     ENABLED = True
 
@@ -114,14 +420,51 @@ class Unit:
         """
         Entry point for events received from the Slack RTM API.
 
-        Any messages from the RTM API will be sent here, to be dispatched
-        appropriately.  Default behavior is to look for a matching "on_event"
-        method for the given message type, and will call that if found.
+        The main Edi framework routes events straight to the "on_<type>"
+        handlers found by `handlers()`, and does not call this by default.
+        Units that override it receive every event here instead, and are
+        responsible for dispatching them; the default implementation calls the
+        matching "on_<type>" method, or `on_default` if there is none.
         """
 
         method = getattr(self, f"on_{event.type}", self.on_default)
         await method(event)
 
+    def handlers(self) -> Dict[str, Handler]:
+        """
+        Map event types to the bound "on_<type>" handlers defined by this unit.
+
+        Used by the main Edi framework to build its routing table once at startup,
+        so that events are only delivered to units that actually handle them.
+        Units overriding `dispatch` have no specific handlers.
+        """
+        if self.overrides_dispatch():
+            return {}
+        return {
+            name[3:]: getattr(self, name)
+            for name in dir(type(self))
+            if name.startswith("on_")
+            and name != "on_default"
+            and callable(getattr(type(self), name))
+        }
+
+    def default_handler(self) -> Optional[Handler]:
+        """
+        Return the bound `on_default` handler if this unit overrides it.
+
+        Receiving events without a specific "on_<type>" handler is opt-in; units
+        relying on the no-op default will not be scheduled for those events.
+        Units overriding `dispatch` get it as their handler for every event.
+        """
+        if self.overrides_dispatch():
+            return self.dispatch
+        if type(self).on_default is Unit.on_default:
+            return None
+        return self.on_default
+
+    def overrides_dispatch(self) -> bool:
+        return type(self).dispatch is not Unit.dispatch
+
     async def on_default(self, event: Event) -> None:
         """Default message handler when specific handlers aren't defined."""
         pass
@@ -1,7 +1,224 @@
 # Copyright 2016 John Reese
 # Licensed under the MIT license
 
+import asyncio
+import logging
+from itertools import cycle
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Sequence
+from urllib.parse import quote
+
+import aiosqlite
+
+log = logging.getLogger(__name__)
+
+Params = Sequence[Any]
+
+
+def fts_match(terms: str) -> str:
+    """
+    Build an FTS5 query matching rows that contain all of the given words.
+
+    Each word is quoted, so that user input can't use FTS query syntax.
+    Returns an empty string if there are no words to match.
+    """
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in terms.split())
+
+
+class Transaction:
+    """Hold the writer for a single transaction, rolled back on error."""
+
+    def __init__(self, db: "EdiDb") -> None:
+        self.db = db
+        self.cursor: Optional[aiosqlite.Cursor] = None
+
+    async def __aenter__(self) -> aiosqlite.Cursor:
+        await self.db.lock.acquire()
+        try:
+            if self.db.writer is None:
+                raise RuntimeError("database not started")
+            self.cursor = await self.db.writer.cursor()
+            await self.cursor.execute("BEGIN")
+            return self.cursor
+        except BaseException:
+            self.db.lock.release()
+            raise
+
+    async def __aexit__(self, exc_type: Any, *args: Any) -> None:
+        assert self.cursor is not None
+        try:
+            await self.cursor.execute("ROLLBACK" if exc_type else "COMMIT")
+            await self.cursor.close()
+        finally:
+            self.cursor = None
+            self.db.lock.release()
+
 
 class EdiDb:
-    def __init__(self) -> None:
-        pass
+    """
+    Shared SQLite database for the framework and all units.
+
+    All writes go through a single connection, serialized by a lock so that
+    transactions from different units never interleave.  Reads are spread over
+    a small pool of read-only connections, which WAL mode allows to run while
+    the writer is busy.  Units declare their schema with `migrate()`, versioned
+    separately for each namespace.
+    """
+
+    JOURNAL_MODES = ("delete", "truncate", "persist", "memory", "wal", "off")
+    SYNCHRONOUS = ("off", "normal", "full", "extra")
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        readers: int = 2,
+        journal_mode: str = "wal",
+        synchronous: str = "normal",
+        cache_size: int = -2000,
+    ) -> None:
+        if journal_mode.lower() not in self.JOURNAL_MODES:
+            raise ValueError(f"invalid journal mode {journal_mode}")
+        if synchronous.lower() not in self.SYNCHRONOUS:
+            raise ValueError(f"invalid synchronous setting {synchronous}")
+
+        memory = path == ":memory:" or path.startswith("file::memory:")
+        self.path = path if memory else str(Path(path).expanduser())
+        self.pragmas = {
+            "journal_mode": journal_mode.lower(),
+            "synchronous": synchronous.lower(),
+            "cache_size": int(cache_size),
+        }
+
+        # readers can only see the writer's data through a file in WAL mode
+        if memory or self.pragmas["journal_mode"] != "wal":
+            readers = 0
+        self.reader_count = max(0, readers)
+
+        self.writer: Optional[aiosqlite.Connection] = None
+        self.readers: List[aiosqlite.Connection] = []
+        self.next_reader: Optional[Iterable[aiosqlite.Connection]] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Lock serializing use of the writer, bound to the loop that started us."""
+        if self._lock is None:
+            raise RuntimeError("database not started")
+        return self._lock
+
+    async def start(self) -> None:
+        # created here rather than in __init__, which may run outside any loop
+        self._lock = asyncio.Lock()
+
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.writer = await aiosqlite.connect(self.path, isolation_level=None)
+        for key, value in self.pragmas.items():
+            await self.writer.execute(f"PRAGMA {key} = {value}")
+        await self.writer.execute(
+            """
+            CREATE TABLE IF NOT EXISTS edi_migrations (
+                namespace TEXT PRIMARY KEY,
+                version INTEGER
+            )
+            """
+        )
+
+        uri = f"file:{quote(self.path)}?mode=ro"
+        for _ in range(self.reader_count):
+            reader = await aiosqlite.connect(uri, uri=True, isolation_level=None)
+            await reader.execute(f"PRAGMA cache_size = {self.pragmas['cache_size']}")
+            self.readers.append(reader)
+        self.next_reader = cycle(self.readers)
+
+        log.debug(f"opened {self.path} with {len(self.readers)} readers")
+
+    async def stop(self) -> None:
+        if self._lock is None:
+            return
+
+        async with self.lock:
+            for reader in self.readers:
+                await reader.close()
+            self.readers.clear()
+            self.next_reader = None
+
+            if self.writer is not None:
+                await self.writer.close()
+                self.writer = None
+
+        self._lock = None
+
+    @staticmethod
+    async def query(
+        conn: aiosqlite.Connection, query: str, params: Params, many: bool
+    ) -> Any:
+        async with conn.execute(query, params) as cursor:
+            if many:
+                return list(await cursor.fetchall())
+            return await cursor.fetchone()
+
+    async def read(self, query: str, params: Params, many: bool) -> Any:
+        """
+        Run a query on the next reader.
+
+        Without readers, the query runs on the writer under the lock, so that it
+        never lands in the middle of another unit's open transaction.
+        """
+        if self.next_reader is not None and self.readers:
+            conn = next(self.next_reader)  # type: ignore
+            return await self.query(conn, query, params, many)
+
+        async with self.lock:
+            if self.writer is None:
+                raise RuntimeError("database not started")
+            return await self.query(self.writer, query, params, many)
+
+    def transaction(self) -> Transaction:
+        """Run several writes as one transaction: `async with db.transaction()`."""
+        return Transaction(self)
+
+    async def execute(self, query: str, params: Params = ()) -> int:
+        """Run one write statement, and return the last inserted row id."""
+        async with self.lock:
+            if self.writer is None:
+                raise RuntimeError("database not started")
+            async with self.writer.execute(query, params) as cursor:
+                return cursor.lastrowid
+
+    async def executemany(self, query: str, params: Iterable[Params]) -> None:
+        """Run one write statement for each set of params, in one transaction."""
+        async with self.transaction() as cursor:
+            await cursor.executemany(query, params)
+
+    async def fetchone(self, query: str, params: Params = ()) -> Optional[Any]:
+        return await self.read(query, params, many=False)
+
+    async def fetchall(self, query: str, params: Params = ()) -> List[Any]:
+        return await self.read(query, params, many=True)
+
+    async def migrate(self, namespace: str, migrations: Sequence[Sequence[str]]) -> int:
+        """
+        Bring a namespace's schema up to date, and return its version.
+
+        Each item of `migrations` is a list of statements applied together in a
+        transaction; the number applied so far is recorded per namespace.
+        """
+        row = await self.fetchone(
+            "SELECT version FROM edi_migrations WHERE namespace = ?", [namespace]
+        )
+        version = row[0] if row else 0
+
+        for version, statements in enumerate(migrations[version:], version + 1):
+            log.info(f"migrating {namespace} in {self.path} to version {version}")
+            async with self.transaction() as cursor:
+                for statement in statements:
+                    await cursor.execute(statement)
+                await cursor.execute(
+                    "INSERT OR REPLACE INTO edi_migrations VALUES (?, ?)",
+                    [namespace, version],
+                )
+
+        return version
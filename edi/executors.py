@@ -0,0 +1,161 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from functools import partial
+from typing import Any, Callable, Dict, Mapping, Optional, Sequence
+
+from attr import asdict
+
+from aioslack import Event
+
+from .core import Context
+from .metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+
+def bare_method(module: str, qualname: str) -> Callable:
+    """Find a unit method by name, bound to an instance without any state."""
+    cls_name, fn_name = qualname.rsplit(".", 1)
+    cls = getattr(importlib.import_module(module), cls_name)
+    return getattr(cls.__new__(cls), fn_name)
+
+
+def call_method(
+    module: str, qualname: str, args: Sequence[Any], kwargs: Mapping[str, Any]
+) -> Any:
+    """Run a command method in a worker process."""
+    return bare_method(module, qualname)(*args, **kwargs)
+
+
+def call_handler(
+    module: str,
+    qualname: str,
+    data: Dict[str, Any],
+    parts: Optional[Sequence[Any]],
+) -> None:
+    """Run an event handler in a worker process, rebuilding its arguments."""
+    event = Event.generate(data, recursive=False)
+    fn = bare_method(module, qualname)
+    if parts is None:
+        fn(event)
+    else:
+        fn(event, Context(event, *parts))
+
+
+class Executors:
+    """
+    Shared thread and process pools for handlers that would block the loop.
+
+    Pools are created on first use.  Work waiting for or running in each pool
+    is reported as `edi_executor_pending`, and as a fraction of the pool size
+    in `edi_executor_saturation`.
+    """
+
+    def __init__(self, threads: int = 4, processes: int = 2) -> None:
+        self.sizes = {"thread": max(1, threads), "process": max(1, processes)}
+        self.pools: Dict[str, Executor] = {}
+        self.pending = {"thread": 0, "process": 0}
+
+        for kind in self.sizes:
+            METRICS.gauge(
+                "edi_executor_pending", partial(self.pending.get, kind), pool=kind
+            )
+            METRICS.gauge(
+                "edi_executor_saturation",
+                lambda kind=kind: self.pending[kind] / self.sizes[kind],
+                pool=kind,
+            )
+
+    def pool(self, kind: str) -> Executor:
+        if kind not in self.pools:
+            if kind == "thread":
+                self.pools[kind] = ThreadPoolExecutor(
+                    self.sizes[kind], thread_name_prefix="edi-executor"
+                )
+            elif kind == "process":
+                # spawn, as forking a process with running threads is unsafe
+                try:
+                    self.pools[kind] = ProcessPoolExecutor(
+                        self.sizes[kind],
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                except TypeError:  # python < 3.7
+                    log.warning("process pool will fork, spawning needs python 3.7")
+                    self.pools[kind] = ProcessPoolExecutor(self.sizes[kind])
+            else:
+                raise ValueError(f"unknown executor {kind}")
+        return self.pools[kind]
+
+    def stop(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
+        self.pools.clear()
+
+    @staticmethod
+    def when_done(future: Future, callback: Callable[[], None]) -> None:
+        """Call `callback` on the event loop once a pool job has really finished."""
+        loop = asyncio.get_event_loop()
+
+        def done(_future: Future) -> None:
+            try:
+                loop.call_soon_threadsafe(callback)
+            except RuntimeError:
+                pass  # loop already closed
+
+        future.add_done_callback(done)
+
+    def submit(self, kind: str, fn: Callable[[], Any]) -> Future:
+        """
+        Start a job in the given pool.
+
+        Jobs count as pending until they finish, even if whoever awaited them
+        has given up, as a running job can't be interrupted.
+        """
+        future = self.pool(kind).submit(fn)
+        self.pending[kind] += 1
+
+        def finished() -> None:
+            self.pending[kind] -= 1
+
+        self.when_done(future, finished)
+        return future
+
+    def run(self, kind: str, method: Callable, *args: Any, **kwargs: Any) -> Future:
+        """Start a synchronous command method in the given pool."""
+        if kind == "process":
+            return self.submit(
+                kind,
+                partial(
+                    call_method, method.__module__, method.__qualname__, args, kwargs
+                ),
+            )
+        return self.submit(kind, partial(method, *args, **kwargs))
+
+    def handler(self, kind: str, fn: Callable, context: bool) -> Callable:
+        """Wrap a synchronous event handler to run in the given pool."""
+
+        async def offloaded(event: Event, ctx: Context) -> None:
+            if kind == "process":
+                parts = (ctx.channel, ctx.user, ctx.username) if context else None
+                target = partial(
+                    call_handler, fn.__module__, fn.__qualname__, asdict(event), parts
+                )
+            elif context:
+                target = partial(fn, event, ctx)
+            else:
+                target = partial(fn, event)
+            await asyncio.wrap_future(self.submit(kind, target))
+
+        offloaded.__name__ = getattr(fn, "__name__", "offloaded")
+        return offloaded
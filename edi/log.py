@@ -1,24 +1,107 @@
 # Copyright 2017 John Reese
 # Licensed under the MIT license
 
+import atexit
+import gzip
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 import sys
+from typing import Any, List, Optional
+
+LISTENER: Optional[logging.handlers.QueueListener] = None
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Pass records to the listener thread without formatting them first.
+
+    The stock handler formats every record on the calling thread so that it can be
+    pickled; an in-process queue has no such need, which leaves all of the
+    formatting work to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class WorkerQueueHandler(logging.handlers.QueueHandler):
+    """Send records from a worker process to the supervisor, tagged by workspace."""
+
+    def __init__(self, records: Any, workspace: str) -> None:
+        super().__init__(records)
+        self.workspace = workspace
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.msg = f"[{self.workspace}] {record.msg}"
+        return record
+
+
+class ForwardHandler(logging.Handler):
+    """Pass records received from worker processes to this process's loggers."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+
+def compress_rotator(source: str, dest: str) -> None:
+    """
+    Gzip the current log file to its rotated name, and remove the original.
+
+    Rotation happens on the listener thread, so compressing here never blocks the
+    event loop; records logged in the meantime wait in the queue.
+    """
+    tmp = f"{dest}.tmp"
+    with open(source, "rb") as src, gzip.open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, dest)
+    os.remove(source)
+
+
+def stop_logger() -> None:
+    """Flush and stop the background logging thread, if running."""
+    global LISTENER
+
+    if LISTENER is not None:
+        LISTENER.stop()
+        LISTENER = None
+
+
+def level_names() -> None:
+    logging.addLevelName(logging.ERROR, "E")
+    logging.addLevelName(logging.WARNING, "W")
+    logging.addLevelName(logging.INFO, "I")
+    logging.addLevelName(logging.DEBUG, "V")
 
 
 def init_logger(
-    stdout: bool = True, file_path: str = None, debug: bool = False
+    stdout: bool = True,
+    file_path: str = None,
+    debug: bool = False,
+    max_bytes: int = 0,
+    backups: int = 5,
+    rotate: str = "",
+    compress: bool = True,
 ) -> logging.Logger:
-    """Initialize the logging system for stdout and an optional log file."""
+    """
+    Initialize the logging system for stdout and an optional log file.
+
+    Handlers run on a background thread behind a queue, so logging from the event
+    loop never blocks on writes.  The log file is rotated once it reaches
+    `max_bytes`, or at the interval given by `rotate` (eg, "midnight"), keeping
+    `backups` old files, and gzipping them if `compress` is set.
+    """
+    global LISTENER
 
     log = logging.getLogger("")
 
     level = logging.DEBUG if debug else logging.INFO
     log.setLevel(level)
 
-    logging.addLevelName(logging.ERROR, "E")
-    logging.addLevelName(logging.WARNING, "W")
-    logging.addLevelName(logging.INFO, "I")
-    logging.addLevelName(logging.DEBUG, "V")
+    level_names()
 
     date_fmt = r"%H:%M:%S"
     stdout_fmt = "%(levelname)s: %(message)s"
@@ -29,6 +112,7 @@ def init_logger(
     )
 
     handler: logging.Handler
+    handlers: List[logging.Handler] = []
 
     if stdout:
         handler = logging.StreamHandler(sys.stdout)
@@ -39,13 +123,51 @@ def init_logger(
         else:
             handler.setFormatter(logging.Formatter(stdout_fmt, date_fmt))
 
-        log.addHandler(handler)
+        handlers.append(handler)
 
     if file_path:
-        handler = logging.FileHandler(file_path)
+        if rotate:
+            handler = logging.handlers.TimedRotatingFileHandler(
+                file_path, when=rotate, backupCount=backups
+            )
+        elif max_bytes > 0:
+            handler = logging.handlers.RotatingFileHandler(
+                file_path, maxBytes=max_bytes, backupCount=backups
+            )
+        else:
+            handler = logging.FileHandler(file_path)
+
+        if compress and isinstance(handler, logging.handlers.BaseRotatingHandler):
+            handler.namer = lambda name: f"{name}.gz"
+            handler.rotator = compress_rotator
+
         handler.setLevel(logging.DEBUG)
         handler.setFormatter(logging.Formatter(verbose_fmt, date_fmt))
 
-        log.addHandler(handler)
+        handlers.append(handler)
+
+    if handlers:
+        stop_logger()
+        records: queue.Queue = queue.Queue()
+        LISTENER = logging.handlers.QueueListener(
+            records, *handlers, respect_handler_level=True
+        )
+        LISTENER.start()
+        atexit.register(stop_logger)
+
+        log.addHandler(QueueHandler(records))
 
     return log
+
+
+def init_worker_logger(records: Any, workspace: str, debug: bool = False) -> None:
+    """
+    Send all logging from a worker process to the supervisor's queue.
+
+    Records are formatted before they are pickled, and written out by the
+    supervisor's handlers along with those of every other workspace.
+    """
+    log = logging.getLogger("")
+    log.setLevel(logging.DEBUG if debug else logging.INFO)
+    level_names()
+    log.addHandler(WorkerQueueHandler(records, workspace))
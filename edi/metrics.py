@@ -0,0 +1,134 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, TypeVar
+
+T = TypeVar("T")
+Labels = Tuple[Tuple[str, str], ...]
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket containing it."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Registry of counters, histograms, and gauges, labeled by name and key/value.
+
+    Lookups return the same object for the same name and labels, so hot paths
+    can hold onto a histogram or counter key rather than looking it up each time.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, Callable[[], float]]] = {}
+
+    @staticmethod
+    def labels(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def histogram(self, name: str, **labels: Any) -> Histogram:
+        series = self.histograms.setdefault(name, {})
+        key = self.labels(labels)
+        if key not in series:
+            series[key] = Histogram()
+        return series[key]
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        self.histogram(name, **labels).observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        series = self.counters.setdefault(name, {})
+        key = self.labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def gauge(self, name: str, fn: Callable[[], float], **labels: Any) -> None:
+        """Register a callback to report a current value, like a queue depth."""
+        self.gauges.setdefault(name, {})[self.labels(labels)] = fn
+
+    def timed(
+        self, fn: Callable[..., Awaitable[T]], histogram: Histogram
+    ) -> Callable[..., Awaitable[T]]:
+        """Wrap a coroutine function to record its run time in a histogram."""
+
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            before = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - before)
+
+        wrapper.__name__ = getattr(fn, "__name__", "timed")
+        return wrapper
+
+    def prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+
+        def fmt(labels: Labels, extra: str = "") -> str:
+            pairs = [f'{k}="{v}"' for k, v in labels]
+            if extra:
+                pairs.append(extra)
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines: List[str] = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{fmt(labels)} {value}")
+
+        for name, gauges in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for labels, fn in gauges.items():
+                try:
+                    lines.append(f"{name}{fmt(labels)} {fn()}")
+                except Exception:
+                    continue
+
+        for name, histograms in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in histograms.items():
+                total = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    total += count
+                    le = fmt(labels, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{le} {total}")
+                le = fmt(labels, 'le="+Inf"')
+                lines.append(f"{name}_bucket{le} {h.count}")
+                lines.append(f"{name}_sum{fmt(labels)} {h.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {h.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
@@ -0,0 +1,75 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    Bounded queue of work drained by a fixed number of async workers.
+
+    Items submitted with the same key always land on the same worker, so they
+    are processed in the order they were submitted, while items with different
+    keys can be processed concurrently.  Submitting blocks once a worker's queue
+    is full, applying backpressure to the producer.
+    """
+
+    def __init__(
+        self, handler: Callable[[Any], Awaitable[None]], workers: int, maxsize: int
+    ) -> None:
+        if workers < 1:
+            raise ValueError("worker pool needs at least one worker")
+
+        self.handler = handler
+        size = max(1, -(-maxsize // workers))  # ceiling division
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(size) for _ in range(workers)]
+        self.tasks: List[asyncio.Future] = []
+
+    def __len__(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop."""
+        if self.tasks:
+            return
+
+        self.tasks = [
+            asyncio.ensure_future(self.worker(queue)) for queue in self.queues
+        ]
+        log.debug(f"started {len(self.tasks)} workers")
+
+    async def submit(self, key: Optional[str], item: Any) -> None:
+        """Queue an item for processing, waiting if the worker's queue is full."""
+        queue = self.queues[hash(key) % len(self.queues)]
+        await queue.put(item)
+
+    async def join(self) -> None:
+        """Wait until all queued items have been processed."""
+        await asyncio.gather(*[queue.join() for queue in self.queues])
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Process queued items for up to `timeout` seconds, then cancel workers."""
+        if self.tasks and timeout > 0:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                log.warning(f"dropping {len(self)} queued items after {timeout}s")
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            try:
+                await self.handler(item)
+            except Exception:
+                log.exception("uncaught exception in worker")
+            finally:
+                queue.task_done()
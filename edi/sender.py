@@ -0,0 +1,181 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from attr import Factory, dataclass
+
+from aioslack import Slack, SlackError
+
+from .metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+API_URL = "https://slack.com/api/{method}"
+
+
+class RateLimited(SlackError):
+    """Slack asked us to wait before posting again."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"rate limited for {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Message:
+    channel: str
+    text: str
+    kwargs: Dict[str, Any]
+    futures: List[asyncio.Future] = Factory(list)
+
+
+class Sender:
+    """
+    Outbound message queue, paced per channel.
+
+    Messages are queued per channel and posted no more often than once every
+    `interval` seconds per channel, honoring Retry-After when Slack responds with
+    a rate limit.  Consecutive queued messages to the same channel with the same
+    options are merged into a single post, up to `coalesce` characters.
+    """
+
+    def __init__(
+        self,
+        slack: Callable[[], Slack],
+        interval: float = 1.0,
+        coalesce: int = 3000,
+        retries: int = 3,
+    ) -> None:
+        self.slack = slack
+        self.interval = interval
+        self.coalesce = coalesce
+        self.retries = retries
+
+        self.queues: Dict[str, Deque[Message]] = {}
+        self.tasks: Dict[str, asyncio.Future] = {}
+        self.next_post: Dict[str, float] = {}
+
+        METRICS.gauge("edi_send_queue", lambda: len(self))
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def post(self, channel: str, text: str, **kwargs: Any) -> asyncio.Future:
+        """Queue a message for the channel, returning a future for its delivery."""
+        kwargs.setdefault("as_user", True)
+        future = asyncio.get_event_loop().create_future()
+        # failures are already logged, so fire-and-forget callers can ignore them
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        message = Message(channel=channel, text=text, kwargs=kwargs, futures=[future])
+        self.queues.setdefault(channel, deque()).append(message)
+
+        if channel not in self.tasks:
+            self.tasks[channel] = asyncio.ensure_future(self.drain(channel))
+
+        return future
+
+    async def send(self, channel: str, text: str, **kwargs: Any) -> None:
+        """Queue a message for the channel, and wait until it has been posted."""
+        await self.post(channel, text, **kwargs)
+
+    async def stop(self) -> None:
+        """Cancel all pending deliveries."""
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+        for queue in self.queues.values():
+            for message in queue:
+                for future in message.futures:
+                    future.cancel()
+        self.queues.clear()
+
+    def next_message(self, queue: Deque[Message]) -> Message:
+        """Pop the next message, merging any similar messages that follow it."""
+        message = queue.popleft()
+        while (
+            self.coalesce
+            and queue
+            and queue[0].kwargs == message.kwargs
+            and len(message.text) + len(queue[0].text) + 1 <= self.coalesce
+        ):
+            following = queue.popleft()
+            message.text = f"{message.text}\n{following.text}"
+            message.futures.extend(following.futures)
+            METRICS.increment("edi_send_coalesced_total")
+        return message
+
+    async def drain(self, channel: str) -> None:
+        queue = self.queues[channel]
+        try:
+            while queue:
+                wait = self.next_post.get(channel, 0) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                message = self.next_message(queue)
+                error: Optional[Exception] = None
+                try:
+                    await self.deliver(message)
+                except Exception as e:
+                    log.exception(f"failed to post message to {channel}")
+                    error = e
+
+                for future in message.futures:
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+
+        finally:
+            self.tasks.pop(channel, None)
+            if not queue:
+                self.queues.pop(channel, None)
+
+    async def deliver(self, message: Message) -> None:
+        attempt = 0
+        while True:
+            self.next_post[message.channel] = time.monotonic() + self.interval
+            try:
+                await self.api(
+                    "chat.postMessage",
+                    channel=message.channel,
+                    text=message.text,
+                    **message.kwargs,
+                )
+                METRICS.increment("edi_send_total")
+                return
+
+            except RateLimited as e:
+                METRICS.increment("edi_send_ratelimited_total")
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                log.warning(f"rate limited posting to {message.channel}, waiting")
+                self.next_post[message.channel] = time.monotonic() + e.retry_after
+                await asyncio.sleep(e.retry_after)
+
+    async def api(self, method: str, **kwargs: Any) -> Dict[str, Any]:
+        """Call the web API directly, so that rate limit headers are visible."""
+        slack = self.slack()
+        async with slack.session.post(
+            API_URL.format(method=method), data=kwargs
+        ) as response:
+            if response.status == 429:
+                raise RateLimited(float(response.headers.get("Retry-After", 1)))
+            if response.status != 200:
+                raise SlackError(f"{method} returned status {response.status}")
+
+            value = await response.json()
+            if not value.get("ok", False):
+                if value.get("error", "") == "ratelimited":
+                    raise RateLimited(float(response.headers.get("Retry-After", 1)))
+                raise SlackError(f'{method} error: "{value.get("error")}"', kwargs)
+            return value
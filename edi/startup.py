@@ -0,0 +1,42 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """Record how long each phase of startup takes, for --startup-profile."""
+
+    def __init__(self) -> None:
+        self.created = time.perf_counter()
+        self.timings: List[Tuple[str, float]] = []
+
+    def add(self, name: str, duration: float) -> None:
+        self.timings.append((name, duration))
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        before = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - before)
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.created
+        width = max([len(name) for name, _duration in self.timings] + [5])
+        lines = ["startup profile:"]
+        lines.extend(
+            f"  {name:<{width}} {duration * 1000:9.1f} ms"
+            for name, duration in self.timings
+        )
+        lines.append(f"  {'total':<{width}} {total * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+
+PROFILE = StartupProfile()
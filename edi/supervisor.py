@@ -0,0 +1,358 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from importlib import import_module
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from attr import dataclass
+
+from .bot import Edi
+from .config import Config
+from .core import backoff
+from .log import ForwardHandler, init_logger, init_worker_logger, stop_logger
+from .metrics import METRICS
+from .units import MANIFEST
+
+log = logging.getLogger(__name__)
+
+
+# settings naming files that a worker writes or imports, the unit using them, and
+# the settings the unit needs before it uses the file; no two workspaces may
+# resolve any of them to the same path
+SHARED_PATHS: Tuple[Tuple[str, str, str, Tuple[str, ...]], ...] = (
+    ("bot", "db_path", "", ()),
+    ("chatlog", "root", "ChatLog", ()),
+    ("quotes", "db_path", "Quotes", ()),
+    ("quotes", "recents_path", "Quotes", ()),
+    ("stats", "prometheus_path", "Stats", ()),
+    (
+        "twitter",
+        "state_path",
+        "Twitter",
+        ("consumer_key", "consumer_secret", "access_key", "access_secret"),
+    ),
+)
+
+
+def import_unit_configs() -> Set[str]:
+    """Import the units naming shared paths, for their config tables."""
+    available = {""}
+    for unit in {unit for _table, _key, unit, _required in SHARED_PATHS if unit}:
+        try:
+            import_module(f"edi.units.{MANIFEST[unit]}")
+            available.add(unit)
+        except ImportError:
+            continue  # workers can't load it either
+    return available
+
+
+def load_workspace(path: str, workspace: str) -> Config:
+    """
+    Load a workspace's config, with its own copy of each default shared path.
+
+    Paths left unset in the config file get the workspace name appended, so
+    `edi.db` becomes `edi-<workspace>.db`; paths set explicitly are kept.
+    """
+    import_unit_configs()
+    config = Config.load_from_file(path, workspace=workspace)
+    for table, key, _unit, _required in SHARED_PATHS:
+        if config.is_set(table, key):
+            continue
+        try:
+            default = getattr(getattr(config, table), key)
+        except AttributeError:
+            continue  # table of a unit that can't be imported
+        if default:
+            value = Path(default)
+            value = value.with_name(f"{value.stem}-{workspace}{value.suffix}")
+            config.override(table, key, str(value))
+    return config
+
+
+@dataclass
+class supervisor(Config):
+    status_path: str = ""
+    heartbeat: float = 10.0
+    stall_timeout: float = 60.0
+    restart_min: float = 1.0
+    restart_max: float = 300.0
+    shutdown_timeout: float = 10.0
+
+
+def send_heartbeats(edi: Edi, workspace: str, status: Any, interval: float) -> None:
+    """Report the worker's event loop lag to the supervisor, from a thread."""
+    while True:
+        time.sleep(interval)
+        loop = getattr(edi, "loop", None)
+        if loop is None or not loop.is_running():
+            continue
+
+        before = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop)
+        try:
+            future.result(interval)
+        except concurrent.futures.TimeoutError:
+            # a stalled loop sends nothing, and the supervisor will notice
+            continue
+
+        reconnects = METRICS.counters.get("edi_reconnects_total", {}).get((), 0)
+        status.put(
+            (workspace, os.getpid(), time.perf_counter() - before, int(reconnects))
+        )
+
+
+def run_worker(
+    path: str, workspace: str, records: Any, status: Any, debug: bool
+) -> None:
+    """Entry point for a worker process, running the bot for one workspace."""
+    config = load_workspace(path, workspace)
+    if debug:
+        config.bot.debug = True
+
+    init_worker_logger(records, workspace, config.bot.debug)
+    edi = Edi(config)
+    heartbeat = threading.Thread(
+        target=send_heartbeats,
+        args=(edi, workspace, status, config.supervisor.heartbeat),
+        name="edi-heartbeat",
+        daemon=True,
+    )
+    heartbeat.start()
+
+    edi.start()
+
+
+class Worker:
+    """State of the process running one workspace."""
+
+    def __init__(self, workspace: str) -> None:
+        self.workspace = workspace
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.started = 0.0
+        self.seen = 0.0
+        self.next_start = 0.0
+        self.failures = 0
+        self.restarts = 0
+        self.exitcode: Optional[int] = None
+        self.lag = 0.0
+        self.reconnects = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def status(self, now: float) -> Dict[str, Any]:
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive,
+            "uptime": round(now - self.started, 3) if self.alive else 0,
+            "heartbeat_age": round(now - self.seen, 3) if self.alive else None,
+            "loop_lag": round(self.lag, 6),
+            "reconnects": self.reconnects,
+            "restarts": self.restarts,
+            "exitcode": self.exitcode,
+        }
+
+
+class Supervisor:
+    """
+    Run one worker process for each workspace in a config file.
+
+    `Edi` and the command registry are process-wide, so each workspace gets a
+    process of its own, configured by its `[workspaces.<name>.*]` tables merged
+    over the shared ones, with their own copy of any data paths left at their
+    defaults.  Workers that exit or stop sending heartbeats are restarted with
+    backoff; their logs are written by this process's handlers, and their
+    health is collected into a single status file.
+    """
+
+    def __init__(self, path: str, config: Config) -> None:
+        self.path = path
+        self.config: supervisor = config.supervisor
+        self.debug = config.bot.debug
+        self.running = False
+
+        names = config.workspace_names()
+        if not names:
+            raise ValueError(f"no [workspaces.*] tables found in {path}")
+        self.check_paths(names)
+
+        self.context = multiprocessing.get_context("spawn")
+        self.records = self.context.Queue()
+        self.status = self.context.Queue()
+        self.workers = {name: Worker(name) for name in names}
+
+    def check_paths(self, names: List[str]) -> None:
+        """Workspaces must not share files, or their units' data would mix."""
+        available = import_unit_configs()
+        seen: Dict[str, Tuple[str, str]] = {}
+        for name in names:
+            config = load_workspace(self.path, name)
+            disabled = config.units.disable_units
+            for table, key, unit, required in SHARED_PATHS:
+                if unit not in available or unit in disabled:
+                    continue
+                settings = getattr(config, table)
+                value = getattr(settings, key)
+                if not value or not all(getattr(settings, r) for r in required):
+                    continue
+
+                setting = f"{table}.{key}"
+                path = str(Path(value).expanduser().resolve())
+                if path in seen:
+                    other, other_setting = seen[path]
+                    raise ValueError(
+                        f"workspaces {other} ({other_setting}) and {name} "
+                        f"({setting}) share {path}"
+                    )
+                seen[path] = (name, setting)
+
+    def spawn(self, worker: Worker, now: float) -> None:
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(self.path, worker.workspace, self.records, self.status, self.debug),
+            name=f"edi-{worker.workspace}",
+        )
+        worker.process.start()
+        worker.started = worker.seen = now
+        worker.exitcode = None
+        log.info(f"started workspace {worker.workspace} as pid {worker.process.pid}")
+
+    def check(self, now: float) -> None:
+        """Start workers that are due, and reap those that died or stalled."""
+        for worker in self.workers.values():
+            if worker.process is None:
+                if now >= worker.next_start:
+                    self.spawn(worker, now)
+
+            elif not worker.process.is_alive():
+                worker.exitcode = worker.process.exitcode
+                worker.process = None
+                worker.failures += 1
+                worker.restarts += 1
+                delay = backoff(
+                    worker.failures, self.config.restart_min, self.config.restart_max
+                )
+                worker.next_start = now + delay
+                log.warning(
+                    f"workspace {worker.workspace} exited with code "
+                    f"{worker.exitcode}, restarting in {delay:.1f}s"
+                )
+
+            elif now - worker.seen > self.config.stall_timeout:
+                log.error(
+                    f"workspace {worker.workspace} sent no heartbeat for "
+                    f"{now - worker.seen:.1f}s, killing pid {worker.process.pid}"
+                )
+                # a stalled loop would never handle SIGTERM
+                os.kill(worker.process.pid, signal.SIGKILL)
+                worker.seen = now
+
+    def heartbeat(self, workspace: str, pid: int, lag: float, reconnects: int) -> None:
+        worker = self.workers.get(workspace)
+        if worker is None or worker.process is None or worker.process.pid != pid:
+            return
+
+        now = time.monotonic()
+        worker.seen = now
+        worker.lag = lag
+        worker.reconnects = reconnects
+        if worker.failures and now - worker.started > self.config.stall_timeout:
+            worker.failures = 0
+
+    def write_status(self, now: float) -> None:
+        if not self.config.status_path:
+            return
+
+        path = Path(self.config.status_path).expanduser()
+        tmp = path.with_name(path.name + ".tmp")
+        status = {name: worker.status(now) for name, worker in self.workers.items()}
+        try:
+            with open(tmp, "w") as fd:
+                json.dump({"time": time.time(), "workspaces": status}, fd, indent=2)
+            os.replace(tmp, path)
+        except OSError:
+            log.exception(f"failed to write status to {path}")
+
+    def stop(self, *args: Any) -> None:
+        log.warning("Signal received, stopping workers")
+        self.running = False
+
+    def shutdown(self) -> None:
+        """Ask every worker to stop, and kill those that take too long."""
+        workers = [w for w in self.workers.values() if w.process is not None]
+        for worker in workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+        deadline = time.monotonic() + self.config.shutdown_timeout
+        for worker in workers:
+            worker.process.join(max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                log.warning(f"workspace {worker.workspace} did not stop, killing")
+                os.kill(worker.process.pid, signal.SIGKILL)
+                worker.process.join()
+            worker.exitcode = worker.process.exitcode
+            worker.process = None
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        forwarder = logging.handlers.QueueListener(self.records, ForwardHandler())
+        forwarder.start()
+        self.running = True
+        log.info(f"supervising {len(self.workers)} workspaces from {self.path}")
+
+        try:
+            while self.running:
+                now = time.monotonic()
+                self.check(now)
+                self.write_status(now)
+
+                deadline = now + 1.0
+                while self.running:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        self.heartbeat(*self.status.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+
+        finally:
+            self.shutdown()
+            self.write_status(time.monotonic())
+            forwarder.stop()
+            log.info("Goodbye!")
+
+
+def supervise(path: str, config: Config) -> None:
+    """Run every workspace in the config file under a supervisor process."""
+
+    init_logger(
+        stdout=True,
+        file_path=config.bot.log,
+        debug=config.bot.debug,
+        max_bytes=config.bot.log_max_bytes,
+        backups=config.bot.log_backups,
+        rotate=config.bot.log_rotate,
+        compress=config.bot.log_compress,
+    )
+
+    try:
+        Supervisor(path, config).run()
+    finally:
+        stop_logger()
@@ -7,14 +7,39 @@ import logging
 from pathlib import Path
 from importlib import import_module
 from types import ModuleType
-from typing import List
+from typing import Any, Dict, Iterable, List
+
+from ..startup import PROFILE
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # python < 3.8
+    entry_points = None
 
 log = logging.getLogger(__name__)
 
+# module for each bundled unit, so that disabled units are never imported
+MANIFEST: Dict[str, str] = {
+    "ChatLog": "chatlog",
+    "Help": "help",
+    "Quotes": "quotes",
+    "Stats": "stats",
+    "Twitter": "twitter",
+}
+
+# third party packages can register units as "UnitName = package.module:UnitName"
+ENTRY_POINT_GROUP = "edi.units"
 
-def import_units(root: Path = None) -> List[ModuleType]:
-    """Find and import units in this path."""
+
+def import_units(root: Path = None, disabled: Iterable[str] = ()) -> List[ModuleType]:
+    """Find and import units in this path, and from entry points, if enabled."""
     modules: List[ModuleType] = []
+    disabled = set(disabled)
+    skipped = {
+        name
+        for name in set(MANIFEST.values())
+        if all(u in disabled for u, module in MANIFEST.items() if module == name)
+    }
 
     if root is None:
         root = Path(__file__)
@@ -26,7 +51,35 @@ def import_units(root: Path = None) -> List[ModuleType]:
         name = path.stem
         if name.startswith("_"):
             continue
+        if name in skipped:
+            log.debug(f"Skipping disabled unit {name}")
+            continue
         log.debug(f"Loading unit {name}")
-        module = import_module(f"edi.units.{name}")
+        with PROFILE.measure(f"import edi.units.{name}"):
+            module = import_module(f"edi.units.{name}")
         modules.append(module)
+
+    for entry_point in unit_entry_points():
+        if entry_point.name in disabled:
+            log.debug(f"Skipping disabled unit {entry_point.name}")
+            continue
+        log.debug(f"Loading unit {entry_point.name} from {entry_point.value}")
+        with PROFILE.measure(f"import {entry_point.value}"):
+            try:
+                entry_point.load()
+            except Exception:
+                log.exception(f"failed to load unit {entry_point.name}")
+                continue
+        modules.append(import_module(entry_point.value.partition(":")[0].strip()))
+
     return modules
+
+
+def unit_entry_points() -> List[Any]:
+    """Return entry points registered for the edi.units group."""
+    if entry_points is None:
+        return []
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return list(eps.select(group=ENTRY_POINT_GROUP))
+    return list(eps.get(ENTRY_POINT_GROUP, []))
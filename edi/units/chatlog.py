@@ -1,69 +1,656 @@
 # Copyright 2017 John Reese
 # Licensed under the MIT license
 
+import asyncio
+import gzip
 import logging
-from datetime import datetime
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, TextIO, Tuple
 
-from aioslack import Event
-from edi import Config, Edi, Unit
+from attr import dataclass
+
+from aioslack import Channel, Event, User
+from edi import Config, Context, Edi, Unit, command
+from edi.db import EdiDb, fts_match
+from edi.metrics import METRICS
 
 log = logging.getLogger(__name__)
 
 
+@dataclass
 class chatlog(Config):
     root: str = "~/slacklogs"
     format: str = "[{time}] {message}"
+    flush_lines: int = 100
+    flush_interval: float = 1.0
+    cache_size: int = 5000
+    index_interval: float = 60.0
+    search_limit: int = 5
+    archive_days: int = 30
+    archive_interval: float = 3600.0
+    archive_workers: int = 2
+
+
+class LogWriter:
+    """
+    Append lines to log files from a background thread.
+
+    Lines are queued without touching the file system, and the writer thread
+    batches them, keeping one open handle per directory (ie, per channel) until
+    the target file changes at midnight or the handle sits idle.  Pending lines
+    are flushed once `flush_lines` are queued or `flush_interval` has passed.
+    Files claimed by the archiver are closed, and lines for them are held back
+    until they are released.
+    """
+
+    IDLE_TIMEOUT = 300.0
+
+    def __init__(self, flush_lines: int = 100, flush_interval: float = 1.0) -> None:
+        self.flush_lines = max(1, flush_lines)
+        self.flush_interval = flush_interval
+        self.queue: "queue.Queue[Optional[Tuple[Path, str]]]" = queue.Queue()
+        self.handles: Dict[Path, Tuple[Path, TextIO, float]] = {}
+        self.claimed: Set[Path] = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self.run, name="chatlog-writer", daemon=True
+        )
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Flush everything pending, close all files, and wait for the thread."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def write(self, path: Path, line: str) -> None:
+        """Queue a line to be appended to the given file."""
+        self.queue.put((path, line))
+
+    def claim(self, paths: Iterable[Path]) -> None:
+        """Close these files, and hold back writes to them until released."""
+        with self.lock:
+            self.claimed.update(paths)
+            for key, (path, fd, _last_used) in list(self.handles.items()):
+                if path in self.claimed:
+                    fd.close()
+                    del self.handles[key]
+
+    def release(self, paths: Iterable[Path]) -> None:
+        with self.lock:
+            self.claimed.difference_update(paths)
+
+    def run(self) -> None:
+        pending: Dict[Path, List[str]] = {}
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                pass
+            else:
+                if item is None:
+                    # the archiver has stopped by now, so nothing is held back
+                    self.claimed.clear()
+                    self.flush(pending)
+                    self.close()
+                    return
+
+                path, line = item
+                pending.setdefault(path, []).append(line)
+                count += 1
+
+            if count >= self.flush_lines or time.monotonic() >= deadline:
+                pending = self.flush(pending)
+                count = 0
+                deadline = time.monotonic() + self.flush_interval
+
+    def flush(self, pending: Dict[Path, List[str]]) -> Dict[Path, List[str]]:
+        """Write pending lines, and return those held back for claimed files."""
+        held: Dict[Path, List[str]] = {}
+        now = time.monotonic()
+        with self.lock:
+            for path, lines in pending.items():
+                if path in self.claimed:
+                    held[path] = lines
+                    continue
+                try:
+                    fd = self.open(path, now)
+                    fd.write("".join(lines))
+                    fd.flush()
+                except OSError:
+                    log.exception(f"failed to write {len(lines)} lines to {path}")
+
+            for key, (path, fd, last_used) in list(self.handles.items()):
+                if now - last_used > self.IDLE_TIMEOUT:
+                    fd.close()
+                    del self.handles[key]
+
+        return held
+
+    def open(self, path: Path, now: float) -> TextIO:
+        key = path.parent
+        if key in self.handles:
+            current, fd, _last_used = self.handles[key]
+            if current == path:
+                self.handles[key] = (path, fd, now)
+                return fd
+            fd.close()  # rolled over to a new day
+
+        key.mkdir(parents=True, exist_ok=True)
+        # kept open across writes, and closed by close() or when rolled over
+        fd = open(path, "a")  # pylint: disable=consider-using-with
+        self.handles[key] = (path, fd, now)
+        return fd
+
+    def close(self) -> None:
+        for _path, fd, _last_used in self.handles.values():
+            fd.close()
+        self.handles.clear()
+
+
+# schema changes applied in order, tracked in the "chatlog" namespace by EdiDb
+MIGRATIONS: List[List[str]] = [
+    [
+        # 1: indexed lines, and how far into each log file they have been read
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS chatlog_fts
+        USING fts5(
+            line, team UNINDEXED, channel UNINDEXED, date UNINDEXED, path UNINDEXED
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chatlog_files (
+            path TEXT PRIMARY KEY,
+            offset INTEGER
+        )
+        """,
+    ]
+]
+
+# path relative to the log root, old offset, new offset, rows to index
+Chunk = Tuple[str, int, int, List[Tuple[str, str, str, str, str]]]
+
+
+class LogIndex:
+    """
+    Incremental full text index of the log tree, kept in the shared database.
+
+    Each pass reads only the complete lines appended to each log file since the
+    offset recorded for it, in a worker thread, and stores those lines and the
+    new offsets in one transaction, so indexing picks up where it left off after
+    a restart.  Passes are kept small, and locks are released between them, so a
+    long backlog never holds up searches or other writers to the database.
+    """
+
+    BATCH_BYTES = 1024 * 1024
+
+    def __init__(self, db: EdiDb, root: Path) -> None:
+        self.db = db
+        self.root = root
+        self.offsets: Dict[str, int] = {}
+        self.lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        await self.db.migrate("chatlog", MIGRATIONS)
+        rows = await self.db.fetchall("SELECT path, offset FROM chatlog_files")
+        self.offsets = {path: offset for path, offset in rows}
+
+    async def update(self) -> int:
+        """Index any new lines, and return how many were added."""
+        total = 0
+        while True:
+            count = await self.index_pass()
+            if count is None:
+                return total
+            total += count
+
+    async def index_pass(self) -> Optional[int]:
+        """Index up to BATCH_BYTES of new lines, returning None if there were none."""
+        async with self.lock:
+            loop = asyncio.get_event_loop()
+            chunks = await loop.run_in_executor(None, self.scan, dict(self.offsets))
+            if not chunks:
+                return None
+
+            async with self.db.transaction() as cursor:
+                for path, start, end, rows in chunks:
+                    if start == 0 and self.offsets.get(path, 0):
+                        # file was truncated or replaced, so start over
+                        await cursor.execute(
+                            "DELETE FROM chatlog_fts WHERE path = ?", [path]
+                        )
+                    await cursor.executemany(
+                        """
+                        INSERT INTO chatlog_fts (line, team, channel, date, path)
+                        VALUES (?, ?, ?, ?, ?)
+                        """,
+                        rows,
+                    )
+                    await cursor.execute(
+                        "INSERT OR REPLACE INTO chatlog_files VALUES (?, ?)",
+                        [path, end],
+                    )
+
+            count = 0
+            for path, _start, end, rows in chunks:
+                self.offsets[path] = end
+                count += len(rows)
+            METRICS.increment("edi_chatlog_indexed_lines_total", count)
+            return count
+
+    def scan(self, offsets: Dict[str, int]) -> List[Chunk]:
+        """Read new complete lines from log files, up to BATCH_BYTES per pass."""
+        chunks: List[Chunk] = []
+        budget = self.BATCH_BYTES
+
+        for path in sorted(self.root.glob("*/*/*.log")):
+            key = str(path.relative_to(self.root))
+            offset = offsets.get(key, 0)
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+
+            if size == offset:
+                continue
+            if size < offset:
+                offset = 0
+
+            try:
+                with open(path, "rb") as fd:
+                    fd.seek(offset)
+                    data = fd.read(min(size - offset, budget))
+            except OSError:
+                continue  # archived since we looked
+            end = data.rfind(b"\n") + 1
+            if not end:
+                continue
+
+            team, channel, _filename = path.relative_to(self.root).parts
+            date = path.stem
+            rows = [
+                (line, team, channel, date, key)
+                for line in data[:end].decode(errors="replace").splitlines()
+                if line
+            ]
+            chunks.append((key, offset, offset + end, rows))
+
+            budget -= end
+            if budget <= 0:
+                break
+
+        return chunks
+
+    async def forget(self, path: str) -> None:
+        """
+        Drop the offset of a log file that has been archived.
+
+        Its lines stay in the index.  If the file is created again, eg for a late
+        reaction to an old message, the new file is indexed from the start.
+        """
+        async with self.lock:
+            await self.db.execute("DELETE FROM chatlog_files WHERE path = ?", [path])
+            self.offsets.pop(path, None)
+
+    async def search(
+        self, terms: str, team: str, channel: str = "", limit: int = 5
+    ) -> List[Tuple[str, str, str]]:
+        """Find log lines containing all the given words, as (channel, date, line)."""
+        match = fts_match(terms)
+        if not match:
+            return []
+
+        query = """
+            SELECT channel, date, line FROM chatlog_fts
+            WHERE chatlog_fts MATCH ? AND team = ?
+        """
+        params = [match, team]
+        if channel:
+            query += " AND channel = ? "
+            params.append(channel)
+        query += " ORDER BY rank LIMIT ? "
+        params.append(limit)
+
+        return [tuple(row) for row in await self.db.fetchall(query, params)]
+
+
+def open_log(path: Path) -> TextIO:
+    """Open a log file for reading as text, whether it has been archived or not."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", errors="replace")  # type: ignore
+    return open(path, errors="replace")
+
+
+def log_files(root: Path) -> List[Path]:
+    """Find all log files, archived or not, ordered by team, channel, and date."""
+    return sorted(
+        list(root.glob("*/*/*.log")) + list(root.glob("*/*/*.log.gz")),
+        key=lambda path: (path.parent, path.name.split(".")[0], path.suffix),
+    )
+
+
+def archive_log(path: Path) -> Tuple[int, int]:
+    """
+    Compress a log file to `<name>.log.gz` and remove the original.
+
+    If the archive already exists, the log is appended to it as another gzip
+    member, which readers see as one continuous file.  Returns the size of the
+    original file and the number of compressed bytes written.
+    """
+    dest = path.with_name(path.name + ".gz")
+    tmp = path.with_name(path.name + ".gz.tmp")
+    existing = dest.stat().st_size if dest.exists() else 0
+    if existing:
+        shutil.copyfile(dest, tmp)
+
+    with open(path, "rb") as src, gzip.open(tmp, "ab", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    size = path.stat().st_size
+
+    os.replace(tmp, dest)
+    path.unlink()
+    return size, dest.stat().st_size - existing
+
+
+class LogArchiver:
+    """
+    Compress daily log files once they are older than a given number of days.
+
+    Compression runs in a pool of worker threads, as zlib releases the GIL while
+    it works.  Files are claimed from the writer first, so that nothing is
+    written to them while they are indexed and compressed, and the index then
+    forgets their offsets.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        index: LogIndex,
+        days: int,
+        workers: int,
+        writer: Optional[LogWriter] = None,
+    ) -> None:
+        self.root = root
+        self.index = index
+        self.writer = writer
+        self.days = days
+        self.pool = ThreadPoolExecutor(max(1, workers), "chatlog-archiver")
+
+        # bytes on disk by state, updated on each pass
+        self.usage = {"plain": 0, "archived": 0}
+        METRICS.gauge("edi_chatlog_bytes", lambda: self.usage["plain"], state="plain")
+        METRICS.gauge(
+            "edi_chatlog_bytes", lambda: self.usage["archived"], state="archived"
+        )
+
+    def stop(self) -> None:
+        self.pool.shutdown(wait=True)
+
+    def candidates(self) -> List[Path]:
+        """Find logs due to be archived, and total up disk usage while at it."""
+        cutoff = (datetime.now() - timedelta(days=self.days)).strftime(r"%Y-%m-%d")
+        usage = {"plain": 0, "archived": 0}
+        found = []
+        for path in log_files(self.root):
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+            if path.suffix == ".gz":
+                usage["archived"] += size
+            else:
+                usage["plain"] += size
+                if path.stem < cutoff:
+                    found.append(path)
+        self.usage = usage
+        return found
+
+    async def run_once(self) -> int:
+        """Archive all logs that are due, and return how many were archived."""
+        loop = asyncio.get_event_loop()
+        paths = await loop.run_in_executor(self.pool, self.candidates)
+        if not paths:
+            return 0
+
+        if self.writer is None:
+            return await self.archive(paths)
+
+        # lines written meanwhile go to a new file, indexed from the start
+        self.writer.claim(paths)
+        try:
+            count = await self.archive(paths)
+        except asyncio.CancelledError:
+            # compression may still be running in the pool, so the claims stay
+            # until the writer stops, which happens after the pool has finished
+            raise
+        except Exception:
+            self.writer.release(paths)
+            raise
+        self.writer.release(paths)
+        return count
+
+    async def archive(self, paths: List[Path]) -> int:
+        loop = asyncio.get_event_loop()
+        await self.index.update()
+
+        before = time.perf_counter()
+        results = await asyncio.gather(
+            *[loop.run_in_executor(self.pool, archive_log, path) for path in paths],
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - before
+
+        count = original = compressed = 0
+        for path, result in zip(paths, results):
+            if isinstance(result, BaseException):
+                log.error(f"failed to archive {path}: {result}")
+                continue
+            await self.index.forget(str(path.relative_to(self.root)))
+            count += 1
+            original += result[0]
+            compressed += result[1]
+            self.usage["plain"] -= result[0]
+            self.usage["archived"] += result[1]
+
+        METRICS.increment("edi_chatlog_archived_files_total", count)
+        METRICS.increment("edi_chatlog_archived_bytes_total", original)
+        log.info(
+            f"archived {count} logs in {elapsed:.1f}s, "
+            f"{original / 1e6:.1f} MB to {compressed / 1e6:.1f} MB "
+            f"({original / 1e6 / max(elapsed, 1e-6):.1f} MB/s)"
+        )
+        return count
 
 
 class ChatLog(Unit):
     async def start(self) -> None:
         config: chatlog = Edi().config.chatlog
-        self.root = Path(config.root).expanduser()
+        self.base = Path(config.root).expanduser()
+        self.root = self.base
         self.format = config.format
+        self.writer = LogWriter(config.flush_lines, config.flush_interval)
+        self.writer.start()
+
+        # (channel id, ts) -> (user id, text) of recent messages, oldest first
+        self.cache_size = config.cache_size
+        self.recent: "OrderedDict[Tuple[str, str], Tuple[str, str]]" = OrderedDict()
+        self.lookups: Dict[Tuple[str, str], asyncio.Future] = {}
+
+        self.search_limit = config.search_limit
+        self.index = LogIndex(Edi().db, self.base)
+        await self.index.start()
+        self.indexer: Optional[asyncio.Future] = None
+        if config.index_interval > 0:
+            self.indexer = asyncio.ensure_future(self.run_index(config.index_interval))
+
+        self.archiver: Optional[LogArchiver] = None
+        self.archiving: Optional[asyncio.Future] = None
+        if config.archive_days > 0:
+            self.archiver = LogArchiver(
+                self.base,
+                self.index,
+                config.archive_days,
+                config.archive_workers,
+                writer=self.writer,
+            )
+            self.archiving = asyncio.ensure_future(
+                self.run_archive(config.archive_interval)
+            )
+
+    async def stop(self) -> None:
+        if self.indexer is not None:
+            self.indexer.cancel()
+            await asyncio.gather(self.indexer, return_exceptions=True)
+            self.indexer = None
+
+        loop = asyncio.get_event_loop()
+        if self.archiving is not None:
+            self.archiving.cancel()
+            await asyncio.gather(self.archiving, return_exceptions=True)
+            self.archiving = None
+        if self.archiver is not None:
+            await loop.run_in_executor(None, self.archiver.stop)
+
+        await loop.run_in_executor(None, self.writer.stop)
+
+    async def run_index(self, interval: float) -> None:
+        while True:
+            try:
+                count = await self.index.update()
+                if count:
+                    log.debug(f"indexed {count} log lines")
+            except Exception:
+                log.exception("failed to index chat logs")
+            await asyncio.sleep(interval)
+
+    async def run_archive(self, interval: float) -> None:
+        assert self.archiver is not None
+        while True:
+            try:
+                await self.archiver.run_once()
+            except Exception:
+                log.exception("failed to archive chat logs")
+            await asyncio.sleep(interval)
+
+    @command(
+        r"(?:(?:<#\w+\|(?P<where>[\w-]+)>|#(?P<name>[\w-]+))\s+)?(?P<terms>.+)",
+        description="[#channel] <words>: search the chat logs",
+        timeout=30.0,
+        concurrency=2,
+        cooldown=5.0,
+    )
+    async def logsearch(
+        self,
+        channel: Channel,
+        user: User,
+        *,
+        terms: str,
+        where: str = "",
+        name: str = "",
+    ) -> str:
+        # search what is indexed so far, rather than wait on a long backlog
+        results = await self.index.search(
+            terms,
+            team=self.slack.team.name,
+            channel=where or name or "",
+            limit=self.search_limit,
+        )
+        if not results:
+            return "no log lines found"
+        return "\n".join(f"#{chan} {date} {line}" for chan, date, line in results)
 
     def log_message(self, channel: str, dt: datetime, message: str) -> None:
         # todo: replace <@U0HML87RT> with @username
 
         date = dt.strftime(r"%Y-%m-%d")
-        time = dt.strftime(r"%H:%M:%S")
+        clock = dt.strftime(r"%H:%M:%S")
 
         formatted = self.format.format(
             date=date,
-            time=time,
+            time=clock,
             team=self.slack.team.name,
             channel=channel,
             message=message,
         )
-        log.info(f"[{date} {time}] #{channel} {message}")
+        log.info("[%s %s] #%s %s", date, clock, channel, message)
 
         filename = self.root / channel / f"{date}.log"
-        filename.parent.mkdir(parents=True, exist_ok=True)
-        with open(filename, "a") as f:
-            f.write(formatted + "\n")
+        self.writer.write(filename, formatted + "\n")
+
+    def remember(self, channel: str, ts: str, user: str, text: str) -> None:
+        """Add a message to the bounded index of recent messages."""
+        key = (channel, ts)
+        self.recent[key] = (user, text)
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.cache_size:
+            self.recent.popitem(last=False)
+
+    async def lookup(self, channel: str, ts: str) -> Tuple[str, str]:
+        """
+        Find the author and text of a message, preferring the recent index.
+
+        Only on a cache miss is the history API queried, and concurrent lookups
+        for the same message share a single API call.
+        """
+        key = (channel, ts)
+        if key in self.recent:
+            self.recent.move_to_end(key)
+            return self.recent[key]
+
+        future = self.lookups.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(self.fetch(channel, ts))
+            self.lookups[key] = future
+            future.add_done_callback(lambda f: self.lookups.pop(key, None))
+
+        return await asyncio.shield(future)
+
+    async def fetch(self, channel: str, ts: str) -> Tuple[str, str]:
+        history = await self.slack.api(
+            "channels.history", channel=channel, latest=ts, oldest=ts, inclusive=True
+        )
+        context = Event.generate(history.messages[0])
+        self.remember(channel, ts, context.user, context.text)
+        return context.user, context.text
 
     async def on_hello(self, event: Event) -> None:
         assert event
-        self.root /= self.slack.team.name
+        # hello arrives again after every reconnect
+        self.root = self.base / self.slack.team.name
         self.root.mkdir(parents=True, exist_ok=True)
         log.info(f"logging messages to {self.root}")
 
-    async def on_message(self, event: Event) -> None:
-        dt = datetime.fromtimestamp(float(event.ts))
+    async def on_message(self, event: Event, context: Context) -> None:
+        dt = datetime.fromtimestamp(float(context.ts))
 
-        channel = self.slack.channels[event.channel].name
+        channel = context.channel_name
         message = ""
-        if "bot_user" in event:
-            username = event.username
-        elif "user" in event:
-            username = self.slack.users[event.user].name
-        else:
-            username = "unknown"
+        username = context.username or "unknown"
 
-        if "subtype" in event:
-            subtype = event.subtype
+        if context.subtype:
+            subtype = context.subtype
 
-            if subtype == "bot_message":
+            if subtype == "message_changed":
+                key = (event.channel, event.message.get("ts", ""))
+                if key in self.recent:
+                    user, _text = self.recent[key]
+                    self.recent[key] = (user, event.message.get("text", ""))
+            elif subtype == "message_deleted":
+                self.recent.pop((event.channel, event.deleted_ts), None)
+            elif subtype == "bot_message":
                 message = f"<{username}> {event.text}"
             elif subtype == "me_message":
                 message = f"* {username} {event.text}"
@@ -82,23 +669,20 @@ class ChatLog(Unit):
                 )
 
         else:
-            message = f"<{username}> {event.text}"
+            message = f"<{username}> {context.text}"
+            if context.user is not None:
+                self.remember(event.channel, context.ts, context.user.id, context.text)
 
-        if message:
+        if message and channel:
             self.log_message(channel, dt, message)
 
-    async def on_reaction_added(self, event: Event) -> None:
-        ts = float(event.item["ts"])
-        dt = datetime.fromtimestamp(ts)
-        channel = event.item["channel"]
-        history = await self.slack.api(
-            "channels.history", channel=channel, latest=ts, oldest=ts, inclusive=True
-        )
-        context = Event.generate(history.messages[0])
-        channel = self.slack.channels[channel].name
-        reactor = self.slack.users[event.user].name
-        username = self.slack.users[context.user].name
-        text = context.text
+    async def on_reaction_added(self, event: Event, context: Context) -> None:
+        ts = event.item["ts"]
+        dt = datetime.fromtimestamp(float(ts))
+        user, text = await self.lookup(event.item["channel"], ts)
+        channel = context.channel_name
+        reactor = context.username
+        username = self.slack.users[user].name
         if len(text) > 40:
             text = text[:40].rsplit(" ", 1)[0] + "..."
         message = f" * {reactor} reacted :{event.reaction}: to <{username}> {text}"
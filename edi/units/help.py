@@ -12,7 +12,7 @@ log = logging.getLogger(__name__)
 
 
 class Help(Unit):
-    @command(description="[command]: show command details")
+    @command(description="[command]: show command details", cache_ttl=3600.0)
     async def help(self, channel: Channel, user: User, phrase: str) -> str:
         phrase = phrase.strip().lower()
         detail = bool(phrase)
@@ -20,14 +20,18 @@ class Help(Unit):
             command_list = list(COMMANDS.keys())
         else:
             names = phrase.split()
-            command_list = [c for c in COMMANDS if c in names]
+            command_list = [
+                c
+                for c in COMMANDS
+                if c in names or any(a in names for a in COMMANDS[c].aliases)
+            ]
             if not command_list:
                 return "No matching commands"
 
         helps = []
         for name in sorted(command_list):
-            _unit, args, description = COMMANDS[name]
-            description = description.strip()  # handle blockquote descriptions
+            cmd = COMMANDS[name]
+            description = cmd.description.strip()  # handle blockquote descriptions
             if detail:
                 description = "\n".join(
                     f"    {line.strip()}" for line in description.splitlines()
@@ -36,9 +40,11 @@ class Help(Unit):
                     [
                         f"{name}:",
                         f"{description}",
-                        f"    argument regex: {args.pattern}",
+                        f"    argument regex: {cmd.args.pattern}",
                     ]
                 )
+                if cmd.aliases:
+                    helps.append(f"    aliases: {', '.join(cmd.aliases)}")
             else:
                 description = description.splitlines()[0].strip()
                 helps.append(f"{name} {description}")
@@ -1,26 +1,40 @@
 # Copyright 2017 John Reese
 # Licensed under the MIT license
 
+import asyncio
+import json
 import logging
+import os
+import random
 import time
-from collections import defaultdict
+from array import array
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-import aiosqlite
 from attr import dataclass
 
 from aioslack.types import Channel, Event, User
-from edi import Config, Edi, Unit, command
-
-from .twitter import Twitter
+from edi import Config, Context, Edi, Unit, command
+from edi.core import RESPONSES
+from edi.db import EdiDb, fts_match
+from edi.metrics import METRICS
 
 log = logging.getLogger(__name__)
 
 
 @dataclass
 class quotes(Config):
-    db_path: str = "quotes.db"
+    db_path: str = "quotes.db"  # standalone database, imported once into bot.db_path
+    shuffle: bool = False
+    id_cache_size: int = 64
+    write_behind: bool = False
+    write_delay: float = 0.005
+    recents_per_channel: int = 200
+    recents_ttl: float = 7 * 24 * 3600
+    recents_bytes: int = 4 * 1024 * 1024
+    recents_path: str = ""
     tweet_grabs: bool = False
     tweet_format: str = "<{user}> {text}"
 
@@ -47,66 +61,215 @@ class Quote:
         )
 
 
+# schema changes applied in order, tracked in the "quotes" namespace by EdiDb
+MIGRATIONS: List[List[str]] = [
+    [
+        # 1: quotes table and lookup indexes
+        """
+        CREATE TABLE IF NOT EXISTS quotes (
+            id INTEGER PRIMARY KEY,
+            channel TEXT,
+            username TEXT,
+            added_by TEXT,
+            added_at TIMESTAMP,
+            quote TEXT
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS quote_channel
+        ON quotes (channel)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS quote_username
+        ON quotes (username)
+        """,
+    ],
+    [
+        # 2: full text index of quote text, kept in sync by triggers
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts
+        USING fts5(quote, content='quotes', content_rowid='id')
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS quotes_fts_insert AFTER INSERT ON quotes
+        BEGIN
+            INSERT INTO quotes_fts (rowid, quote) VALUES (new.id, new.quote);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS quotes_fts_delete AFTER DELETE ON quotes
+        BEGIN
+            INSERT INTO quotes_fts (quotes_fts, rowid, quote)
+            VALUES ('delete', old.id, old.quote);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS quotes_fts_update AFTER UPDATE ON quotes
+        BEGIN
+            INSERT INTO quotes_fts (quotes_fts, rowid, quote)
+            VALUES ('delete', old.id, old.quote);
+            INSERT INTO quotes_fts (rowid, quote) VALUES (new.id, new.quote);
+        END
+        """,
+        # backfill quotes that predate the index
+        """
+        INSERT INTO quotes_fts (quotes_fts) VALUES ('rebuild')
+        """,
+    ],
+]
+
+
 class QuoteDB:
-    def __init__(self, path: str) -> None:
-        self.path = path
-        self.db = aiosqlite.connect(path, isolation_level=None)
+    INSERT = """
+        INSERT INTO quotes
+        VALUES (NULL, ?, ?, ?, ?, ?)
+    """
+
+    def __init__(
+        self,
+        db: EdiDb,
+        shuffle: bool = False,
+        *,
+        id_cache_size: int = 64,
+        write_delay: float = 0.0,
+    ) -> None:
+        self.db = db
+
+        # with a write_delay, inserts arriving within that many seconds of each
+        # other are committed together in one transaction
+        self.write_delay = write_delay
+        self.pending: List[Tuple[Quote, asyncio.Future]] = []
+        self.flusher: Optional[asyncio.Future] = None
+
+        # quote ids by (channel, username pattern), loaded on first use, and
+        # the remaining shuffled "deck" of ids when avoiding repeats; patterns
+        # come from users, so only the most recently used are kept
+        self.shuffle = shuffle
+        self.id_cache_size = max(1, id_cache_size)
+        self.ids: "OrderedDict[Tuple[str, str], array]" = OrderedDict()
+        self.decks: Dict[Tuple[str, str], array] = {}
 
     async def start(self) -> None:
-        await self.db.__aenter__()
+        await self.db.migrate("quotes", MIGRATIONS)
 
-        async with self.db.cursor() as cursor:
-            await cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS quotes (
-                    id INTEGER PRIMARY KEY,
-                    channel TEXT,
-                    username TEXT,
-                    added_by TEXT,
-                    added_at TIMESTAMP,
-                    quote TEXT
+    async def stop(self) -> None:
+        """Commit any pending writes, resolving all of their futures."""
+        if self.flusher is not None:
+            # still waiting out the delay, as it is cleared before flushing
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+
+    async def import_legacy(self, path: Path) -> int:
+        """Copy quotes from a standalone quotes database, if ours is still empty."""
+        if not path.is_file() or path.resolve() == Path(self.db.path).resolve():
+            return 0
+
+        row = await self.db.fetchone("SELECT COUNT(*) FROM quotes")
+        if row[0]:
+            return 0
+
+        await self.db.execute("ATTACH DATABASE ? AS legacy", [str(path)])
+        try:
+            async with self.db.transaction() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO quotes
+                    SELECT id, channel, username, added_by, added_at, quote
+                    FROM legacy.quotes
+                    """
                 )
-                """
-            )
-            await cursor.execute(
-                """
-                CREATE INDEX IF NOT EXISTS quote_channel
-                ON quotes (channel)
-                """
-            )
-            await cursor.execute(
-                """
-                CREATE INDEX IF NOT EXISTS quote_username
-                ON quotes (username)
-                """
-            )
+                count = cursor.rowcount
+        finally:
+            await self.db.execute("DETACH DATABASE legacy")
+
+        log.info(f"imported {count} quotes from {path}")
+        return count
+
+    @staticmethod
+    def params(quote: Quote) -> List:
+        return [
+            quote.channel,
+            quote.username,
+            quote.added_by,
+            quote.added_at,
+            quote.text,
+        ]
+
+    async def flush(self) -> None:
+        """Insert all pending quotes in one transaction and resolve their ids."""
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
 
-    async def stop(self) -> None:
-        await self.db.__aexit__(None, None, None)
+        ids: List[int] = []
+        try:
+            async with self.db.transaction() as cursor:
+                for quote, _future in pending:
+                    await cursor.execute(self.INSERT, self.params(quote))
+                    ids.append(cursor.lastrowid)
+
+        except asyncio.CancelledError:
+            for _quote, future in pending:
+                future.cancel()
+            raise
+
+        except Exception as e:
+            for _quote, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_quote, future), qid in zip(pending, ids):
+            if not future.done():
+                future.set_result(qid)
+
+    async def flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.write_delay)
+        finally:
+            self.flusher = None
+        await self.flush()
 
     async def add(self, quote: Quote) -> int:
-        query = """
-            INSERT INTO quotes
-            VALUES (NULL, ?, ?, ?, ?, ?)
-        """
+        if self.write_delay > 0:
+            future = asyncio.get_event_loop().create_future()
+            self.pending.append((quote, future))
+            if self.flusher is None:
+                self.flusher = asyncio.ensure_future(self.flush_later())
+            quote.id = await future
 
-        async with self.db.execute(
-            query,
-            [quote.channel, quote.username, quote.added_by, quote.added_at, quote.text],
-        ) as cursor:
-            quote.id = cursor.lastrowid
-            return quote.id
+        else:
+            quote.id = await self.db.execute(self.INSERT, self.params(quote))
+
+        # cached listings for the channel may now be out of date
+        RESPONSES.invalidate("quote", quote.channel)
+        RESPONSES.invalidate("search", quote.channel)
+
+        for key in list(self.ids):
+            if key[0] != quote.channel:
+                continue
+            if key[1]:
+                # cheaper to reload than to reimplement LIKE matching
+                self.ids.pop(key)
+                self.decks.pop(key, None)
+                continue
+            self.ids[key].append(quote.id)
+            if key in self.decks:
+                deck = self.decks[key]
+                deck.insert(random.randint(0, len(deck)), quote.id)
+
+        return quote.id
 
     async def get(self, qid: int) -> Quote:
         query = """
             SELECT * FROM quotes
             WHERE id = ?
         """
-        async with self.db.execute(query, [qid]) as cursor:
-            if not cursor.rowcount:
-                raise KeyError(f"quote id {qid} not found")
-            row = await cursor.fetchone()
-            return Quote(*row)
+        row = await self.db.fetchone(query, [qid])
+        if row is None:
+            raise KeyError(f"quote id {qid} not found")
+        return Quote(*row)
 
     async def find(
         self, channel: str, username: str = "", fuzz: bool = False, limit: int = 0
@@ -130,53 +293,225 @@ class QuoteDB:
             query += " LIMIT ? "
             params += [limit]
 
-        async with self.db.execute(query, params) as cursor:
-            result: List[Quote] = []
-            async for row in cursor:
-                result.append(Quote(*row))
-            return result
+        return [Quote(*row) for row in await self.db.fetchall(query, params)]
+
+    async def search(self, channel: str, terms: str, limit: int = 5) -> List[Quote]:
+        """Find quotes containing all of the given words, best matches first."""
+        match = fts_match(terms)
+        if not match:
+            return []
+
+        query = """
+            SELECT quotes.* FROM quotes_fts
+            JOIN quotes ON quotes.id = quotes_fts.rowid
+            WHERE quotes_fts MATCH ? AND quotes.channel = ?
+            ORDER BY quotes_fts.rank
+            LIMIT ?
+        """
+
+        rows = await self.db.fetchall(query, [match, channel, limit])
+        return [Quote(*row) for row in rows]
+
+    async def quote_ids(self, channel: str, pattern: str = "") -> array:
+        """Return the cached ids of quotes matching the channel and username."""
+        key = (channel, pattern)
+        if key not in self.ids:
+            if pattern:
+                query = """
+                    SELECT id FROM quotes
+                    WHERE channel = ? AND username LIKE ?
+                """
+                params = [channel, pattern]
+            else:
+                query = """
+                    SELECT id FROM quotes
+                    WHERE channel = ?
+                """
+                params = [channel]
+
+            rows = await self.db.fetchall(query, params)
+            self.ids[key] = array("q", (row[0] for row in rows))
+            while len(self.ids) > self.id_cache_size:
+                oldest, _ids = self.ids.popitem(last=False)
+                self.decks.pop(oldest, None)
+
+        self.ids.move_to_end(key)
+        return self.ids[key]
 
     async def random(
         self, channel: str, username: str = "", fuzz: bool = False
     ) -> Quote:
-        if username:
-            query = """
-                SELECT * FROM quotes
-                WHERE channel = ? AND username LIKE ?
-                ORDER BY random()
-                LIMIT 1
-            """
-            params = [channel, f"{username[:5]}%" if fuzz else username]
+        """
+        Pick a random quote without sorting the table.
+
+        Ids of matching quotes are loaded once and sampled in memory.  In shuffle
+        mode, ids are dealt from a shuffled deck so that no quote repeats until
+        every matching quote has been shown.
+        """
+        pattern = (f"{username[:5]}%" if fuzz else username) if username else ""
+        ids = await self.quote_ids(channel, pattern)
+        if not ids:
+            return Quote.new(channel, "nobody", "nobody", "say something funny")
+
+        if self.shuffle:
+            key = (channel, pattern)
+            deck = self.decks.get(key, None)
+            if not deck:
+                deck = array("q", ids)
+                random.shuffle(deck)
+                self.decks[key] = deck
+            qid = deck.pop()
         else:
-            query = """
-                SELECT * FROM quotes
-                WHERE channel = ?
-                ORDER BY random()
-                LIMIT 1
-            """
-            params = [channel]
+            qid = random.choice(ids)
 
-        async with self.db.execute(query, params) as cursor:
-            if not cursor.rowcount:
-                return Quote.new(channel, "nobody", "nobody", "say something funny")
-            row = await cursor.fetchone()
-            return Quote(*row)
+        return await self.get(qid)
+
+
+class Recents:
+    """
+    Bounded store of the last message from each user in each channel.
+
+    Entries are kept in order of last update, and the oldest are evicted once
+    a channel holds more than `per_channel` users, once the total size of the
+    stored text exceeds `max_bytes`, or once they are older than `ttl` seconds.
+    """
+
+    def __init__(
+        self, per_channel: int = 200, ttl: float = 0, max_bytes: int = 0
+    ) -> None:
+        self.per_channel = per_channel
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+
+        # (channel, username) -> (text, timestamp, size), oldest first
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[str, float, int]]" = (
+            OrderedDict()
+        )
+        # channel -> usernames, oldest first
+        self.channels: Dict[str, "OrderedDict[str, None]"] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, channel: str, username: str) -> Optional[str]:
+        entry = self.entries.get((channel, username), None)
+        if entry is None:
+            return None
+        text, ts, _size = entry
+        if self.ttl and ts < time.time() - self.ttl:
+            return None
+        return text
+
+    def set(self, channel: str, username: str, text: str, ts: float = 0) -> None:
+        key = (channel, username)
+        if key in self.entries:
+            if ts and self.entries[key][1] > ts:
+                return  # a late message, already superseded
+            self.remove(key)
+
+        size = len(channel) + len(username) + len(text.encode())
+        self.entries[key] = (text, ts or time.time(), size)
+        self.channels.setdefault(channel, OrderedDict())[username] = None
+        self.bytes += size
+
+        users = self.channels[channel]
+        while self.per_channel and len(users) > self.per_channel:
+            self.evict((channel, next(iter(users))))
+
+        self.prune()
+
+    def prune(self) -> None:
+        """Evict entries past the ttl or beyond the byte budget."""
+        if self.ttl:
+            cutoff = time.time() - self.ttl
+            while self.entries:
+                key, (_text, ts, _size) = next(iter(self.entries.items()))
+                if ts >= cutoff:
+                    break
+                self.evict(key)
+
+        while self.max_bytes and self.bytes > self.max_bytes and self.entries:
+            self.evict(next(iter(self.entries)))
+
+    def evict(self, key: Tuple[str, str]) -> None:
+        self.remove(key)
+        self.evictions += 1
+
+    def remove(self, key: Tuple[str, str]) -> None:
+        channel, username = key
+        _text, _ts, size = self.entries.pop(key)
+        self.bytes -= size
+        users = self.channels[channel]
+        del users[username]
+        if not users:
+            del self.channels[channel]
+
+    def save(self, path: Path) -> None:
+        """Atomically write a snapshot of all entries to disk."""
+        data = [
+            [channel, username, text, ts]
+            for (channel, username), (text, ts, _size) in self.entries.items()
+        ]
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as fd:
+            json.dump(data, fd)
+        os.replace(tmp, path)
+
+    def load(self, path: Path) -> None:
+        """Restore entries from a snapshot, subject to the current limits."""
+        if not path.exists():
+            return
+        with open(path) as fd:
+            data = json.load(fd)
+        for channel, username, text, ts in data:
+            self.set(channel, username, text, ts)
 
 
 class Quotes(Unit):
     async def start(self) -> None:
         self.config = Edi().config.quotes
-        self.db = QuoteDB(self.config.db_path)
+        self.db = QuoteDB(
+            Edi().db,
+            shuffle=self.config.shuffle,
+            id_cache_size=self.config.id_cache_size,
+            write_delay=self.config.write_delay if self.config.write_behind else 0,
+        )
         await self.db.start()
+        if self.config.db_path:
+            try:
+                await self.db.import_legacy(Path(self.config.db_path).expanduser())
+            except Exception:
+                log.exception(f"failed to import quotes from {self.config.db_path}")
 
-        self.recents: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self.recents = Recents(
+            per_channel=self.config.recents_per_channel,
+            ttl=self.config.recents_ttl,
+            max_bytes=self.config.recents_bytes,
+        )
+        METRICS.gauge("edi_quotes_recents", lambda: len(self.recents))
+        METRICS.gauge("edi_quotes_recents_bytes", lambda: self.recents.bytes)
+        METRICS.gauge("edi_quotes_recents_evictions", lambda: self.recents.evictions)
+
+        self.recents_path: Optional[Path] = None
+        if self.config.recents_path:
+            self.recents_path = Path(self.config.recents_path).expanduser()
+            try:
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, self.recents.load, self.recents_path)
+                log.debug(f"loaded {len(self.recents)} recent messages")
+            except (OSError, ValueError):
+                log.exception(f"failed to load recents from {self.recents_path}")
 
     @command(
-        r"(?P<username>\S+)", description="<username>: grab the user's last message"
+        r"(?P<username>\S+)",
+        description="<username>: grab the user's last message",
+        timeout=10.0,
     )
     async def grab(self, channel: Channel, user: User, username: str) -> str:
         username = self.slack.decode(username, prefix="")
-        text = self.recents[channel.name].get(username, None)
+        text = self.recents.get(channel.name, username)
         if text is None:
             return f"no history for {username}"
 
@@ -185,6 +520,8 @@ class Quotes(Unit):
 
         if self.config.tweet_grabs:
             try:
+                from .twitter import Twitter
+
                 twitter = Edi().units.get(Twitter, None)
                 if twitter is not None:
                     tweet = self.config.tweet_format.format(
@@ -210,6 +547,9 @@ class Quotes(Unit):
             count: integer - how many quotes to show
             username: string - only show quotes for the given username
         """,
+        timeout=10.0,
+        cooldown=2.0,
+        cache_ttl=300.0,
     )
     async def quote(
         self,
@@ -238,13 +578,67 @@ class Quotes(Unit):
             return "no quotes found"
         return "\n".join(f"#{q.id} [{q.added_at}] <{q.username}> {q.text}" for q in qs)
 
-    async def on_message(self, event: Event) -> None:
-        if "user" not in event or "subtype" in event:
+    @command(
+        r"(?P<username>\S+)?",
+        name="random",
+        description="""
+            [<username>]: show a random quote
+
+            username: string - only pick from quotes by the given username
+        """,
+        timeout=10.0,
+        cooldown=2.0,
+    )
+    async def random_quote(
+        self, channel: Channel, user: User, *, username: Optional[str] = None
+    ) -> str:
+        username = self.slack.decode(username, prefix="") if username else ""
+        q = await self.db.random(channel.name, username, fuzz=True)
+        if not q.id:
+            return "no quotes found"
+        return f"#{q.id} [{q.added_at}] <{q.username}> {q.text}"
+
+    @command(
+        r"(?:(?P<limit>\d+)\s+)?(?P<terms>.+)",
+        description="""
+            [<count>] <terms>: search quotes by text
+
+            count: integer - how many quotes to show
+            terms: string - words that must all appear in the quote
+        """,
+        timeout=10.0,
+        cooldown=2.0,
+        cache_ttl=300.0,
+    )
+    async def search(
+        self, channel: Channel, user: User, *, terms: str, limit: str = ""
+    ) -> str:
+        terms = self.slack.decode(terms, prefix="")
+        if limit:
+            count = max(1, min(20, int(limit)))
+        else:
+            count = 3
+        qs = await self.db.search(channel.name, terms, limit=count)
+        if not qs:
+            return "no quotes found"
+        return "\n".join(f"#{q.id} [{q.added_at}] <{q.username}> {q.text}" for q in qs)
+
+    async def on_message(self, event: Event, context: Context) -> None:
+        if context.user is None or context.subtype:
             return
 
-        channel = self.slack.channels[event.channel].name
-        username = self.slack.users[event.user].name
-        self.recents[channel][username] = event.text
+        ts = float(context.ts) if context.replayed else 0
+        self.recents.set(context.channel_name, context.username, context.text, ts)
 
     async def stop(self) -> None:
+        log.debug(
+            f"recents: {len(self.recents)} messages, {self.recents.bytes} bytes, "
+            f"{self.recents.evictions} evictions"
+        )
+        if self.recents_path is not None:
+            try:
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, self.recents.save, self.recents_path)
+            except OSError:
+                log.exception(f"failed to save recents to {self.recents_path}")
         await self.db.stop()
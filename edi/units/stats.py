@@ -0,0 +1,92 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from attr import dataclass
+
+from aioslack.types import Channel, User
+from edi import Config, Edi, Unit, command
+from edi.metrics import METRICS, Histogram, Labels
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class stats(Config):
+    prometheus_path: str = ""
+    interval: float = 15.0
+    limit: int = 15
+
+
+class Stats(Unit):
+    async def start(self) -> None:
+        self.config: stats = Edi().config.stats
+        self.task: Optional[asyncio.Future] = None
+        if self.config.prometheus_path:
+            self.task = asyncio.ensure_future(self.export())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+    def write_prometheus(self, path: Path) -> None:
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as fd:
+            fd.write(METRICS.prometheus())
+        os.replace(tmp, path)
+
+    async def export(self) -> None:
+        """Periodically write all metrics to a file for Prometheus to collect."""
+        path = Path(self.config.prometheus_path).expanduser()
+        loop = asyncio.get_event_loop()
+        log.info(f"writing metrics to {path} every {self.config.interval}s")
+
+        while True:
+            try:
+                await loop.run_in_executor(None, self.write_prometheus, path)
+            except OSError:
+                log.exception(f"failed to write metrics to {path}")
+            await asyncio.sleep(self.config.interval)
+
+    @staticmethod
+    def describe(name: str, labels: Labels) -> str:
+        values = dict(labels)
+        if name == "edi_handler_seconds":
+            return f"{values['unit']}.{values['handler']} [{values['type']}]"
+        if name == "edi_command_seconds":
+            return f"command {values['command']}"
+        return f"dispatch [{values.get('type', '')}]"
+
+    @command(description="[filter]: show the slowest handlers and commands")
+    async def stats(self, channel: Channel, user: User, phrase: str) -> str:
+        phrase = phrase.strip().lower()
+        series: List[Tuple[str, Histogram]] = []
+        for name in (
+            "edi_dispatch_seconds",
+            "edi_handler_seconds",
+            "edi_command_seconds",
+        ):
+            for labels, histogram in METRICS.histograms.get(name, {}).items():
+                description = self.describe(name, labels)
+                if histogram.count and phrase in description.lower():
+                    series.append((description, histogram))
+
+        if not series:
+            return "no stats recorded"
+
+        series.sort(key=lambda item: item[1].sum, reverse=True)
+        width = max(len(description) for description, _h in series)
+        lines = [f"{'':<{width}}  {'count':>8} {'avg ms':>8} {'p99 ms':>8}"]
+        for description, h in series[: self.config.limit]:
+            lines.append(
+                f"{description:<{width}}  {h.count:>8} "
+                f"{h.sum / h.count * 1000:>8.2f} {h.quantile(0.99) * 1000:>8.1f}"
+            )
+
+        text = "\n".join(lines)
+        return f"```\n{text}\n```"
@@ -2,9 +2,12 @@
 # Licensed under the MIT license
 
 import asyncio
+import json
 import logging
+import os
 import time
-from typing import List, Optional
+from pathlib import Path
+from typing import Any, List, Mapping, Optional
 
 from attr import Factory, dataclass
 from peony import PeonyClient
@@ -23,11 +26,17 @@ class twitter(Config):
     access_key: str = ""
     access_secret: str = ""
     timeline_channels: List[str] = Factory(list)
+    state_path: str = "twitter.json"
+    poll_min: float = 60.0
+    poll_max: float = 300.0
+    announce_concurrency: int = 4
 
 
 class Twitter(Unit):
     async def start(self) -> None:
         self.config: twitter = Edi().config.twitter
+        self.task: Optional[asyncio.Future] = None
+        self.interval = self.config.poll_min
         if not all(
             [
                 self.config.consumer_key,
@@ -49,6 +58,63 @@ class Twitter(Unit):
 
         self.task = asyncio.ensure_future(self.timeline())
 
+    def load_since_id(self) -> Optional[str]:
+        """Read the last seen tweet id persisted by a previous run."""
+        if not self.config.state_path:
+            return None
+        path = Path(self.config.state_path).expanduser()
+        try:
+            with open(path) as fd:
+                return json.load(fd).get("since_id", None)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            log.exception(f"failed to load twitter state from {path}")
+            return None
+
+    def save_since_id(self, since_id: str) -> None:
+        if not self.config.state_path:
+            return
+        path = Path(self.config.state_path).expanduser()
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as fd:
+            json.dump({"since_id": since_id}, fd)
+        os.replace(tmp, path)
+
+    def next_interval(self, headers: Mapping[str, str], count: int) -> float:
+        """
+        Pick the delay before the next poll.
+
+        Polling speeds up while new tweets are arriving and backs off while the
+        timeline is quiet, within the configured bounds, but never faster than
+        the remaining rate limit allows before the limit window resets.
+        """
+        if count:
+            interval = max(self.config.poll_min, self.interval / 2)
+        else:
+            interval = min(self.config.poll_max, self.interval * 1.5)
+
+        try:
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset = float(headers["x-rate-limit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return interval
+
+        window = max(0.0, reset - time.time())
+        if remaining < 1:
+            return max(interval, window)
+        return max(interval, window / remaining)
+
+    async def poll(self, since_id: Optional[str]) -> Any:
+        """Fetch new tweets from the home timeline, newest first."""
+        kwargs = {"count": 200, "include_entities": False}
+        if since_id is None:
+            kwargs["count"] = 1
+        else:
+            kwargs["since_id"] = since_id
+
+        return await self.client.api.statuses.home_timeline.get(**kwargs)
+
     async def timeline(self) -> None:
         """Run loop, poll for updates and push new posts to slack."""
 
@@ -59,35 +125,32 @@ class Twitter(Unit):
         me = await self.client.user
         log.info(f"connected to twitter as @{me.screen_name}")
 
-        since_id = None
+        loop = asyncio.get_event_loop()
+        since_id = await loop.run_in_executor(None, self.load_since_id)
 
         while True:
             ts = time.time()
+            count = 0
+            headers: Mapping[str, str] = {}
 
             try:
-                kwargs = {"count": 20, "include_entities": False}
-                if since_id is None:
-                    kwargs["count"] = 1
-                else:
-                    kwargs["since_id"] = since_id
+                response = await self.poll(since_id)
+                headers = getattr(response, "headers", {})
+                tweets = [Auto.generate(tweet) for tweet in reversed(response)]
+                count = len(tweets)
 
-                tweets = await self.client.api.statuses.home_timeline.get(**kwargs)
                 if tweets:
                     log.info(f"timeline:")
-                    for tweet in reversed(tweets):
+                    for tweet in tweets:
                         log.info(f" @{tweet.user.screen_name}: {tweet.text}")
-                    tweet = Auto.generate(tweets[-1])
 
-                    if (
-                        since_id is not None
-                        and tweet.user.screen_name != me.screen_name
-                    ):
-                        for name in self.config.timeline_channels:
-                            channel = self.slack.channels.get(name, None)
-                            if channel:
-                                await self.announce(channel, tweet)
+                    if since_id is not None:
+                        await self.announce_all(
+                            [t for t in tweets if t.user.screen_name != me.screen_name]
+                        )
 
-                    since_id = tweet.id_str
+                    since_id = tweets[-1].id_str
+                    await loop.run_in_executor(None, self.save_since_id, since_id)
 
                 else:
                     log.debug(f"timeline empty")
@@ -99,11 +162,36 @@ class Twitter(Unit):
                 log.exception(r"¯\_(ツ)_/¯")
 
             finally:
-                wait = (ts + 90) - time.time()
+                self.interval = self.next_interval(headers, count)
+                wait = (ts + self.interval) - time.time()
                 if wait > 0:
                     log.debug(f"sleeping for {wait}s")
                     await asyncio.sleep(wait)
 
+    async def announce_all(self, tweets: List[Auto]) -> None:
+        """Post tweets, in order, to every timeline channel concurrently."""
+        if not tweets:
+            return
+
+        semaphore = asyncio.Semaphore(max(1, self.config.announce_concurrency))
+
+        async def fanout(channel: Channel) -> None:
+            async with semaphore:
+                for tweet in tweets:
+                    await self.announce(channel, tweet)
+
+        channels = [
+            self.slack.channels.get(name, None)
+            for name in self.config.timeline_channels
+        ]
+        results = await asyncio.gather(
+            *[fanout(channel) for channel in channels if channel],
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                log.error(f"failed to announce tweets:\n{result}")
+
     @staticmethod
     def tweet_url(tweet: Auto) -> str:
         return (
@@ -112,12 +200,7 @@ class Twitter(Unit):
         )
 
     async def announce(self, channel: Channel, tweet: Auto) -> None:
-        await self.slack.api(
-            "chat.postMessage",
-            channel=channel.id,
-            text=self.tweet_url(tweet),
-            as_user=True,
-        )
+        await Edi().sender.send(channel.id, self.tweet_url(tweet))
 
     async def update(self, status: str) -> Optional[Auto]:
         try:
@@ -128,7 +211,7 @@ class Twitter(Unit):
             log.exception("failed to update status")
             return None
 
-    @command(description="<status>: twitter a new tweet")
+    @command(description="<status>: twitter a new tweet", timeout=30.0, cooldown=10.0)
     async def tweet(self, channel: Channel, user: User, status: str) -> str:
         tweet = await self.update(status)
         if tweet is not None:
@@ -136,4 +219,5 @@ class Twitter(Unit):
         return r"¯\_(ツ)_/¯"
 
     async def stop(self) -> None:
-        self.task.cancel()
+        if self.task is not None:
+            self.task.cancel()
@@ -1,3 +1,15 @@
 # Copyright 2017 John Reese
 # Licensed under the MIT license
 # flake8: noqa
+
+from .twitter import TwitterTest
+from .core import CommandIndexTest, CommandTest, ResponseCacheTest, UnitTest
+from .sender import SenderTest
+from .backfill import BackfillTest
+from .quotes import QuoteDBTest, RecentsTest
+from .bot import ContextTest, DirectoryTest
+from .db import EdiDbTest
+from .supervisor import SupervisorTest
+from .chatlog import LogArchiverTest, LogIndexTest
+from .executors import ExecutorsTest
+from .pool import WorkerPoolTest
@@ -0,0 +1,137 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+from typing import Any, Dict, List
+from unittest import TestCase
+
+from aioslack import Event
+
+from edi.backfill import Backfill
+from edi.sender import RateLimited
+
+from .base import async_test
+
+
+def message(channel: str, ts: str, text: str = "") -> Event:
+    return Event.generate(
+        {"type": "message", "channel": channel, "ts": ts, "text": text or ts},
+        recursive=False,
+    )
+
+
+class FakeHistory:
+    """conversations.history over fixed messages, newest first like Slack."""
+
+    def __init__(self, messages: Dict[str, List[str]], page_size: int = 2) -> None:
+        self.messages = messages
+        self.page_size = page_size
+        self.requests: List[Dict[str, Any]] = []
+        self.limits: List[float] = []
+
+    async def __call__(self, method: str, **kwargs: Any) -> Dict[str, Any]:
+        self.requests.append(kwargs)
+        if self.limits:
+            raise RateLimited(self.limits.pop(0))
+
+        found = sorted(
+            (
+                ts
+                for ts in self.messages.get(kwargs["channel"], [])
+                if float(kwargs["oldest"]) < float(ts) < float(kwargs["latest"])
+            ),
+            key=float,
+            reverse=True,
+        )
+        start = int(kwargs.get("cursor", 0))
+        page = found[start : start + self.page_size]
+        more = start + self.page_size < len(found)
+        return {
+            "messages": [{"ts": ts, "text": ts} for ts in page],
+            "has_more": more,
+            "response_metadata": {
+                "next_cursor": str(start + len(page)) if more else ""
+            },
+        }
+
+
+class BackfillTest(TestCase):
+    def setUp(self) -> None:
+        self.history = FakeHistory(
+            {
+                "C1": ["1.000001", "2.000001", "3.000001", "4.000001", "5.000001"],
+                "C2": ["1.500001", "2.500001"],
+            }
+        )
+        self.dispatched: List[Event] = []
+        self.backfill = Backfill(self.history, self.dispatch, interval=0)
+
+    async def dispatch(self, event: Event) -> None:
+        self.dispatched.append(event)
+
+    def replayed(self, channel: str) -> List[str]:
+        return [e.ts for e in self.dispatched if e.channel == channel]
+
+    async def wait(self) -> None:
+        await asyncio.gather(self.backfill.task)
+
+    @async_test
+    async def test_ordering(self) -> None:
+        self.backfill.observe(message("C1", "1.000001"))
+        self.backfill.observe(message("C2", "1.500001"))
+        self.backfill.start()
+        await self.wait()
+
+        self.assertEqual(
+            self.replayed("C1"), ["2.000001", "3.000001", "4.000001", "5.000001"]
+        )
+        self.assertEqual(self.replayed("C2"), ["2.500001"])
+        self.assertTrue(all(e.replayed for e in self.dispatched))
+        self.assertEqual(self.backfill.last_seen["C1"], "5.000001")
+
+        # two pages for C1, one for C2
+        self.assertEqual(len(self.history.requests), 3)
+
+    @async_test
+    async def test_nothing_seen(self) -> None:
+        self.backfill.start()
+        self.assertIsNone(self.backfill.task)
+
+    @async_test
+    async def test_dedupe_live(self) -> None:
+        self.backfill.observe(message("C1", "1.000001"))
+        self.backfill.start()
+
+        # arrives live before the backfill gets to it
+        self.assertTrue(self.backfill.observe(message("C1", "3.000001")))
+        await self.wait()
+        self.assertEqual(self.replayed("C1"), ["2.000001", "4.000001", "5.000001"])
+
+        # arrives live after it was replayed
+        self.assertFalse(self.backfill.observe(message("C1", "4.000001")))
+        self.assertTrue(self.backfill.observe(message("C1", "6.000001")))
+
+    @async_test
+    async def test_dedupe_overlapping_gaps(self) -> None:
+        self.backfill.observe(message("C1", "1.000001"))
+        self.backfill.start()
+        await self.wait()
+
+        # a second outage only replays what the first one didn't
+        self.backfill.last_seen["C1"] = "3.000001"
+        self.backfill.start()
+        await self.wait()
+        self.assertEqual(
+            self.replayed("C1"), ["2.000001", "3.000001", "4.000001", "5.000001"]
+        )
+
+    @async_test
+    async def test_retry_after(self) -> None:
+        self.history.limits = [0.05]
+        self.backfill.observe(message("C2", "1.500001"))
+        with self.assertLogs("edi.backfill", "WARNING"):
+            self.backfill.start()
+            await self.wait()
+
+        self.assertEqual(self.replayed("C2"), ["2.500001"])
+        self.assertEqual(len(self.history.requests), 2)
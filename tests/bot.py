@@ -0,0 +1,219 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+from types import SimpleNamespace
+from typing import Any, Dict, List
+from unittest import TestCase
+
+from aioslack import Event
+from aioslack.types import Channel, Group, User
+
+from edi.bot import Edi
+from edi.core import Context, accepts_context, with_context
+
+from .base import async_test
+
+
+def event(data: Dict[str, Any]) -> Event:
+    return Event.generate(data, recursive=False)
+
+
+def channel_info(id: str, name: str) -> Dict[str, Any]:
+    # as sent by slack, including the latest message in the channel
+    return {
+        "id": id,
+        "name": name,
+        "created": 1500000000,
+        "creator": "U1",
+        "is_archived": False,
+        "members": ["U1"],
+        "topic": {"value": "", "creator": "", "last_set": 0},
+        "latest": {"type": "message", "user": "U1", "text": "hi", "ts": "1.000001"},
+        "unread_count": 0,
+    }
+
+
+class DirectoryTest(TestCase):
+    def setUp(self) -> None:
+        self.slack = SimpleNamespace(users={}, channels={}, groups={})
+        self.bot = SimpleNamespace(slack=self.slack)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        Edi.update_directory(self.bot, event(data))  # type: ignore
+
+    def test_team_join(self) -> None:
+        user = {
+            "id": "U2",
+            "team_id": "T1",
+            "name": "amy",
+            "profile": {"real_name": "Amy", "fields": {"Xf1": {"value": "x"}}},
+        }
+        self.update({"type": "team_join", "user": user})
+        self.assertEqual(self.slack.users["U2"].name, "amy")
+        self.assertEqual(self.slack.users["U2"].profile.real_name, "Amy")
+
+    def test_user_change(self) -> None:
+        user = {"id": "U2", "team_id": "T1", "name": "amy"}
+        self.update({"type": "team_join", "user": user})
+        self.update({"type": "user_change", "user": dict(user, name="amelia")})
+        self.assertEqual(self.slack.users["U2"].name, "amelia")
+
+    def test_channel_created(self) -> None:
+        info = {"id": "C2", "name": "new", "created": 1500000000, "creator": "U1"}
+        self.update({"type": "channel_created", "channel": info})
+        self.assertEqual(self.slack.channels["C2"].name, "new")
+
+    def test_channel_joined(self) -> None:
+        self.update({"type": "channel_joined", "channel": channel_info("C2", "new")})
+        channel = self.slack.channels["C2"]
+        self.assertIsInstance(channel, Channel)
+        self.assertEqual(channel.name, "new")
+        self.assertEqual(channel.members, ["U1"])
+
+    def test_group_joined(self) -> None:
+        self.update({"type": "group_joined", "channel": channel_info("G2", "secret")})
+        self.assertIsInstance(self.slack.groups["G2"], Group)
+        self.assertEqual(self.slack.groups["G2"].name, "secret")
+
+    def test_channel_rename(self) -> None:
+        self.update({"type": "channel_joined", "channel": channel_info("C2", "new")})
+        channel = self.slack.channels["C2"]
+        info = {"id": "C2", "name": "renamed", "created": 1500000000}
+        self.update({"type": "channel_rename", "channel": info})
+        self.assertIs(self.slack.channels["C2"], channel)
+        self.assertEqual(channel.name, "renamed")
+
+        self.update({"type": "channel_rename", "channel": dict(info, id="C3")})
+        self.assertEqual(self.slack.channels["C3"].name, "renamed")
+
+    def test_group_rename(self) -> None:
+        info = {"id": "G2", "name": "renamed", "created": 1500000000}
+        self.update({"type": "group_rename", "channel": info})
+        self.assertEqual(self.slack.groups["G2"].name, "renamed")
+
+    def test_channel_deleted(self) -> None:
+        self.update({"type": "channel_joined", "channel": channel_info("C2", "new")})
+        self.update({"type": "channel_deleted", "channel": "C2"})
+        self.assertNotIn("C2", self.slack.channels)
+
+        # unknown channels are ignored
+        self.update({"type": "channel_deleted", "channel": "C3"})
+
+    def test_channel_archive(self) -> None:
+        self.update({"type": "channel_joined", "channel": channel_info("C2", "new")})
+        self.update({"type": "channel_archive", "channel": "C2", "user": "U1"})
+        self.assertTrue(self.slack.channels["C2"].is_archived)
+        self.update({"type": "channel_unarchive", "channel": "C2", "user": "U1"})
+        self.assertFalse(self.slack.channels["C2"].is_archived)
+
+    def test_bad_payload(self) -> None:
+        with self.assertLogs("edi.bot", "ERROR"):
+            self.update({"type": "team_join", "user": {"name": "no id"}})
+        self.assertEqual(self.slack.users, {})
+
+
+class ContextTest(TestCase):
+    def setUp(self) -> None:
+        self.slack = SimpleNamespace(
+            users={"U1": User("U1", "T1", "amy")},
+            channels={"C1": Channel("C1", "general")},
+            groups={"G1": Group("G1", "secret")},
+        )
+        self.bot = SimpleNamespace(slack=self.slack, event_key=Edi.event_key)
+
+    def context(self, data: Dict[str, Any]) -> Context:
+        return Edi.context(self.bot, event(data))  # type: ignore
+
+    def test_accepts_context(self) -> None:
+        async def legacy(event: Event) -> None:
+            pass
+
+        async def current(event: Event, context: Context) -> None:
+            pass
+
+        async def varargs(*args: Any) -> None:
+            pass
+
+        class Handlers:
+            async def on_legacy(self, event: Event) -> None:
+                pass
+
+            async def on_current(self, event: Event, context: Context) -> None:
+                pass
+
+        self.assertFalse(accepts_context(legacy))
+        self.assertTrue(accepts_context(current))
+        self.assertTrue(accepts_context(varargs))
+        self.assertFalse(accepts_context(Handlers().on_legacy))
+        self.assertTrue(accepts_context(Handlers().on_current))
+
+    @async_test
+    async def test_with_context(self) -> None:
+        calls: List[Any] = []
+
+        async def on_message(event: Event) -> None:
+            calls.append(event)
+
+        async def on_hello(event: Event, context: Context) -> None:
+            calls.append((event, context))
+
+        self.assertIs(with_context(on_hello), on_hello)
+        adapted = with_context(on_message)
+        self.assertEqual(adapted.__name__, "on_message")
+
+        # legacy handlers get the event alone, through the same calling convention
+        bot = SimpleNamespace(executors=None)
+        data = {"type": "message", "channel": "C1", "user": "U1", "text": "hi"}
+        msg = event(data)
+        context = self.context(data)
+        await adapted(msg, context)
+        await Edi.adapt(bot, on_message)(msg, context)  # type: ignore
+        await Edi.adapt(bot, on_hello)(msg, context)  # type: ignore
+        self.assertEqual(calls, [msg, msg, (msg, context)])
+
+    def test_message(self) -> None:
+        context = self.context(
+            {"type": "message", "channel": "C1", "user": "U1", "text": "hi", "ts": "1"}
+        )
+        self.assertIs(context.channel, self.slack.channels["C1"])
+        self.assertIs(context.user, self.slack.users["U1"])
+        self.assertEqual(context.username, "amy")
+        self.assertEqual(context.channel_name, "general")
+        self.assertEqual(context.text, "hi")
+        self.assertEqual(context.ts, "1")
+        self.assertFalse(context.replayed)
+
+    def test_group(self) -> None:
+        context = self.context({"type": "message", "channel": "G1", "user": "U1"})
+        self.assertIs(context.channel, self.slack.groups["G1"])
+
+    def test_reaction(self) -> None:
+        item = {"type": "message", "channel": "C1", "ts": "1"}
+        context = self.context({"type": "reaction_added", "user": "U1", "item": item})
+        self.assertIs(context.channel, self.slack.channels["C1"])
+        self.assertIs(context.user, self.slack.users["U1"])
+
+    def test_bot_user(self) -> None:
+        # messages relayed by a bot keep the name they were sent with
+        context = self.context(
+            {
+                "type": "message",
+                "channel": "C1",
+                "user": "U1",
+                "bot_user": "B1",
+                "username": "relay",
+            }
+        )
+        self.assertIs(context.user, self.slack.users["U1"])
+        self.assertEqual(context.username, "relay")
+
+    def test_unknown(self) -> None:
+        context = self.context({"type": "message", "channel": "C9", "user": "U9"})
+        self.assertIsNone(context.channel)
+        self.assertIsNone(context.user)
+        self.assertEqual(context.username, "")
+        self.assertEqual(context.channel_name, "")
+
+        context = self.context({"type": "hello"})
+        self.assertIsNone(context.channel)
+        self.assertIsNone(context.user)
@@ -0,0 +1,239 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import gzip
+import os
+import tempfile
+from datetime import date
+from pathlib import Path
+from typing import List, Optional
+from unittest import TestCase, mock
+
+from edi.db import EdiDb
+from edi.units.chatlog import LogArchiver, LogIndex, LogWriter, archive_log, open_log
+
+from .base import async_test
+
+
+class LogIndexTest(TestCase):
+    @async_test
+    async def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name) / "logs"
+        self.path = self.root / "team" / "general" / "2018-01-01.log"
+        self.db_path = str(Path(self.tmpdir.name) / "edi.db")
+        self.db = EdiDb(self.db_path)
+        await self.db.start()
+        self.index = LogIndex(self.db, self.root)
+        await self.index.start()
+
+    @async_test
+    async def tearDown(self) -> None:
+        await self.db.stop()
+        self.tmpdir.cleanup()
+
+    def append(self, text: str, path: Optional[Path] = None) -> None:
+        path = path or self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as fd:
+            fd.write(text)
+
+    async def lines(self) -> List[str]:
+        rows = await self.db.fetchall("SELECT line FROM chatlog_fts ORDER BY rowid")
+        return [row[0] for row in rows]
+
+    @async_test
+    async def test_search(self) -> None:
+        self.append("[10:00] <amy> hello there\n[10:01] <bob> hi amy\n")
+        self.append("[10:02] <cat> hello\n", self.root / "team" / "random" / "x.log")
+        self.append("[10:03] <dan> hello\n", self.root / "other" / "general" / "x.log")
+        self.assertEqual(await self.index.update(), 4)
+
+        results = await self.index.search("hello", "team")
+        self.assertEqual(len(results), 2)
+        results = await self.index.search("hello", "team", channel="general")
+        self.assertEqual(
+            results, [("general", "2018-01-01", "[10:00] <amy> hello there")]
+        )
+        self.assertEqual(await self.index.search("  ", "team"), [])
+
+    @async_test
+    async def test_resume(self) -> None:
+        self.append("one\ntwo\n")
+        self.assertEqual(await self.index.update(), 2)
+        await self.db.stop()
+
+        # a new index on the reopened database picks up from the stored offset
+        self.db = EdiDb(self.db_path)
+        await self.db.start()
+        self.index = LogIndex(self.db, self.root)
+        await self.index.start()
+        self.assertEqual(self.index.offsets, {"team/general/2018-01-01.log": 8})
+        self.assertEqual(await self.index.update(), 0)
+
+        self.append("three\n")
+        self.assertEqual(await self.index.update(), 1)
+        self.assertEqual(await self.lines(), ["one", "two", "three"])
+
+    @async_test
+    async def test_new_lines(self) -> None:
+        self.append("one\ntw")
+        self.assertEqual(await self.index.update(), 1)
+        self.assertIsNone(await self.index.index_pass())
+
+        # partial lines wait until they are complete
+        self.append("o\nthree\n")
+        self.assertEqual(await self.index.update(), 2)
+        self.assertEqual(await self.lines(), ["one", "two", "three"])
+
+    @async_test
+    async def test_batches(self) -> None:
+        self.index.BATCH_BYTES = 10
+        self.append("".join(f"line {i}\n" for i in range(10)))
+        self.assertEqual(await self.index.index_pass(), 1)
+        self.assertEqual(await self.index.update(), 9)
+        self.assertEqual(len(await self.lines()), 10)
+
+    @async_test
+    async def test_truncated(self) -> None:
+        self.append("one\ntwo\nthree\n")
+        self.assertEqual(await self.index.update(), 3)
+
+        with open(self.path, "w") as fd:
+            fd.write("four\n")
+        self.assertEqual(await self.index.update(), 1)
+        self.assertEqual(await self.lines(), ["four"])
+        self.assertEqual(self.index.offsets["team/general/2018-01-01.log"], 5)
+
+    @async_test
+    async def test_rotated(self) -> None:
+        self.append("one\ntwo\nthree\n")
+        self.assertEqual(await self.index.update(), 3)
+
+        # replaced by a smaller file, rather than truncated in place
+        tmp = self.path.with_name("new.tmp")
+        self.append("four\n", tmp)
+        os.replace(tmp, self.path)
+        self.assertEqual(await self.index.update(), 1)
+        self.assertEqual(await self.lines(), ["four"])
+
+    @async_test
+    async def test_forget(self) -> None:
+        self.append("one\ntwo\n")
+        self.assertEqual(await self.index.update(), 2)
+
+        # archived files keep their lines, and are indexed from the start if
+        # they are created again
+        self.path.unlink()
+        await self.index.forget("team/general/2018-01-01.log")
+        self.assertEqual(self.index.offsets, {})
+        self.append("three\nfour\nfive\n")
+        self.assertEqual(await self.index.update(), 3)
+        self.assertEqual(await self.lines(), ["one", "two", "three", "four", "five"])
+
+
+class LogArchiverTest(TestCase):
+    @async_test
+    async def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        self.path = self.root / "team" / "general" / "2018-01-01.log"
+        self.path.parent.mkdir(parents=True)
+        self.db = EdiDb(":memory:")
+        await self.db.start()
+        self.index = LogIndex(self.db, self.root)
+        await self.index.start()
+        self.writer = LogWriter()
+        self.archiver = LogArchiver(self.root, self.index, 30, 2, self.writer)
+
+    @async_test
+    async def tearDown(self) -> None:
+        self.archiver.stop()
+        self.writer.close()
+        await self.db.stop()
+        self.tmpdir.cleanup()
+
+    def read(self, path: Path) -> str:
+        with open_log(path) as fd:
+            return fd.read()
+
+    def test_archive_log(self) -> None:
+        self.path.write_text("one\ntwo\n")
+        size, written = archive_log(self.path)
+
+        dest = self.path.with_name("2018-01-01.log.gz")
+        self.assertFalse(self.path.exists())
+        self.assertEqual(size, 8)
+        self.assertEqual(written, dest.stat().st_size)
+        with gzip.open(dest, "rt") as fd:
+            self.assertEqual(fd.read(), "one\ntwo\n")
+
+    def test_archive_log_append(self) -> None:
+        dest = self.path.with_name("2018-01-01.log.gz")
+        self.path.write_text("one\ntwo\n")
+        archive_log(self.path)
+        existing = dest.stat().st_size
+
+        # a late line ends up in the same archive, as another gzip member
+        self.path.write_text("three\n")
+        size, written = archive_log(self.path)
+        self.assertEqual(size, 6)
+        self.assertEqual(written, dest.stat().st_size - existing)
+        self.assertEqual(self.read(dest), "one\ntwo\nthree\n")
+        self.assertEqual(
+            sorted(p.name for p in self.path.parent.iterdir()), [dest.name]
+        )
+
+    def test_claim_release(self) -> None:
+        self.assertEqual(self.writer.flush({self.path: ["one\n"]}), {})
+        self.assertIn(self.path.parent, self.writer.handles)
+
+        # claimed files are closed, and their lines held back until released
+        self.writer.claim([self.path])
+        self.assertEqual(self.writer.handles, {})
+        held = self.writer.flush({self.path: ["two\n"]})
+        self.assertEqual(held, {self.path: ["two\n"]})
+        self.assertEqual(self.path.read_text(), "one\n")
+
+        self.writer.release([self.path])
+        self.assertEqual(self.writer.flush(held), {})
+        self.assertEqual(self.path.read_text(), "one\ntwo\n")
+
+    @async_test
+    async def test_run_once(self) -> None:
+        today = self.path.with_name(f"{date.today():%Y-%m-%d}.log")
+        self.path.write_text("old news\n")
+        today.write_text("new news\n")
+        self.assertEqual(await self.index.update(), 2)
+
+        self.assertEqual(await self.archiver.run_once(), 1)
+        self.assertFalse(self.path.exists())
+        self.assertTrue(today.exists())
+        self.assertEqual(
+            self.read(self.path.with_name("2018-01-01.log.gz")), "old news\n"
+        )
+        self.assertEqual(self.writer.claimed, set())
+        self.assertEqual(list(self.index.offsets), [str(today.relative_to(self.root))])
+        self.assertEqual(len(await self.index.search("old", "team")), 1)
+        self.assertEqual(await self.archiver.run_once(), 0)
+
+    @async_test
+    async def test_run_once_failed(self) -> None:
+        self.path.write_text("old news\n")
+        self.assertEqual(await self.index.update(), 1)
+
+        # files that fail to compress are left in place, and still indexed
+        with mock.patch("edi.units.chatlog.archive_log", side_effect=OSError("nope")):
+            with self.assertLogs("edi.units.chatlog", "ERROR"):
+                self.assertEqual(await self.archiver.run_once(), 0)
+        self.assertTrue(self.path.exists())
+        self.assertEqual(self.writer.claimed, set())
+        self.assertIn("team/general/2018-01-01.log", self.index.offsets)
+
+        async def fail(paths: List[Path]) -> int:
+            raise RuntimeError("nope")
+
+        with mock.patch.object(self.archiver, "archive", fail):
+            with self.assertRaises(RuntimeError):
+                await self.archiver.run_once()
+        self.assertEqual(self.writer.claimed, set())
@@ -0,0 +1,214 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import re
+from typing import Any, List
+from unittest import TestCase
+
+from aioslack import Event
+
+from edi.core import RESPONSES, Command, CommandIndex, ResponseCache, Unit
+from edi.db import EdiDb
+from edi.units.quotes import Quote, QuoteDB
+
+from .base import async_test
+
+
+def make_command(name: str = "test", **kwargs: Any) -> Command:
+    return Command(name, None, re.compile(r"(.*)"), "", **kwargs)
+
+
+class CommandTest(TestCase):
+    def test_unlimited(self) -> None:
+        cmd = make_command()
+        cmd.running = 10
+        for now in range(5):
+            self.assertIsNone(cmd.limited("C1", "U1", now))
+
+    def test_concurrency(self) -> None:
+        cmd = make_command(concurrency=2)
+        self.assertIsNone(cmd.limited("C1", "U1", 0))
+
+        cmd.running = 2
+        self.assertEqual(cmd.limited("C1", "U1", 0), "concurrency")
+
+        cmd.release()
+        self.assertEqual(cmd.running, 1)
+        self.assertIsNone(cmd.limited("C1", "U1", 0))
+
+    def test_cooldown_per_user(self) -> None:
+        cmd = make_command(cooldown=10)
+        self.assertIsNone(cmd.limited("C1", "U1", 100))
+        self.assertEqual(cmd.limited("C1", "U1", 105), "cooldown")
+        self.assertEqual(cmd.limited("C2", "U1", 105), "cooldown")
+        self.assertIsNone(cmd.limited("C1", "U2", 105))
+
+        # rejected runs don't extend the cooldown
+        self.assertIsNone(cmd.limited("C1", "U1", 110))
+
+    def test_cooldown_per_channel(self) -> None:
+        cmd = make_command(cooldown=10, cooldown_per="channel")
+        self.assertIsNone(cmd.limited("C1", "U1", 100))
+        self.assertEqual(cmd.limited("C1", "U2", 105), "cooldown")
+        self.assertIsNone(cmd.limited("C2", "U2", 105))
+        self.assertIsNone(cmd.limited("C1", "U2", 110))
+
+    def test_cooldown_prunes_expired(self) -> None:
+        cmd = make_command(cooldown=10)
+        for user in range(1001):
+            cmd.limited("C1", f"U{user}", 0)
+        self.assertEqual(len(cmd.last_run), 1001)
+
+        cmd.limited("C1", "late", 20)
+        self.assertEqual(list(cmd.last_run), ["late"])
+
+
+class CommandIndexTest(TestCase):
+    def setUp(self) -> None:
+        commands = [
+            make_command("quote", aliases=["q"]),
+            make_command("quotes"),
+            make_command("grab", aliases=["steal"]),
+            make_command("search", aliases=["find"]),
+        ]
+        self.index = CommandIndex({cmd.name: cmd for cmd in commands})
+        self.commands = {cmd.name: cmd for cmd in commands}
+
+    def test_exact(self) -> None:
+        for name, cmd in self.commands.items():
+            self.assertIs(self.index.resolve(name), cmd)
+        self.assertIsNone(self.index.resolve("nope"))
+        self.assertIsNone(self.index.resolve(""))
+
+    def test_prefix(self) -> None:
+        self.assertIs(self.index.resolve("gr"), self.commands["grab"])
+        self.assertIs(self.index.resolve("sea"), self.commands["search"])
+
+        # an exact name wins over the longer names it prefixes
+        self.assertIs(self.index.resolve("quote"), self.commands["quote"])
+        self.assertIs(self.index.resolve("quotes"), self.commands["quotes"])
+
+    def test_ambiguous(self) -> None:
+        self.assertIsNone(self.index.resolve("qu"))
+        self.assertIsNone(self.index.resolve("s"))
+        self.assertNotIn("qu", self.index.prefixes)
+
+    def test_alias(self) -> None:
+        self.assertIs(self.index.resolve("q"), self.commands["quote"])
+        self.assertIs(self.index.resolve("steal"), self.commands["grab"])
+        self.assertIs(self.index.resolve("fi"), self.commands["search"])
+
+        # prefixes of a command's name and alias are not ambiguous
+        self.assertIs(self.index.resolve("f"), self.commands["search"])
+
+    def test_alias_does_not_shadow_name(self) -> None:
+        other = make_command("steal")
+        commands = dict(self.commands, steal=other)
+        index = CommandIndex(commands)
+        self.assertIs(index.resolve("steal"), other)
+
+    def test_parse(self) -> None:
+        cmd, match = self.index.parse("gra", "amy")
+        self.assertIs(cmd, self.commands["grab"])
+        self.assertEqual(match.group(1), "amy")
+        self.assertEqual(self.index.parse("qu", "amy"), (None, None))
+
+
+class ResponseCacheTest(TestCase):
+    def test_ttl(self) -> None:
+        cache = ResponseCache()
+        cache.set("quote", "general", "", "hello", expires=10)
+        self.assertEqual(cache.get("quote", "general", "", now=5), "hello")
+        self.assertIsNone(cache.get("quote", "general", "1", now=5))
+        self.assertIsNone(cache.get("quote", "random", "", now=5))
+
+        self.assertIsNone(cache.get("quote", "general", "", now=10))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.ratio("quote"), 0.25)
+
+    def test_lru(self) -> None:
+        cache = ResponseCache(maxsize=2)
+        cache.set("quote", "general", "1", "one", expires=10)
+        cache.set("quote", "general", "2", "two", expires=10)
+        cache.get("quote", "general", "1", now=0)
+        cache.set("quote", "general", "3", "three", expires=10)
+
+        self.assertEqual(cache.get("quote", "general", "1", now=0), "one")
+        self.assertIsNone(cache.get("quote", "general", "2", now=0))
+        self.assertEqual(cache.get("quote", "general", "3", now=0), "three")
+
+    def test_invalidate(self) -> None:
+        cache = ResponseCache()
+        for name in ("quote", "search"):
+            for channel in ("general", "random"):
+                cache.set(name, channel, "", f"{name} {channel}", expires=10)
+
+        cache.invalidate("quote", "general")
+        self.assertIsNone(cache.get("quote", "general", "", now=0))
+        self.assertEqual(cache.get("quote", "random", "", now=0), "quote random")
+        self.assertEqual(cache.get("search", "general", "", now=0), "search general")
+
+        cache.invalidate("search")
+        self.assertIsNone(cache.get("search", "general", "", now=0))
+        self.assertIsNone(cache.get("search", "random", "", now=0))
+
+    @async_test
+    async def test_invalidated_by_grab(self) -> None:
+        db = EdiDb(":memory:")
+        await db.start()
+        quotes = QuoteDB(db)
+        try:
+            await quotes.start()
+            for name in ("quote", "search"):
+                for channel in ("general", "random"):
+                    RESPONSES.set(name, channel, "", "cached", expires=float("inf"))
+
+            await quotes.add(Quote.new("general", "amy", "john", "hello"))
+            self.assertIsNone(RESPONSES.get("quote", "general", "", now=0))
+            self.assertIsNone(RESPONSES.get("search", "general", "", now=0))
+            self.assertEqual(RESPONSES.get("quote", "random", "", now=0), "cached")
+            self.assertEqual(RESPONSES.get("search", "random", "", now=0), "cached")
+
+        finally:
+            RESPONSES.invalidate("quote")
+            RESPONSES.invalidate("search")
+            await db.stop()
+
+
+class Handlers(Unit):
+    ENABLED = False
+
+    async def on_message(self, event: Event) -> None:
+        pass
+
+
+class Dispatcher(Unit):
+    ENABLED = False
+
+    def __init__(self) -> None:
+        super().__init__(None)  # type: ignore
+        self.events: List[str] = []
+
+    async def dispatch(self, event: Event) -> None:
+        self.events.append(event.type)
+
+    async def on_message(self, event: Event) -> None:
+        raise AssertionError("dispatch should have handled it")
+
+
+class UnitTest(TestCase):
+    def test_handlers(self) -> None:
+        unit = Handlers(None)  # type: ignore
+        self.assertEqual(unit.handlers(), {"message": unit.on_message})
+        self.assertIsNone(unit.default_handler())
+
+    @async_test
+    async def test_dispatch_overridden(self) -> None:
+        unit = Dispatcher()
+        self.assertEqual(unit.handlers(), {})
+        handler = unit.default_handler()
+        self.assertEqual(handler, unit.dispatch)
+
+        for event_type in ("message", "reaction_added"):
+            await handler(Event.generate({"type": event_type}, recursive=False))
+        self.assertEqual(unit.events, ["message", "reaction_added"])
@@ -0,0 +1,150 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from unittest import TestCase, mock
+
+from edi.db import EdiDb
+
+from .base import async_test
+
+
+class EdiDbTest(TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    async def roundtrip(self, db: EdiDb) -> None:
+        await db.start()
+        try:
+            await db.execute("CREATE TABLE t (x INTEGER)")
+            await db.execute("INSERT INTO t VALUES (?)", [1])
+            self.assertEqual(await db.fetchall("SELECT x FROM t"), [(1,)])
+            self.assertEqual(len(db.readers), 2)
+        finally:
+            await db.stop()
+
+    @async_test
+    async def test_home_path(self) -> None:
+        with mock.patch.dict(os.environ, {"HOME": str(self.root)}):
+            db = EdiDb("~/sub/edi.db", readers=2)
+            self.assertEqual(db.path, str(self.root / "sub" / "edi.db"))
+            await self.roundtrip(db)
+        self.assertTrue((self.root / "sub" / "edi.db").is_file())
+
+    @async_test
+    async def test_uri_characters(self) -> None:
+        path = self.root / "what? #1" / "edi.db"
+        await self.roundtrip(EdiDb(str(path), readers=2))
+        self.assertTrue(path.is_file())
+
+    @async_test
+    async def test_migrate(self) -> None:
+        path = str(self.root / "edi.db")
+        first = [["CREATE TABLE a (x INTEGER)"], ["ALTER TABLE a ADD COLUMN y"]]
+        other = [["CREATE TABLE b (x INTEGER)"]]
+
+        db = EdiDb(path)
+        await db.start()
+        try:
+            self.assertEqual(await db.migrate("first", first[:1]), 1)
+            self.assertEqual(await db.migrate("other", other), 1)
+
+            # already applied, so nothing runs again
+            self.assertEqual(await db.migrate("first", first[:1]), 1)
+            self.assertEqual(await db.migrate("first", first), 2)
+            await db.execute("INSERT INTO a VALUES (1, 2)")
+        finally:
+            await db.stop()
+
+        db = EdiDb(path)
+        await db.start()
+        try:
+            self.assertEqual(await db.migrate("first", first), 2)
+            self.assertEqual(await db.migrate("other", other), 1)
+            self.assertEqual(
+                await db.fetchall("SELECT * FROM edi_migrations ORDER BY namespace"),
+                [("first", 2), ("other", 1)],
+            )
+        finally:
+            await db.stop()
+
+    @async_test
+    async def test_migrate_failure(self) -> None:
+        db = EdiDb(":memory:")
+        await db.start()
+        try:
+            broken = [
+                ["CREATE TABLE a (x INTEGER)"],
+                ["CREATE TABLE b (x INTEGER)", "NOT SQL"],
+            ]
+            with self.assertLogs("edi.db", "INFO"):
+                with self.assertRaises(sqlite3.OperationalError):
+                    await db.migrate("test", broken)
+
+            # the failed version rolled back entirely, and can be retried
+            tables = await db.fetchall(
+                "SELECT name FROM sqlite_master WHERE name IN ('a', 'b')"
+            )
+            self.assertEqual(tables, [("a",)])
+            broken[1][1] = "CREATE TABLE c (x INTEGER)"
+            with self.assertLogs("edi.db", "INFO"):
+                self.assertEqual(await db.migrate("test", broken), 2)
+        finally:
+            await db.stop()
+
+    @async_test
+    async def test_transaction_rollback(self) -> None:
+        db = EdiDb(":memory:")
+        await db.start()
+        try:
+            await db.execute("CREATE TABLE t (x INTEGER)")
+            with self.assertRaises(ValueError):
+                async with db.transaction() as cursor:
+                    await cursor.execute("INSERT INTO t VALUES (1)")
+                    raise ValueError("oops")
+
+            self.assertEqual(await db.fetchall("SELECT x FROM t"), [])
+            self.assertFalse(db.lock.locked())
+
+            async with db.transaction() as cursor:
+                await cursor.execute("INSERT INTO t VALUES (2)")
+            self.assertEqual(await db.fetchall("SELECT x FROM t"), [(2,)])
+        finally:
+            await db.stop()
+
+    @async_test
+    async def test_read_without_readers(self) -> None:
+        db = EdiDb(str(self.root / "edi.db"), readers=0)
+        await db.start()
+        try:
+            self.assertEqual(db.readers, [])
+            await db.execute("CREATE TABLE t (x INTEGER)")
+
+            # reads on the writer wait for open transactions, never seeing them
+            with self.assertRaises(ValueError):
+                async with db.transaction() as cursor:
+                    await cursor.execute("INSERT INTO t VALUES (1)")
+                    read = asyncio.ensure_future(db.fetchall("SELECT x FROM t"))
+                    await asyncio.sleep(0.05)
+                    self.assertFalse(read.done())
+                    raise ValueError("oops")
+
+            self.assertEqual(await read, [])
+            self.assertEqual(await db.fetchone("SELECT COUNT(*) FROM t"), (0,))
+        finally:
+            await db.stop()
+
+    @async_test
+    async def test_not_started(self) -> None:
+        db = EdiDb(":memory:")
+        with self.assertRaises(RuntimeError):
+            await db.fetchall("SELECT 1")
+        await db.stop()
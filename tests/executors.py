@@ -0,0 +1,160 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import pickle
+import re
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Any, List, Tuple
+from unittest import TestCase, mock
+
+from aioslack import Event
+from aioslack.types import Channel, User
+
+from edi.bot import Edi
+from edi.core import Command, CommandIndex, Context
+from edi.executors import Executors
+
+from .base import async_test
+
+CALLS: List[Tuple[Any, ...]] = []
+
+
+class Blocking:
+    """Stands in for a unit, whose methods are looked up by name in the worker."""
+
+    def echo(self, channel: Channel, user: User, text: str, *, loud: bool) -> str:
+        return f"{channel.name} {user.name} {text.upper() if loud else text}"
+
+    def on_message(self, event: Event, context: Context) -> None:
+        CALLS.append((event, context.channel, context.user, context.username))
+
+    def on_legacy(self, event: Event) -> None:
+        CALLS.append((event,))
+
+
+class ExecutorsTest(TestCase):
+    def setUp(self) -> None:
+        self.executors = Executors(threads=1, processes=1)
+        self.channel = Channel("C1", "general")
+        self.user = User("U1", "T1", "amy")
+        self.posts: List[str] = []
+        CALLS.clear()
+
+    def tearDown(self) -> None:
+        self.executors.stop()
+
+    def bot(self, cmd: Command) -> Any:
+        return SimpleNamespace(
+            command_prefixes=("edi",),
+            command_re=re.compile(
+                r"^\s*(?P<name>edi)[:,]?\s+(?P<command>\w+)(?P<args>.*)$"
+            ),
+            commands=CommandIndex({cmd.name: cmd}),
+            config=SimpleNamespace(units=SimpleNamespace(disable_commands=[])),
+            sender=SimpleNamespace(post=lambda channel, text: self.posts.append(text)),
+            executors=self.executors,
+        )
+
+    async def command(self, bot: Any, text: str) -> bool:
+        event = Event.generate(
+            {"type": "message", "channel": "C1", "user": "U1", "text": text},
+            recursive=False,
+        )
+        context = Context(event, self.channel, self.user, self.user.name)
+        return await Edi.command(bot, event, context)  # type: ignore
+
+    @staticmethod
+    async def until(check: Any, timeout: float = 5.0) -> None:
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while not check() and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    @async_test
+    async def test_slot_held_after_timeout(self) -> None:
+        gate = threading.Event()
+
+        def slow(channel: Channel, user: User, text: str) -> str:
+            gate.wait(5)
+            return "done"
+
+        cmd = Command(
+            "slow",
+            slow,
+            re.compile(r"(.*)"),
+            "",
+            timeout=0.05,
+            concurrency=1,
+            executor="thread",
+        )
+        bot = self.bot(cmd)
+        with self.assertLogs("edi.bot", "WARNING"):
+            self.assertTrue(await self.command(bot, "edi slow"))
+        self.assertEqual(self.posts, ['<@U1> command "slow" timed out'])
+
+        # the job is still running in the pool, so it keeps its slot
+        self.assertEqual(cmd.running, 1)
+        self.assertEqual(self.executors.pending["thread"], 1)
+        self.assertTrue(await self.command(bot, "edi slow"))
+        self.assertEqual(self.posts[-1], '<@U1> command "slow" is busy, try again soon')
+
+        gate.set()
+        await self.until(lambda: cmd.running == 0)
+        self.assertEqual(cmd.running, 0)
+        self.assertEqual(self.executors.pending["thread"], 0)
+
+    @async_test
+    async def test_slot_released(self) -> None:
+        def quick(channel: Channel, user: User, text: str) -> str:
+            return f"quick {text}"
+
+        cmd = Command(
+            "quick", quick, re.compile(r"(.*)"), "", timeout=5, executor="thread"
+        )
+        self.assertTrue(await self.command(self.bot(cmd), "edi quick one"))
+        self.assertEqual(self.posts, ["quick one"])
+        self.assertEqual(cmd.running, 0)
+        await self.until(lambda: self.executors.pending["thread"] == 0)
+        self.assertEqual(self.executors.pending["thread"], 0)
+
+    def submit(self, kind: str, fn: Any) -> Future:
+        """Run jobs for the process pool here, after a round trip through pickle."""
+        self.assertEqual(kind, "process")
+        future: Future = Future()
+        future.set_result(pickle.loads(pickle.dumps(fn))())
+        return future
+
+    def test_process_command_args(self) -> None:
+        with mock.patch.object(self.executors, "submit", self.submit):
+            job = self.executors.run(
+                "process", Blocking().echo, self.channel, self.user, "hi", loud=True
+            )
+        self.assertEqual(job.result(), "general amy HI")
+
+    @async_test
+    async def test_process_handler_args(self) -> None:
+        data = {"type": "message", "channel": "C1", "user": "U1", "text": "hi"}
+        event = Event.generate(data, recursive=False)
+        context = Context(event, self.channel, self.user, "amy")
+
+        unit = Blocking()
+        with mock.patch.object(self.executors, "submit", self.submit):
+            await self.executors.handler("process", unit.on_message, True)(
+                event, context
+            )
+            await self.executors.handler("process", unit.on_legacy, False)(
+                event, context
+            )
+
+        (event1, channel, user, username), (event2,) = CALLS
+        for rebuilt in (event1, event2):
+            self.assertIsInstance(rebuilt, Event)
+            self.assertEqual(rebuilt.type, "message")
+            self.assertEqual(rebuilt.text, "hi")
+            self.assertEqual(rebuilt.user, "U1")
+        self.assertEqual(channel, self.channel)
+        self.assertEqual(user, self.user)
+        self.assertEqual(username, "amy")
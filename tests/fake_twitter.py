@@ -0,0 +1,72 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+"""
+In-process stand-in for the parts of PeonyClient used by the Twitter unit.
+
+Tweets added with `FakeTwitter.tweet()` are served from the home timeline,
+newest first, honoring `since_id` and `count` like the real API, along with
+the rate limit headers in `headers`.
+"""
+
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+
+class Response(list):
+    """List of tweets, with the response headers attached like peony's."""
+
+    def __init__(self, tweets: List[Dict[str, Any]], headers: Dict[str, str]) -> None:
+        super().__init__(tweets)
+        self.headers = headers
+
+
+class Endpoint:
+    def __init__(self, handler: Any) -> None:
+        self.handler = handler
+
+    async def get(self, **kwargs: Any) -> Any:
+        return self.handler(**kwargs)
+
+    async def post(self, **kwargs: Any) -> Any:
+        return self.handler(**kwargs)
+
+
+class FakeTwitter:
+    def __init__(self, screen_name: str = "edi") -> None:
+        self.me = SimpleNamespace(screen_name=screen_name)
+        self.timeline: List[Dict[str, Any]] = []
+        self.requests: List[Dict[str, Any]] = []
+        self.headers: Dict[str, str] = {}
+        self.next_id = 1000
+
+        self.api = SimpleNamespace(
+            statuses=SimpleNamespace(
+                home_timeline=Endpoint(self.home_timeline),
+                update=Endpoint(self.update),
+            )
+        )
+
+    @property
+    async def user(self) -> SimpleNamespace:
+        return self.me
+
+    def tweet(self, screen_name: str, text: str) -> Dict[str, Any]:
+        self.next_id += 1
+        tweet = {
+            "id_str": str(self.next_id),
+            "text": text,
+            "user": {"screen_name": screen_name},
+        }
+        self.timeline.append(tweet)
+        return tweet
+
+    def home_timeline(self, **kwargs: Any) -> Response:
+        self.requests.append(kwargs)
+        since_id = int(kwargs.get("since_id", 0))
+        count = int(kwargs.get("count", 20))
+        tweets = [t for t in reversed(self.timeline) if int(t["id_str"]) > since_id]
+        return Response(tweets[:count], dict(self.headers))
+
+    def update(self, status: str) -> Dict[str, Any]:
+        return self.tweet(self.me.screen_name, status)
@@ -0,0 +1,135 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import random
+from typing import Any, List, Tuple
+from unittest import TestCase
+
+from edi.pool import WorkerPool
+
+from .base import async_test
+
+
+class WorkerPoolTest(TestCase):
+    def setUp(self) -> None:
+        self.handled: List[Any] = []
+        self.gate = asyncio.Event()
+
+    async def handle(self, item: Any) -> None:
+        self.handled.append(item)
+
+    async def blocked(self, item: Any) -> None:
+        await self.gate.wait()
+        self.handled.append(item)
+
+    def test_workers(self) -> None:
+        with self.assertRaises(ValueError):
+            WorkerPool(self.handle, workers=0, maxsize=10)
+
+    @async_test
+    async def test_per_key_order(self) -> None:
+        async def jittery(item: Tuple[str, int]) -> None:
+            await asyncio.sleep(random.random() / 1000)
+            self.handled.append(item)
+
+        pool = WorkerPool(jittery, workers=4, maxsize=100)
+        pool.start()
+        keys = [f"C{i}" for i in range(8)]
+        for n in range(20):
+            for key in keys:
+                await pool.submit(key, (key, n))
+        await pool.join()
+        await pool.stop()
+
+        self.assertEqual(len(self.handled), 160)
+        for key in keys:
+            self.assertEqual(
+                [n for k, n in self.handled if k == key], list(range(20)), key
+            )
+
+    @async_test
+    async def test_keys_in_parallel(self) -> None:
+        slow = "C0"
+        fast = next(
+            key
+            for key in (f"C{i}" for i in range(1, 100))
+            if hash(key) % 2 != hash(slow) % 2
+        )
+
+        async def handler(item: str) -> None:
+            if item == slow:
+                await self.blocked(item)
+            else:
+                await self.handle(item)
+
+        pool = WorkerPool(handler, workers=2, maxsize=10)
+        pool.start()
+        await pool.submit(slow, slow)
+        await pool.submit(fast, fast)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.handled, [fast])
+
+        self.gate.set()
+        await pool.stop()
+        self.assertEqual(self.handled, [fast, slow])
+
+    @async_test
+    async def test_backpressure(self) -> None:
+        pool = WorkerPool(self.blocked, workers=1, maxsize=2)
+        pool.start()
+        await pool.submit("C1", 1)
+        await asyncio.sleep(0)  # taken off the queue by the worker
+
+        await pool.submit("C1", 2)
+        await pool.submit("C1", 3)
+        self.assertEqual(len(pool), 2)
+        waiting = asyncio.ensure_future(pool.submit("C1", 4))
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+
+        self.gate.set()
+        await asyncio.wait_for(waiting, 1)
+        await pool.join()
+        await pool.stop()
+        self.assertEqual(self.handled, [1, 2, 3, 4])
+
+    @async_test
+    async def test_errors(self) -> None:
+        async def handler(item: int) -> None:
+            if item == 2:
+                raise ValueError("nope")
+            self.handled.append(item)
+
+        pool = WorkerPool(handler, workers=1, maxsize=10)
+        pool.start()
+        with self.assertLogs("edi.pool", "ERROR"):
+            for item in range(4):
+                await pool.submit(None, item)
+            await pool.stop()
+        self.assertEqual(self.handled, [0, 1, 3])
+
+    @async_test
+    async def test_stop_drains(self) -> None:
+        pool = WorkerPool(self.handle, workers=2, maxsize=100)
+        pool.start()
+        for item in range(50):
+            await pool.submit(f"C{item % 5}", item)
+        await pool.stop()
+
+        self.assertEqual(sorted(self.handled), list(range(50)))
+        self.assertEqual(pool.tasks, [])
+
+    @async_test
+    async def test_stop_timeout(self) -> None:
+        pool = WorkerPool(self.blocked, workers=1, maxsize=10)
+        pool.start()
+        for item in range(3):
+            await pool.submit("C1", item)
+
+        # items still queued after the timeout are dropped
+        with self.assertLogs("edi.pool", "WARNING"):
+            await pool.stop(timeout=0.05)
+        self.assertEqual(self.handled, [])
+        self.assertEqual(pool.tasks, [])
+        self.assertEqual(len(pool), 2)
@@ -0,0 +1,278 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, List
+from unittest import TestCase
+
+from edi.db import EdiDb, fts_match
+from edi.units.quotes import MIGRATIONS, Quote, QuoteDB, Quotes, Recents
+
+from .base import async_test
+
+
+class RecentsTest(TestCase):
+    def test_get_set(self) -> None:
+        recents = Recents()
+        self.assertIsNone(recents.get("general", "amy"))
+
+        recents.set("general", "amy", "hello")
+        recents.set("general", "amy", "goodbye")
+        self.assertEqual(recents.get("general", "amy"), "goodbye")
+        self.assertIsNone(recents.get("random", "amy"))
+        self.assertEqual(len(recents), 1)
+
+    def test_late_message(self) -> None:
+        recents = Recents()
+        recents.set("general", "amy", "newer", ts=200)
+        recents.set("general", "amy", "older", ts=100)
+        self.assertEqual(recents.get("general", "amy"), "newer")
+
+    def test_evict_per_channel(self) -> None:
+        recents = Recents(per_channel=2)
+        recents.set("general", "amy", "one")
+        recents.set("general", "bob", "two")
+        recents.set("general", "amy", "three")
+        recents.set("random", "cat", "four")
+        recents.set("general", "dan", "five")
+
+        self.assertIsNone(recents.get("general", "bob"))
+        self.assertEqual(recents.get("general", "amy"), "three")
+        self.assertEqual(recents.get("general", "dan"), "five")
+        self.assertEqual(recents.get("random", "cat"), "four")
+        self.assertEqual(recents.evictions, 1)
+
+    def test_evict_bytes(self) -> None:
+        # sizes count the channel and username too
+        recents = Recents(max_bytes=40)
+        recents.set("general", "amy", "x" * 10)
+        recents.set("random", "bob", "y" * 10)
+        self.assertEqual(recents.bytes, 39)
+
+        recents.set("general", "cat", "z" * 10)
+        self.assertIsNone(recents.get("general", "amy"))
+        self.assertEqual(recents.get("general", "cat"), "z" * 10)
+        self.assertEqual(recents.bytes, 39)
+        self.assertEqual(recents.evictions, 1)
+
+    def test_ttl(self) -> None:
+        recents = Recents(ttl=60)
+        now = time.time()
+        recents.set("general", "amy", "stale", ts=now - 120)
+        self.assertIsNone(recents.get("general", "amy"))
+        self.assertEqual(len(recents), 0)
+
+        recents.set("general", "bob", "aging", ts=now - 30)
+        recents.set("general", "cat", "fresh")
+        self.assertEqual(recents.get("general", "bob"), "aging")
+        self.assertEqual(len(recents), 2)
+
+        # expired entries are hidden before they are pruned
+        text, _ts, size = recents.entries[("general", "bob")]
+        recents.entries[("general", "bob")] = (text, now - 90, size)
+        self.assertIsNone(recents.get("general", "bob"))
+        recents.prune()
+        self.assertEqual(len(recents), 1)
+        self.assertEqual(recents.bytes, len("general") + len("cat") + len("fresh"))
+
+    def test_save_load(self) -> None:
+        recents = Recents()
+        recents.set("general", "amy", "hello", ts=100)
+        recents.set("random", "bob", "goodbye", ts=200)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "recents.json"
+            recents.save(path)
+
+            loaded = Recents(per_channel=1)
+            loaded.load(path)
+            loaded.load(Path(tmpdir) / "missing.json")
+
+        self.assertEqual(list(loaded.entries), list(recents.entries))
+        self.assertEqual(loaded.get("random", "bob"), "goodbye")
+
+
+class QuoteDBTest(TestCase):
+    @async_test
+    async def setUp(self) -> None:
+        self.db = EdiDb(":memory:")
+        await self.db.start()
+        self.quotes = QuoteDB(self.db)
+        await self.quotes.start()
+
+    @async_test
+    async def tearDown(self) -> None:
+        await self.db.stop()
+
+    async def add(self, *texts: str, channel: str = "general") -> None:
+        for text in texts:
+            await self.quotes.add(Quote.new(channel, "amy", "bob", text))
+
+    async def search(self, terms: str, channel: str = "general") -> List[str]:
+        return [q.text for q in await self.quotes.search(channel, terms)]
+
+    def test_fts_match(self) -> None:
+        self.assertEqual(fts_match("  "), "")
+        self.assertEqual(fts_match("a  b"), '"a" "b"')
+        self.assertEqual(fts_match('say "hi"'), '"say" """hi"""')
+
+    @async_test
+    async def test_search(self) -> None:
+        await self.add("the quick brown fox", "the lazy dog", "quick quick quick")
+        await self.add("quick elsewhere", channel="random")
+
+        self.assertEqual(await self.search(""), [])
+        self.assertEqual(await self.search("lazy"), ["the lazy dog"])
+        self.assertEqual(await self.search("QUICK fox"), ["the quick brown fox"])
+        self.assertEqual(await self.search("fox dog"), [])
+
+        # best matches first, and only from the channel
+        self.assertEqual(
+            await self.search("quick"), ["quick quick quick", "the quick brown fox"]
+        )
+        self.assertEqual(await self.search("quick", "random"), ["quick elsewhere"])
+
+    @async_test
+    async def test_search_syntax(self) -> None:
+        await self.add('he said "NOT" OR NEAR(this) * ^ : -', "plain text")
+
+        for terms in ('"NOT"', "OR", "NEAR(this)", "*", "^", ":", "-", 'a"b', "AND"):
+            with self.subTest(terms=terms):
+                # never an fts syntax error, and operators are just words
+                results = await self.search(terms)
+                self.assertNotIn("plain text", results)
+
+        self.assertEqual(len(await self.search("OR NEAR")), 1)
+        self.assertEqual(await self.search("text NOT"), [])
+
+    @async_test
+    async def test_fts_rebuild(self) -> None:
+        db = EdiDb(":memory:")
+        await db.start()
+        try:
+            # quotes from before the index existed are indexed by the migration
+            await db.migrate("quotes", MIGRATIONS[:1])
+            await db.execute(
+                "INSERT INTO quotes VALUES (NULL, 'general', 'amy', 'bob', 0, ?)",
+                ["an old quote"],
+            )
+            quotes = QuoteDB(db)
+            await quotes.start()
+            results = await quotes.search("general", "old")
+            self.assertEqual([q.text for q in results], ["an old quote"])
+
+            # and the triggers keep it current afterwards
+            await db.execute("UPDATE quotes SET quote = 'a new quote'")
+            self.assertEqual(await quotes.search("general", "old"), [])
+            self.assertEqual(len(await quotes.search("general", "new")), 1)
+            await db.execute("DELETE FROM quotes")
+            self.assertEqual(await quotes.search("general", "new"), [])
+        finally:
+            await db.stop()
+
+    @async_test
+    async def test_write_behind(self) -> None:
+        quotes = QuoteDB(self.db, write_delay=0.01)
+        transactions = 0
+        transaction = self.db.transaction
+
+        def counted() -> Any:
+            nonlocal transactions
+            transactions += 1
+            return transaction()
+
+        self.db.transaction = counted  # type: ignore
+        added = [Quote.new("general", "amy", "bob", f"quote {i}") for i in range(5)]
+        ids = await asyncio.gather(*[quotes.add(quote) for quote in added])
+
+        self.assertEqual(transactions, 1)
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual([quote.id for quote in added], ids)
+        rows = await self.db.fetchall("SELECT id, quote FROM quotes ORDER BY id")
+        self.assertEqual(rows, [(q.id, q.text) for q in added])
+
+    @async_test
+    async def test_write_behind_stop(self) -> None:
+        quotes = QuoteDB(self.db, write_delay=10)
+        adds = [
+            asyncio.ensure_future(quotes.add(Quote.new("general", "amy", "bob", t)))
+            for t in ("one", "two")
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(len(quotes.pending), 2)
+
+        await asyncio.wait_for(quotes.stop(), 1)
+        self.assertTrue(all(add.done() for add in adds))
+        self.assertEqual(len(await self.search("one")), 1)
+
+    @async_test
+    async def test_write_behind_error(self) -> None:
+        quotes = QuoteDB(self.db, write_delay=0.01)
+        await self.db.execute("DROP TABLE quotes")
+        adds = [quotes.add(Quote.new("general", "amy", "bob", "x")) for _ in range(2)]
+        results = await asyncio.gather(*adds, return_exceptions=True)
+        self.assertTrue(all(isinstance(r, sqlite3.Error) for r in results))
+        self.assertEqual(quotes.pending, [])
+
+    @async_test
+    async def test_random(self) -> None:
+        placeholder = await self.quotes.random("general")
+        self.assertEqual(placeholder.id, 0)
+
+        await self.add("one", "two")
+        await self.quotes.add(Quote.new("general", "amelia", "bob", "three"))
+        await self.add("elsewhere", channel="random")
+
+        seen = {(await self.quotes.random("general")).text for _ in range(50)}
+        self.assertEqual(seen, {"one", "two", "three"})
+
+        for _ in range(5):
+            quote = await self.quotes.random("general", "amelia")
+            self.assertEqual(quote.text, "three")
+            quote = await self.quotes.random("general", "ameliaxyz", fuzz=True)
+            self.assertEqual(quote.text, "three")
+
+    @async_test
+    async def test_random_shuffle(self) -> None:
+        quotes = QuoteDB(self.db, shuffle=True)
+        for text in ("one", "two", "three"):
+            await quotes.add(Quote.new("general", "amy", "bob", text))
+
+        dealt = [(await quotes.random("general")).text for _ in range(2)]
+        # grabbed quotes join the current deck
+        await quotes.add(Quote.new("general", "amy", "bob", "four"))
+        dealt += [(await quotes.random("general")).text for _ in range(2)]
+        self.assertEqual(sorted(dealt), ["four", "one", "three", "two"])
+
+        # and a new deck starts once every quote was shown
+        dealt = [(await quotes.random("general")).text for _ in range(4)]
+        self.assertEqual(sorted(dealt), ["four", "one", "three", "two"])
+
+    @async_test
+    async def test_random_cache_size(self) -> None:
+        quotes = QuoteDB(self.db, id_cache_size=2)
+        await self.add("one")
+        for username in ("amy", "bob", "cat"):
+            await quotes.random("general", username)
+        self.assertEqual(list(quotes.ids), [("general", "bob"), ("general", "cat")])
+
+    @async_test
+    async def test_random_command(self) -> None:
+        unit = Quotes(SimpleNamespace(decode=lambda text, prefix: text))  # type: ignore
+        unit.db = self.quotes
+        channel = SimpleNamespace(name="general")
+        user = SimpleNamespace(name="bob")
+
+        response = await unit.random_quote(channel, user)  # type: ignore
+        self.assertEqual(response, "no quotes found")
+
+        await self.add("hello")
+        response = await unit.random_quote(channel, user, username="amy")  # type: ignore
+        self.assertTrue(response.endswith("<amy> hello"), response)
+        response = await unit.random_quote(channel, user, username="x")  # type: ignore
+        self.assertEqual(response, "no quotes found")
@@ -0,0 +1,120 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+from unittest import TestCase
+
+from edi.sender import RateLimited, Sender
+
+from .base import async_test
+
+
+class FakeSender(Sender):
+    """Sender that records posts instead of calling Slack."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(lambda: None, *args, **kwargs)  # type: ignore
+        self.posts: List[Tuple[float, Dict[str, Any]]] = []
+        self.limits: List[float] = []
+
+    async def api(self, method: str, **kwargs: Any) -> Dict[str, Any]:
+        self.posts.append((time.monotonic(), kwargs))
+        if self.limits:
+            raise RateLimited(self.limits.pop(0))
+        return {"ok": True}
+
+
+class FakeResponse:
+    def __init__(self, status: int, headers: Dict[str, str], body: Any) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    async def __aenter__(self) -> "FakeResponse":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    async def json(self) -> Any:
+        return self.body
+
+
+class SenderTest(TestCase):
+    @async_test
+    async def test_coalesce(self) -> None:
+        sender = FakeSender(interval=0.01)
+        futures = [sender.post("C1", f"line {i}") for i in range(3)]
+        futures.append(sender.post("C1", "thread", thread_ts="1.0"))
+        futures.append(sender.post("C2", "other"))
+        await asyncio.gather(*futures)
+
+        posts = [(p["channel"], p["text"]) for _t, p in sender.posts]
+        self.assertEqual(
+            posts,
+            [("C1", "line 0\nline 1\nline 2"), ("C2", "other"), ("C1", "thread")],
+        )
+        self.assertEqual(sender.posts[2][1]["thread_ts"], "1.0")
+        self.assertEqual(len(sender), 0)
+
+    @async_test
+    async def test_coalesce_limit(self) -> None:
+        sender = FakeSender(interval=0, coalesce=10)
+        await asyncio.gather(*[sender.post("C1", "12345") for _ in range(3)])
+        self.assertEqual([p["text"] for _t, p in sender.posts], ["12345"] * 3)
+
+    @async_test
+    async def test_interval(self) -> None:
+        sender = FakeSender(interval=0.05, coalesce=0)
+        await asyncio.gather(sender.post("C1", "one"), sender.post("C1", "two"))
+        (first, _), (second, _) = sender.posts
+        self.assertGreaterEqual(second - first, 0.045)
+
+    @async_test
+    async def test_retry_after(self) -> None:
+        sender = FakeSender(interval=0, retries=2)
+        sender.limits = [0.1]
+        with self.assertLogs("edi.sender", "WARNING"):
+            await sender.send("C1", "hello")
+
+        (first, _), (second, kwargs) = sender.posts
+        self.assertGreaterEqual(second - first, 0.095)
+        self.assertEqual(kwargs["text"], "hello")
+
+        # messages queued meanwhile wait their turn, and go out together
+        sender.limits = [0.1]
+        with self.assertLogs("edi.sender", "WARNING"):
+            first = sender.post("C1", "one")
+            await asyncio.sleep(0.01)
+            second = sender.post("C1", "two")
+            await asyncio.gather(first, second)
+        (limited, _), (retried, kwargs) = sender.posts[2:4]
+        self.assertGreaterEqual(retried - limited, 0.095)
+        self.assertEqual(kwargs["text"], "one")
+        self.assertEqual(sender.posts[-1][1]["text"], "two")
+
+    @async_test
+    async def test_retries_exhausted(self) -> None:
+        sender = FakeSender(interval=0, retries=1)
+        sender.limits = [0.01, 0.01]
+        with self.assertLogs("edi.sender", "WARNING"):
+            with self.assertRaises(RateLimited):
+                await sender.send("C1", "hello")
+        self.assertEqual(len(sender.posts), 2)
+
+    @async_test
+    async def test_retry_after_header(self) -> None:
+        responses = [
+            FakeResponse(429, {"Retry-After": "7"}, {}),
+            FakeResponse(200, {"Retry-After": "3"}, {"error": "ratelimited"}),
+        ]
+        session = SimpleNamespace(post=lambda url, data: responses.pop(0))
+        sender = Sender(lambda: SimpleNamespace(session=session))  # type: ignore
+
+        for retry_after in (7, 3):
+            with self.assertRaises(RateLimited) as context:
+                await sender.api("chat.postMessage", channel="C1", text="hello")
+            self.assertEqual(context.exception.retry_after, retry_after)
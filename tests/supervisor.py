@@ -0,0 +1,108 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from edi.config import Config
+from edi.supervisor import Supervisor, load_workspace
+
+
+class SupervisorTest(TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "edi.toml"
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def supervisor(self, text: str) -> Supervisor:
+        self.path.write_text(text)
+        return Supervisor(str(self.path), Config.load_from_file(str(self.path)))
+
+    def test_default_paths(self) -> None:
+        supervisor = self.supervisor(
+            """
+            [workspaces.work.bot]
+            token = "a"
+            [workspaces.home.bot]
+            token = "b"
+            """
+        )
+        self.assertEqual(sorted(supervisor.workers), ["home", "work"])
+
+        config = load_workspace(str(self.path), "work")
+        self.assertEqual(config.bot.token, "a")
+        self.assertEqual(config.bot.db_path, "edi-work.db")
+        self.assertEqual(config.chatlog.root, "~/slacklogs-work")
+        self.assertEqual(config.quotes.db_path, "quotes-work.db")
+        self.assertEqual(config.twitter.state_path, "twitter-work.json")
+        self.assertEqual(config.stats.prometheus_path, "")
+
+    def test_explicit_paths(self) -> None:
+        self.supervisor(
+            """
+            [workspaces.work.bot]
+            db_path = "work.db"
+            [workspaces.home.bot]
+            db_path = "home.db"
+            """
+        )
+        config = load_workspace(str(self.path), "home")
+        self.assertEqual(config.bot.db_path, "home.db")
+
+    def test_shared_paths(self) -> None:
+        for table, key in (("chatlog", "root"), ("bot", "db_path")):
+            with self.subTest(setting=f"{table}.{key}"):
+                with self.assertRaisesRegex(ValueError, f"{table}.{key}"):
+                    self.supervisor(
+                        f"""
+                        [{table}]
+                        {key} = "shared"
+                        [workspaces.work.bot]
+                        token = "a"
+                        [workspaces.home.bot]
+                        token = "b"
+                        """
+                    )
+
+    def test_unused_paths(self) -> None:
+        # twitter without credentials never writes its state
+        self.supervisor(
+            """
+            [twitter]
+            state_path = "twitter.json"
+            [workspaces.work.bot]
+            token = "a"
+            [workspaces.home.bot]
+            token = "b"
+            """
+        )
+        with self.assertRaisesRegex(ValueError, "twitter.state_path"):
+            self.supervisor(
+                """
+                [twitter]
+                state_path = "twitter.json"
+                consumer_key = "k"
+                consumer_secret = "s"
+                access_key = "k"
+                access_secret = "s"
+                [workspaces.work.bot]
+                token = "a"
+                [workspaces.home.bot]
+                token = "b"
+                """
+            )
+
+        # nor does a disabled unit
+        self.supervisor(
+            """
+            [chatlog]
+            root = "logs"
+            [workspaces.work.units]
+            disable_units = ["ChatLog"]
+            [workspaces.home.bot]
+            token = "b"
+            """
+        )
@@ -0,0 +1,117 @@
+# Copyright 2018 John Reese
+# Licensed under the MIT license
+
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, List
+from unittest import TestCase
+
+from edi.units.twitter import Twitter, twitter
+
+from .base import async_test
+from .fake_twitter import FakeTwitter
+
+
+class TwitterTest(TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_path = Path(self.tmpdir.name) / "twitter.json"
+        self.client = FakeTwitter()
+        self.announced: List[Any] = []
+        self.unit = self.make_unit()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def make_unit(self) -> Twitter:
+        general = SimpleNamespace(id="C1", name="general")
+        unit = Twitter(SimpleNamespace(channels={"general": general}))  # type: ignore
+        unit.config = twitter(
+            timeline_channels=["general"],
+            state_path=str(self.state_path),
+            poll_min=0.01,
+            poll_max=0.02,
+        )
+        unit.interval = unit.config.poll_min
+        unit.client = self.client
+
+        async def announce(channel: Any, tweet: Any) -> None:
+            self.announced.append((channel.name, tweet.id_str, tweet.text))
+
+        unit.announce = announce  # type: ignore
+        return unit
+
+    async def run_polls(self, unit: Twitter, polls: int) -> None:
+        """Run the timeline loop until it has handled `polls` polls of the client."""
+        # the last poll is only fully handled once the loop polls again
+        target = len(self.client.requests) + polls + 1
+        task = asyncio.ensure_future(unit.timeline())
+        try:
+            while len(self.client.requests) < target:
+                await asyncio.sleep(0.005)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def test_next_interval(self) -> None:
+        unit = self.unit
+        unit.config = twitter(poll_min=10.0, poll_max=100.0)
+
+        unit.interval = 40.0
+        self.assertEqual(unit.next_interval({}, 5), 20.0)
+        unit.interval = 12.0
+        self.assertEqual(unit.next_interval({}, 5), 10.0)
+        unit.interval = 40.0
+        self.assertEqual(unit.next_interval({}, 0), 60.0)
+        unit.interval = 90.0
+        self.assertEqual(unit.next_interval({}, 0), 100.0)
+
+        # never faster than the remaining rate limit allows
+        unit.interval = 10.0
+        reset = str(time.time() + 300)
+        headers = {"x-rate-limit-remaining": "10", "x-rate-limit-reset": reset}
+        self.assertAlmostEqual(unit.next_interval(headers, 5), 30.0, delta=1.0)
+        headers = {"x-rate-limit-remaining": "0", "x-rate-limit-reset": reset}
+        self.assertAlmostEqual(unit.next_interval(headers, 5), 300.0, delta=1.0)
+        headers = {"x-rate-limit-remaining": "many", "x-rate-limit-reset": reset}
+        self.assertEqual(unit.next_interval(headers, 5), 10.0)
+
+    @async_test
+    async def test_announce_in_order(self) -> None:
+        self.client.tweet("someone", "before we started")
+        await self.run_polls(self.unit, 1)
+        self.assertEqual(self.announced, [], "first poll only finds the newest")
+
+        first = self.client.tweet("alice", "one")
+        self.client.tweet("edi", "our own tweet")
+        second = self.client.tweet("bob", "two")
+        third = self.client.tweet("alice", "three")
+        await self.run_polls(self.unit, 1)
+
+        self.assertEqual(
+            self.announced,
+            [
+                ("general", first["id_str"], "one"),
+                ("general", second["id_str"], "two"),
+                ("general", third["id_str"], "three"),
+            ],
+        )
+
+    @async_test
+    async def test_since_id_persisted(self) -> None:
+        self.client.tweet("alice", "one")
+        newest = self.client.tweet("bob", "two")
+        await self.run_polls(self.unit, 1)
+
+        with open(self.state_path) as fd:
+            self.assertEqual(json.load(fd), {"since_id": newest["id_str"]})
+
+        # a restarted unit resumes from the saved id, missing nothing
+        later = self.client.tweet("carol", "three")
+        await self.run_polls(self.make_unit(), 1)
+        self.assertEqual(self.client.requests[-2]["since_id"], newest["id_str"])
+        self.assertEqual(self.announced, [("general", later["id_str"], "three")])